@@ -1,13 +1,60 @@
+import asyncio
 import os
+import json
 import logging
-from flask import Flask, request, jsonify, render_template
+import re
+import sqlite3
+import time
+import uuid
+from flask import (
+    Flask,
+    Response,
+    g,
+    has_request_context,
+    request,
+    jsonify,
+    render_template,
+    stream_with_context,
+    url_for,
+)
+from flask.json.provider import DefaultJSONProvider
+from services.history import get_history_store
+from services.job_queue import QueueFullError
+from services.metrics import metrics
+from services.providers import preload_provider_sdks
+from services.quest_export import encode_quest, export_quest_index
+from services.quest_schema import QUEST_SCHEMA, schema_errors
 from services.quest_generator import (
+    ROUTE_FIELDS,
     create_quest_from_setting,
+    create_quest_hierarchical_async,
+    create_quest_routed_async,
+    generate_quests_batch,
+    get_generation_job,
+    get_provider_status,
+    regenerate_quest_nodes_async,
+    stream_quest_from_setting,
+    submit_generation_job,
     validate_api_key,
     get_available_models,
 )
 
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Сериализация JSON с замером времени для метрик."""
+
+    def dumps(self, obj, **kwargs):
+        endpoint = request.endpoint if has_request_context() else None
+        with metrics.timer("http_response_serialize_seconds", endpoint=endpoint):
+            return super().dumps(obj, **kwargs)
+
+
 app = Flask(__name__, template_folder="templates", static_folder="static")
+app.json = TimedJSONProvider(app)
+
+# SDK провайдеров из LLM_PROVIDERS загружаются сразу (с gunicorn --preload —
+# один раз в мастер-процессе), остальные — при первом запросе.
+preload_provider_sdks()
 
 if __name__ != "__main__":
     gunicorn_logger = logging.getLogger("gunicorn.error")
@@ -22,6 +69,59 @@ if __name__ != "__main__":
     app.logger.info("=" * 60)
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Для потоковых ответов учитывается время до начала отправки тела.
+    started = g.pop("request_started", None)
+    labels = {
+        "endpoint": request.endpoint or "unknown",
+        "method": request.method,
+        "status": response.status_code,
+    }
+    if started is not None:
+        metrics.observe(
+            "http_request_duration_seconds", time.perf_counter() - started, **labels
+        )
+    metrics.inc("http_requests_total", **labels)
+    return response
+
+
+USER_COOKIE = "quest_user"
+USER_COOKIE_MAX_AGE = 365 * 24 * 3600
+_USER_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+CHAT_NOT_FOUND = "Чат не найден."
+
+
+def _user_id():
+    """Анонимный id пользователя из cookie; новый id выдаётся в ответе."""
+    if "user_id" not in g:
+        user_id = request.cookies.get(USER_COOKIE, "")
+        if not _USER_ID_RE.match(user_id):
+            user_id = g.new_user_id = uuid.uuid4().hex
+        g.user_id = user_id
+    return g.user_id
+
+
+@app.after_request
+def set_user_cookie(response):
+    new_user_id = g.pop("new_user_id", None)
+    if new_user_id:
+        response.set_cookie(
+            USER_COOKIE,
+            new_user_id,
+            max_age=USER_COOKIE_MAX_AGE,
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -32,38 +132,465 @@ def settings():
     return render_template("settings.html")
 
 
+def _has_string_fields(data, fields):
+    # Поля попадают в ключ кэша и в запросы к провайдеру, поэтому нужны
+    # непустые строки, как и в пакетной генерации.
+    return isinstance(data, dict) and all(
+        isinstance(data.get(field), str) and data[field] for field in fields
+    )
+
+
+def _has_generate_fields(data):
+    return _has_string_fields(data, ("setting", "api_key", "api_provider", "model"))
+
+
+def _valid_routes(routes):
+    return (
+        isinstance(routes, list)
+        and bool(routes)
+        and all(_has_string_fields(route, ROUTE_FIELDS) for route in routes)
+    )
+
+
+def _hierarchical_options(data):
+    """
+    Параметры двухэтапной генерации из запроса.
+
+    Возвращает {} для обычной генерации и None, если node_count задан неверно.
+    """
+    if not data.get("hierarchical"):
+        return {}
+    node_count = data.get("node_count")
+    max_nodes = int(os.getenv("HIERARCHICAL_MAX_NODES", "300"))
+    if node_count is not None and (
+        not isinstance(node_count, int) or not 3 <= node_count <= max_nodes
+    ):
+        return None
+    return {"hierarchical": True, "node_count": node_count}
+
+
+def _missing_generate_fields_response():
+    return (
+        jsonify(
+            {
+                "error": "Missing 'setting', 'api_key', 'api_provider' or 'model' in request body"
+            }
+        ),
+        400,
+    )
+
+
+def _sse_event(event, data):
+    """Форматирует событие Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.route("/generate", methods=["POST"])
 def generate_quest_endpoint():
+    # Обычная генерация идёт синхронно через клиенты из пула (один на ключ,
+    # с keep-alive соединениями). asyncio нужен только там, где запросы к
+    # провайдерам выполняются параллельно: дублирование маршрутов,
+    # двухэтапная генерация и перегенерация узлов.
     data = request.get_json()
-    if (
-        not data
-        or "setting" not in data
-        or "api_key" not in data
-        or "api_provider" not in data
-        or "model" not in data
-    ):
+    if isinstance(data, dict) and "routes" in data:
+        return _generate_routed(data)
+    if not _has_generate_fields(data):
+        return _missing_generate_fields_response()
+
+    setting = data["setting"]
+    api_key = data["api_key"]
+    api_provider = data["api_provider"]
+    model = data["model"]
+    options = _hierarchical_options(data)
+    if options is None:
+        max_nodes = os.getenv("HIERARCHICAL_MAX_NODES", "300")
+        return (
+            jsonify(
+                {"error": f"'node_count' must be an integer from 3 to {max_nodes}"}
+            ),
+            400,
+        )
+
+    if data.get("background"):
+        # Генерация выполняется в фоне, клиент опрашивает /jobs/<id>.
+        try:
+            job_id = submit_generation_job(
+                setting,
+                api_key,
+                api_provider,
+                model,
+                use_cache=data.get("use_cache", True),
+                **options,
+            )
+        except QueueFullError:
+            return (
+                jsonify({"error": "Очередь генерации переполнена. Попробуйте позже."}),
+                503,
+            )
+        response = jsonify({"job_id": job_id, "status": "pending"})
+        response.headers["Location"] = url_for("job_status_endpoint", job_id=job_id)
+        return response, 202
+
+    if options:
+        quest_json = asyncio.run(
+            create_quest_hierarchical_async(
+                setting,
+                api_key,
+                api_provider,
+                model,
+                node_count=options["node_count"],
+                use_cache=data.get("use_cache", True),
+            )
+        )
+    else:
+        quest_json = create_quest_from_setting(
+            setting, api_key, api_provider, model, use_cache=data.get("use_cache", True)
+        )
+
+    if "error" in quest_json:
+        return jsonify(quest_json), 500
+
+    return jsonify(quest_json)
+
+
+def _generate_routed(data):
+    """Генерация по ранжированному списку маршрутов (см. create_quest_routed_async)."""
+    if not _has_string_fields(data, ("setting",)) or not _valid_routes(data["routes"]):
         return (
             jsonify(
                 {
-                    "error": "Missing 'setting', 'api_key', 'api_provider' or 'model' in request body"
+                    "error": "'routes' must be a non-empty list of objects with 'api_provider', 'model' and 'api_key', and 'setting' is required"
                 }
             ),
             400,
         )
 
-    setting = data["setting"]
-    api_key = data["api_key"]
-    api_provider = data["api_provider"]
-    model = data["model"]
+    quest_json = asyncio.run(
+        create_quest_routed_async(
+            data["setting"], data["routes"], use_cache=data.get("use_cache", True)
+        )
+    )
+    if "error" in quest_json:
+        return jsonify(quest_json), 500
+    return jsonify(quest_json)
 
-    quest_json = create_quest_from_setting(setting, api_key, api_provider, model)
 
+def _regenerate_request_error(data):
+    """Текст ошибки для неверного запроса /generate/nodes или None."""
+    if not data or not all(
+        field in data for field in ("api_key", "api_provider", "model")
+    ):
+        return "Missing 'api_key', 'api_provider' or 'model' in request body"
+    quest = data.get("quest")
+    if not isinstance(quest, dict) or not isinstance(quest.get("nodes"), list):
+        return "'quest' must be an object with a 'nodes' list"
+    errors = schema_errors(quest, QUEST_SCHEMA)
+    if errors:
+        return f"'quest' does not match the quest schema: {'; '.join(errors[:5])}"
+    node_ids = data.get("node_ids")
+    if (
+        not isinstance(node_ids, list)
+        or not node_ids
+        or not all(isinstance(node_id, str) for node_id in node_ids)
+    ):
+        return "'node_ids' must be a non-empty list of strings"
+    known = {node.get("id") for node in quest["nodes"] if isinstance(node, dict)}
+    unknown = [node_id for node_id in node_ids if node_id not in known]
+    if unknown:
+        return f"Unknown node ids: {', '.join(map(str, unknown))}"
+    return None
+
+
+@app.route("/generate/nodes", methods=["POST"])
+def regenerate_nodes_endpoint():
+    """Переписывает выбранные узлы готового квеста, не трогая остальные."""
+    data = request.get_json()
+    error = _regenerate_request_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    quest_json = asyncio.run(
+        regenerate_quest_nodes_async(
+            data["quest"],
+            list(dict.fromkeys(data["node_ids"])),
+            data["api_key"],
+            data["api_provider"],
+            data["model"],
+            instruction=data.get("instruction"),
+        )
+    )
     if "error" in quest_json:
         return jsonify(quest_json), 500
-
     return jsonify(quest_json)
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status_endpoint(job_id):
+    job = get_generation_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/providers/status", methods=["GET"])
+def provider_status_endpoint():
+    return jsonify(get_provider_status())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/generate/stream", methods=["POST"])
+def generate_quest_stream_endpoint():
+    data = request.get_json()
+    if not _has_generate_fields(data):
+        return _missing_generate_fields_response()
+
+    # С chat_id результат сохраняется новой версией квеста в истории чата.
+    chat_id = data.get("chat_id")
+    if chat_id is not None and not isinstance(chat_id, str):
+        return jsonify({"error": "Поле 'chat_id' должно быть строкой."}), 400
+    user_id = _user_id()
+    history = get_history_store()
+    if chat_id and history.get_chat(user_id, chat_id, with_quest=False) is None:
+        return jsonify({"error": CHAT_NOT_FOUND}), 404
+
+    events = stream_quest_from_setting(
+        data["setting"],
+        data["api_key"],
+        data["api_provider"],
+        data["model"],
+        use_cache=data.get("use_cache", True),
+    )
+
+    def generate():
+        for event, payload in events:
+            if event == "result" and chat_id:
+                try:
+                    history.add_version(user_id, chat_id, data["setting"], payload)
+                except sqlite3.Error as e:
+                    app.logger.error(f"Failed to save quest to chat {chat_id}: {e}")
+            yield _sse_event(event, payload)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # Отключаем буферизацию в nginx и кэширование, чтобы события шли сразу.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _chat_fields_error(data):
+    for field in ("title", "setting"):
+        if field in data and not isinstance(data[field], str):
+            return f"Поле '{field}' должно быть строкой."
+    if "quest" in data and not isinstance(data["quest"], dict):
+        return "Поле 'quest' должно быть объектом квеста."
+    return None
+
+
+@app.route("/history/chats", methods=["GET"])
+def list_chats_endpoint():
+    try:
+        chats, next_cursor = get_history_store().list_chats(
+            _user_id(),
+            request.args.get("limit", type=int),
+            request.args.get("cursor"),
+        )
+    except ValueError:
+        return jsonify({"error": "Неверный курсор страницы."}), 400
+    return jsonify({"chats": chats, "next_cursor": next_cursor})
+
+
+@app.route("/history/chats", methods=["POST"])
+def create_chat_endpoint():
+    data = request.get_json(silent=True) or {}
+    error = _chat_fields_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+    chat = get_history_store().create_chat(
+        _user_id(),
+        data.get("title", "").strip() or "Новый чат",
+        data.get("setting", ""),
+        data.get("quest"),
+    )
+    return jsonify(chat), 201
+
+
+@app.route("/history/chats/<chat_id>", methods=["GET"])
+def get_chat_endpoint(chat_id):
+    chat = get_history_store().get_chat(_user_id(), chat_id)
+    if chat is None:
+        return jsonify({"error": CHAT_NOT_FOUND}), 404
+    return jsonify(chat)
+
+
+@app.route("/history/chats/<chat_id>", methods=["PATCH"])
+def update_chat_endpoint(chat_id):
+    data = request.get_json(silent=True) or {}
+    error = _chat_fields_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+    chat = get_history_store().update_chat(
+        _user_id(), chat_id, data.get("title"), data.get("setting")
+    )
+    if chat is None:
+        return jsonify({"error": CHAT_NOT_FOUND}), 404
+    return jsonify(chat)
+
+
+@app.route("/history/chats/<chat_id>", methods=["DELETE"])
+def delete_chat_endpoint(chat_id):
+    if not get_history_store().delete_chat(_user_id(), chat_id):
+        return jsonify({"error": CHAT_NOT_FOUND}), 404
+    return "", 204
+
+
+@app.route("/history/chats/<chat_id>/versions", methods=["GET"])
+def list_versions_endpoint(chat_id):
+    page = get_history_store().list_versions(
+        _user_id(),
+        chat_id,
+        request.args.get("limit", type=int),
+        request.args.get("cursor", type=int),
+    )
+    if page is None:
+        return jsonify({"error": CHAT_NOT_FOUND}), 404
+    versions, next_cursor = page
+    return jsonify({"versions": versions, "next_cursor": next_cursor})
+
+
+@app.route("/history/chats/<chat_id>/versions/<int:version>", methods=["GET"])
+def get_version_endpoint(chat_id, version):
+    quest_version = get_history_store().get_version(_user_id(), chat_id, version)
+    if quest_version is None:
+        return jsonify({"error": "Версия квеста не найдена."}), 404
+    return jsonify(quest_version)
+
+
+EXPORT_FORMATS = ("binary", "json")
+
+
+def _export_response(quest, export_format, filename):
+    """Квест в формате QSTB (binary) или его JSON-вариант для плагинов движков."""
+    if export_format not in EXPORT_FORMATS:
+        return (
+            jsonify({"error": f"'format' must be one of: {', '.join(EXPORT_FORMATS)}"}),
+            400,
+        )
+    if export_format == "json":
+        return jsonify(export_quest_index(quest))
+    return Response(
+        encode_quest(quest),
+        mimetype="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.qstb"'},
+    )
+
+
+@app.route("/export", methods=["POST"])
+def export_quest_endpoint():
+    data = request.get_json(silent=True) or {}
+    quest = data.get("quest")
+    if not isinstance(quest, dict) or not isinstance(quest.get("nodes"), list):
+        return jsonify({"error": "'quest' must be an object with a 'nodes' list"}), 400
+    errors = schema_errors(quest, QUEST_SCHEMA)
+    if errors:
+        return (
+            jsonify(
+                {
+                    "error": "'quest' does not match the quest schema: "
+                    f"{'; '.join(errors[:5])}"
+                }
+            ),
+            400,
+        )
+    return _export_response(quest, data.get("format", "binary"), "quest")
+
+
+@app.route("/history/chats/<chat_id>/export", methods=["GET"])
+def export_chat_endpoint(chat_id):
+    chat = get_history_store().get_chat(_user_id(), chat_id)
+    if chat is None:
+        return jsonify({"error": CHAT_NOT_FOUND}), 404
+    if chat["quest"] is None:
+        return jsonify({"error": "В чате ещё нет квеста."}), 404
+    return _export_response(
+        chat["quest"], request.args.get("format", "binary"), f"quest-{chat_id}"
+    )
+
+
+def _valid_concurrency(value, max_concurrency):
+    return (
+        isinstance(value, int)
+        and not isinstance(value, bool)
+        and 1 <= value <= max_concurrency
+    )
+
+
+def _batch_request_error(data):
+    """
+    Текст ошибки для неверного запроса /generate/batch или None.
+
+    Всё проверяется до начала потока: после статуса 200 об ошибке
+    можно сообщить, только оборвав NDJSON.
+    """
+    settings = data.get("settings") if isinstance(data, dict) else None
+    if not isinstance(settings, list) or not settings:
+        return "Missing 'settings' list in request body"
+    max_items = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+    if len(settings) > max_items:
+        return f"Too many settings in batch (max {max_items})"
+    providers = [data.get("api_provider")] + [
+        item.get("api_provider") for item in settings if isinstance(item, dict)
+    ]
+    if any(
+        provider is not None and not isinstance(provider, str) for provider in providers
+    ):
+        return "'api_provider' must be a string"
+
+    concurrency = data.get("concurrency")
+    max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+    if concurrency is None or _valid_concurrency(concurrency, max_concurrency):
+        return None
+    if isinstance(concurrency, dict) and all(
+        isinstance(provider, str) and _valid_concurrency(limit, max_concurrency)
+        for provider, limit in concurrency.items()
+    ):
+        return None
+    return (
+        f"'concurrency' must be an integer from 1 to {max_concurrency} "
+        "or an object mapping providers to such integers"
+    )
+
+
+@app.route("/generate/batch", methods=["POST"])
+def generate_quest_batch_endpoint():
+    data = request.get_json()
+    error = _batch_request_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    settings = data["settings"]
+    results = generate_quests_batch(
+        settings,
+        defaults={
+            field: data[field]
+            for field in ("api_key", "api_provider", "model")
+            if field in data
+        },
+        concurrency=data.get("concurrency"),
+        use_cache=data.get("use_cache", True),
+    )
+
+    def generate():
+        for item in results:
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @app.route("/validate_api_key", methods=["POST"])
 def validate_api_key_endpoint():
     data = request.get_json()
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Tuple
+
+
+def hash_api_key(api_key: str) -> str:
+    """Возвращает SHA-256 хэш ключа, чтобы не хранить ключи в открытом виде."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class ClientPool:
+    """
+    Потокобезопасный LRU/TTL-реестр клиентов провайдеров.
+
+    Клиенты хранятся по ключу (provider, sha256(api_key)) и переиспользуются
+    между запросами внутри одного воркера, поэтому keep-alive соединения
+    и TLS-сессии не создаются заново на каждый запрос. Вытесненные клиенты
+    не закрываются явно: они могут ещё обслуживать запрос в другом потоке,
+    соединения закрываются сборщиком мусора.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 64,
+        ttl: float = 900.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[Tuple[str, str], Tuple[Any, float]]" = OrderedDict()
+
+    def get(self, provider: str, api_key: str, factory: Callable[[str], Any]) -> Any:
+        """Возвращает клиент из пула или создаёт новый через `factory(api_key)`."""
+        key = (provider, hash_api_key(api_key))
+        now = self._clock()
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._clients[key] = (entry[0], now)
+                self._clients.move_to_end(key)
+                return entry[0]
+            self._clients.pop(key, None)
+
+        # Клиент создаётся вне блокировки: конструкторы SDK могут быть медленными.
+        client = factory(api_key)
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                # Другой поток успел создать клиент раньше — используем его.
+                self._clients.move_to_end(key)
+                return entry[0]
+            self._clients[key] = (client, now)
+            self._evict(now)
+        return client
+
+    def _evict(self, now: float) -> None:
+        expired = [k for k, (_, used) in self._clients.items() if now - used > self.ttl]
+        for k in expired:
+            del self._clients[k]
+        while len(self._clients) > self.max_size:
+            self._clients.popitem(last=False)
+
+    def clear(self) -> None:
+        """Удаляет все клиенты из пула."""
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+
+default_pool = ClientPool(
+    max_size=int(os.getenv("CLIENT_POOL_SIZE", "64")),
+    ttl=float(os.getenv("CLIENT_POOL_TTL", "900")),
+)
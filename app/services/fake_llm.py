@@ -0,0 +1,389 @@
+"""
+Локальный OpenAI-совместимый сервер с поддельной моделью.
+
+Нужен для нагрузочного тестирования и бенчмарков без сети: провайдер
+"fake" в quest_generator ходит сюда через настоящий клиент OpenAI, поэтому
+пул клиентов, лимиты, повторы и потоковый режим работают как с реальным API.
+
+Запуск (из каталога app):
+
+    python -m services.fake_llm --port 8089
+
+Поведение настраивается переменными окружения FAKE_LLM_* (см. FakeLLMConfig).
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from services.prompts import (
+    EXPAND_TEMPLATE,
+    OUTLINE_TEMPLATE,
+    QUEST_TEMPLATE,
+    REGENERATE_TEMPLATE,
+    REPAIR_TEMPLATE,
+)
+
+DEFAULT_MODEL = "fake-quest"
+INVALID_API_KEY = "invalid-key"
+
+# Шаблон промпта узнаётся по имени схемы ответа, а без структурированного
+# вывода — по системному сообщению.
+_TEMPLATE_BY_SYSTEM = {
+    template.system: template.name
+    for template in (
+        QUEST_TEMPLATE,
+        OUTLINE_TEMPLATE,
+        EXPAND_TEMPLATE,
+        REPAIR_TEMPLATE,
+        REGENERATE_TEMPLATE,
+    )
+}
+
+
+@dataclass
+class FakeLLMConfig:
+    """
+    Параметры поддельной модели.
+
+    Задержка до первого токена распределена логнормально с медианой
+    latency и параметром latency_sigma (0 — постоянная задержка); затем
+    текст отдаётся со скоростью tokens_per_second (~4 символа на токен).
+    error_rate и rate_limit_rate — доли запросов, на которые сервер
+    отвечает 500 и 429. node_count и description_words задают размер квеста.
+    """
+
+    latency: float = 0.2
+    latency_sigma: float = 0.0
+    tokens_per_second: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    node_count: int = 8
+    description_words: int = 30
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeLLMConfig":
+        def env(name: str, default: Any) -> Any:
+            return type(default)(os.getenv(f"FAKE_LLM_{name.upper()}", default))
+
+        return cls(**{name: env(name, value) for name, value in vars(cls()).items()})
+
+
+_WORDS = (
+    "туман дорога башня лес река меч свиток страж тень огонь ключ врата "
+    "руины дракон карта шёпот буря камень тропа лагерь"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def fake_quest(
+    setting: str, node_count: int, description_words: int = 30
+) -> Dict[str, Any]:
+    """
+    Детерминированный корректный квест из node_count узлов для сеттинга.
+
+    Узлы идут цепочкой, из каждого есть выход в поражение, а последний
+    узел цепочки ведёт к победе.
+    """
+    rng = random.Random(setting)
+    count = max(node_count, 3)
+    nodes = []
+    for i in range(count - 2):
+        following = f"scene_{i + 2}" if i < count - 3 else "victory"
+        nodes.append(
+            {
+                "id": f"scene_{i + 1}",
+                "title": f"Сцена {i + 1}",
+                "type": "CHOICE",
+                "description": _text(rng, description_words),
+                "choices": [
+                    {"text": _text(rng, 3), "targetNodeId": following},
+                    {"text": _text(rng, 3), "targetNodeId": "defeat"},
+                ],
+            }
+        )
+    nodes.append(
+        {
+            "id": "victory",
+            "title": "Победа",
+            "type": "ENDING_SUCCESS",
+            "description": _text(rng, description_words),
+            "choices": [],
+        }
+    )
+    nodes.append(
+        {
+            "id": "defeat",
+            "title": "Поражение",
+            "type": "ENDING_FAILURE",
+            "description": _text(rng, description_words),
+            "choices": [],
+        }
+    )
+    return {
+        "questTitle": f"Квест {rng.randint(1, 999)}",
+        "startNodeId": "scene_1",
+        "nodes": nodes,
+    }
+
+
+def _outline(setting: str, node_count: int) -> Dict[str, Any]:
+    quest = fake_quest(setting, node_count, 0)
+    for node in quest["nodes"]:
+        del node["description"]
+        node["choices"] = [
+            {"targetNodeId": choice["targetNodeId"]} for choice in node["choices"]
+        ]
+    return quest
+
+
+def _expansion(text: str, words: int) -> Dict[str, Any]:
+    # Строки вида "- id: Название (ТИП); переходы: a (А), b (Б)".
+    rng = random.Random(text)
+    nodes = []
+    for node_id, exits in re.findall(r"^- (\S+):.*?переходы: (.*)$", text, re.M):
+        targets = re.findall(r"(\S+) \(", exits)
+        nodes.append(
+            {
+                "id": node_id,
+                "description": _text(rng, words),
+                "choices": [
+                    {"text": _text(rng, 3), "targetNodeId": target}
+                    for target in targets
+                ],
+            }
+        )
+    return {"nodes": nodes}
+
+
+def _rewritten_nodes(text: str, words: int) -> Dict[str, Any]:
+    # Узлы для перегенерации передаются в промпте JSON-массивом.
+    rng = random.Random(text)
+    for line in text.splitlines():
+        if line.startswith("["):
+            try:
+                nodes = json.loads(line)
+            except ValueError:
+                continue
+            for node in nodes:
+                node["description"] = _text(rng, words)
+            return {"nodes": nodes}
+    return {"nodes": []}
+
+
+def _answer(body: Dict[str, Any], config: FakeLLMConfig) -> str:
+    """Ответ модели на запрос chat.completions по имени схемы ответа."""
+    messages = body.get("messages") or []
+    roles = [message.get("role") for message in messages]
+    if "assistant" in roles:
+        # Продолжение оборванного ответа: ответ детерминирован, поэтому
+        # достаточно отдать его хвост после уже полученной части.
+        position = roles.index("assistant")
+        partial = messages[position]["content"]
+        full = _answer({"messages": messages[:position]}, config)
+        offset = len(partial)
+        return full[offset:] if full.startswith(partial) else ""
+    user = next(
+        (m["content"] for m in reversed(messages) if m.get("role") == "user"), ""
+    )
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    schema = (body.get("response_format") or {}).get("json_schema") or {}
+    kind = schema.get("name") or _TEMPLATE_BY_SYSTEM.get(system, QUEST_TEMPLATE.name)
+    if kind == "outline":
+        match = re.search(r"примерно из (\d+)", user)
+        count = int(match.group(1)) if match else config.node_count
+        value = _outline(user, count)
+    elif kind == "expand":
+        value = _expansion(user, config.description_words)
+    elif kind in ("repair", "regenerate"):
+        value = _rewritten_nodes(user, config.description_words)
+    else:
+        value = fake_quest(user, config.node_count, config.description_words)
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r".{1,4}", text, re.S)
+
+
+class FakeLLM:
+    """Состояние сервера: настройки и счётчик запросов для воспроизводимости."""
+
+    def __init__(self, config: FakeLLMConfig):
+        self.config = config
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _rng(self) -> random.Random:
+        # Случайности запроса зависят только от seed и номера запроса.
+        with self._lock:
+            number = next(self._counter)
+        return random.Random(f"{self.config.seed}:{number}")
+
+    def plan(self) -> Tuple[Optional[int], float]:
+        """(код ошибки или None, задержка до первого токена) для нового запроса."""
+        rng = self._rng()
+        roll = rng.random()
+        if roll < self.config.rate_limit_rate:
+            return 429, 0.0
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            return 500, self.config.latency
+        latency = self.config.latency
+        if self.config.latency_sigma > 0:
+            latency *= rng.lognormvariate(0, self.config.latency_sigma)
+        return None, latency
+
+    def pause(self, tokens: int) -> float:
+        if self.config.tokens_per_second <= 0:
+            return 0.0
+        return tokens / self.config.tokens_per_second
+
+
+def _error(status: int, message: str, kind: str, headers=None) -> Response:
+    response = jsonify({"error": {"message": message, "type": kind}})
+    response.status_code = status
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    return response
+
+
+def create_app(config: Optional[FakeLLMConfig] = None) -> Flask:
+    """Flask-приложение с эндпоинтами /v1/chat/completions и /v1/models."""
+    app = Flask(__name__)
+    llm = FakeLLM(config or FakeLLMConfig.from_env())
+    app.config["FAKE_LLM"] = llm
+
+    @app.before_request
+    def check_api_key():
+        if request.headers.get("Authorization") == f"Bearer {INVALID_API_KEY}":
+            return _error(401, "Invalid API key", "invalid_request_error")
+        return None
+
+    @app.route("/v1/models", methods=["GET"])
+    def list_models():
+        return jsonify(
+            {
+                "object": "list",
+                "data": [{"id": DEFAULT_MODEL, "object": "model", "owned_by": "fake"}],
+            }
+        )
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    def chat_completions():
+        body = request.get_json(force=True)
+        status, latency = llm.plan()
+        time.sleep(latency)
+        if status == 429:
+            retry_after = str(llm.config.retry_after)
+            return _error(
+                429,
+                f"Rate limit reached. Please try again in {retry_after}s",
+                "rate_limit_exceeded",
+                {"retry-after": retry_after, "x-ratelimit-remaining-requests": "0"},
+            )
+        if status == 500:
+            return _error(500, "Injected server error", "server_error")
+
+        tokens = _tokens(_answer(body, llm.config))
+        limit = body.get("max_completion_tokens") or body.get("max_tokens")
+        finish_reason = "stop"
+        if limit and len(tokens) > limit:
+            tokens, finish_reason = tokens[:limit], "length"
+        prompt_tokens = (
+            sum(len(str(m.get("content", ""))) for m in body.get("messages") or []) // 4
+        )
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "created": int(time.time()),
+            "model": body.get("model", DEFAULT_MODEL),
+        }
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        if body.get("stream"):
+            if not (body.get("stream_options") or {}).get("include_usage"):
+                usage = None
+            return Response(
+                stream_with_context(_stream(llm, base, tokens, finish_reason, usage)),
+                mimetype="text/event-stream",
+            )
+
+        time.sleep(llm.pause(len(tokens)))
+        return jsonify(
+            {
+                **base,
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(tokens)},
+                        "finish_reason": finish_reason,
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    return app
+
+
+def _stream(
+    llm: FakeLLM,
+    base: Dict[str, Any],
+    tokens: List[str],
+    finish_reason: str,
+    usage: Optional[Dict[str, int]],
+) -> Iterator[str]:
+    def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> str:
+        data = {
+            **base,
+            "object": "chat.completion.chunk",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    for token in tokens:
+        time.sleep(llm.pause(1))
+        yield chunk({"content": token})
+    yield chunk({}, finish_reason)
+    if usage is not None:
+        # Как у OpenAI со stream_options.include_usage: отдельный фрагмент
+        # без choices.
+        data = {
+            **base,
+            "object": "chat.completion.chunk",
+            "choices": [],
+            "usage": usage,
+        }
+        yield f"data: {json.dumps(data)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    create_app().run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
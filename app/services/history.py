@@ -0,0 +1,298 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+_CHAT_FIELDS = "id, title, setting, versions, created_at, updated_at"
+
+
+def _chat(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    chat_id, title, setting, versions, created_at, updated_at = row
+    return {
+        "id": chat_id,
+        "title": title,
+        "setting": setting,
+        "versions": versions,
+        "created_at": created_at,
+        "updated_at": updated_at,
+    }
+
+
+def _page_size(limit: Optional[int]) -> int:
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def _parse_chat_cursor(cursor: str) -> Tuple[float, str]:
+    # Курсор — "<updated_at>:<id>" последнего чата предыдущей страницы.
+    updated_at, _, chat_id = cursor.partition(":")
+    if not chat_id:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return float(updated_at), chat_id
+
+
+class HistoryStore:
+    """
+    История чатов и версий квестов пользователя в SQLite.
+
+    Список чатов отдаётся страницами без тел квестов, по курсору
+    (updated_at, id), поэтому запрос страницы идёт по индексу и не
+    зависит от её номера. Квест целиком читается только по запросу
+    конкретного чата или версии. Все методы принимают user_id и не
+    видят чужие чаты.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.owner = os.getpid()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chats ("
+                "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, title TEXT NOT NULL, "
+                "setting TEXT NOT NULL DEFAULT '', "
+                "versions INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chats_user_updated "
+                "ON chats (user_id, updated_at, id)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quest_versions ("
+                "chat_id TEXT NOT NULL, version INTEGER NOT NULL, "
+                "setting TEXT NOT NULL, quest TEXT NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (chat_id, version))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _owned(self, conn: sqlite3.Connection, user_id: str, chat_id: str) -> bool:
+        return (
+            conn.execute(
+                "SELECT 1 FROM chats WHERE id = ? AND user_id = ?", (chat_id, user_id)
+            ).fetchone()
+            is not None
+        )
+
+    def create_chat(
+        self,
+        user_id: str,
+        title: str,
+        setting: str = "",
+        quest: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Создаёт чат; если передан quest, он становится первой версией."""
+        now = time.time()
+        chat_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO chats (id, user_id, title, setting, versions, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, 0, ?, ?)",
+                (chat_id, user_id, title, setting, now, now),
+            )
+        chat = _chat((chat_id, title, setting, 0, now, now))
+        if quest is not None:
+            version = self.add_version(user_id, chat_id, setting, quest)
+            if version is not None:
+                chat.update(versions=1, updated_at=version["created_at"])
+        return chat
+
+    def list_chats(
+        self, user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Страница чатов от недавно изменённых к старым и курсор следующей.
+
+        Чаты отдаются без setting и тел квестов. ValueError — неверный курсор.
+        """
+        size = _page_size(limit)
+        query = f"SELECT {_CHAT_FIELDS} FROM chats WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if cursor:
+            updated_at, chat_id = _parse_chat_cursor(cursor)
+            query += " AND (updated_at < ? OR (updated_at = ? AND id < ?))"
+            params += [updated_at, updated_at, chat_id]
+        query += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        params.append(size + 1)
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        chats = [_chat(row) for row in rows[:size]]
+        for chat in chats:
+            del chat["setting"]
+        next_cursor = None
+        if len(rows) > size:
+            last = chats[-1]
+            next_cursor = f"{last['updated_at']!r}:{last['id']}"
+        return chats, next_cursor
+
+    def get_chat(
+        self, user_id: str, chat_id: str, with_quest: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """Чат с последней версией квеста (quest — None, если версий нет)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {_CHAT_FIELDS} FROM chats WHERE id = ? AND user_id = ?",
+                (chat_id, user_id),
+            ).fetchone()
+            if row is None:
+                return None
+            chat = _chat(row)
+            if with_quest:
+                latest = conn.execute(
+                    "SELECT quest FROM quest_versions WHERE chat_id = ? "
+                    "ORDER BY version DESC LIMIT 1",
+                    (chat_id,),
+                ).fetchone()
+                chat["quest"] = json.loads(latest[0]) if latest else None
+        return chat
+
+    def update_chat(
+        self,
+        user_id: str,
+        chat_id: str,
+        title: Optional[str] = None,
+        setting: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Меняет название и/или сеттинг чата; None — чат не найден."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE chats SET title = COALESCE(?, title), "
+                "setting = COALESCE(?, setting), updated_at = ? "
+                "WHERE id = ? AND user_id = ?",
+                (title, setting, time.time(), chat_id, user_id),
+            )
+        if cursor.rowcount == 0:
+            return None
+        return self.get_chat(user_id, chat_id, with_quest=False)
+
+    def delete_chat(self, user_id: str, chat_id: str) -> bool:
+        with self._connect() as conn:
+            if not self._owned(conn, user_id, chat_id):
+                return False
+            conn.execute("DELETE FROM quest_versions WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+        return True
+
+    def add_version(
+        self, user_id: str, chat_id: str, setting: str, quest: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Сохраняет новую версию квеста чата; None — чат не найден."""
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE: номер версии не достанется двум воркерам сразу.
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT versions FROM chats WHERE id = ? AND user_id = ?",
+                (chat_id, user_id),
+            ).fetchone()
+            if row is None:
+                return None
+            version = row[0] + 1
+            conn.execute(
+                "INSERT INTO quest_versions (chat_id, version, setting, quest, "
+                "created_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, version, setting, json.dumps(quest, ensure_ascii=False), now),
+            )
+            conn.execute(
+                "UPDATE chats SET versions = ?, setting = ?, updated_at = ? "
+                "WHERE id = ?",
+                (version, setting, now, chat_id),
+            )
+        return {"chat_id": chat_id, "version": version, "created_at": now}
+
+    def list_versions(
+        self,
+        user_id: str,
+        chat_id: str,
+        limit: Optional[int] = None,
+        cursor: Optional[int] = None,
+    ) -> Optional[Tuple[List[Dict[str, Any]], Optional[int]]]:
+        """
+        Страница версий чата от новых к старым без тел квестов.
+
+        cursor — номер версии, с которой (не включая) начинается страница.
+        None — чат не найден.
+        """
+        size = _page_size(limit)
+        query = (
+            "SELECT version, setting, created_at FROM quest_versions WHERE chat_id = ?"
+        )
+        params: List[Any] = [chat_id]
+        if cursor is not None:
+            query += " AND version < ?"
+            params.append(cursor)
+        query += " ORDER BY version DESC LIMIT ?"
+        params.append(size + 1)
+        with self._connect() as conn:
+            if not self._owned(conn, user_id, chat_id):
+                return None
+            rows = conn.execute(query, params).fetchall()
+        versions = [
+            {"version": version, "setting": setting, "created_at": created_at}
+            for version, setting, created_at in rows[:size]
+        ]
+        next_cursor = versions[-1]["version"] if len(rows) > size else None
+        return versions, next_cursor
+
+    def get_version(
+        self, user_id: str, chat_id: str, version: int
+    ) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            if not self._owned(conn, user_id, chat_id):
+                return None
+            row = conn.execute(
+                "SELECT setting, quest, created_at FROM quest_versions "
+                "WHERE chat_id = ? AND version = ?",
+                (chat_id, version),
+            ).fetchone()
+        if row is None:
+            return None
+        setting, quest, created_at = row
+        return {
+            "chat_id": chat_id,
+            "version": version,
+            "setting": setting,
+            "quest": json.loads(quest),
+            "created_at": created_at,
+        }
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM quest_versions")
+            conn.execute("DELETE FROM chats")
+
+
+_history: Optional[HistoryStore] = None
+_history_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """Хранилище истории процесса (HISTORY_DB), создаётся заново после fork."""
+    global _history
+    db_path = os.getenv(
+        "HISTORY_DB", os.path.join(tempfile.gettempdir(), "quest_history.db")
+    )
+    with _history_lock:
+        if (
+            _history is None
+            or _history.owner != os.getpid()
+            or _history.db_path != db_path
+        ):
+            _history = HistoryStore(db_path)
+        return _history
@@ -0,0 +1,299 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+from services.processes import pid_alive
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+TIMEOUT_ERROR = "Превышено время выполнения задачи."
+ORPHANED_ERROR = "Задача прервана перезапуском сервера. Повторите запрос."
+
+
+class QueueFullError(Exception):
+    """Очередь задач заполнена."""
+
+
+class JobQueue:
+    """
+    Очередь фоновых генераций на SQLite с локальным пулом воркеров.
+
+    Статусы и результаты задач хранятся в базе, поэтому `/jobs/<id>` отвечает
+    из любого воркера gunicorn. API-ключи в базу не пишутся: они хранятся
+    только в памяти процесса, который принял задачу, и этот же процесс её
+    выполняет. Задачи процесса, который завершился, помечаются как
+    прерванные при запуске очереди в другом процессе.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        runner: Callable[[Dict[str, Any]], Dict[str, Any]],
+        workers: int = 4,
+        max_depth: int = 100,
+        job_timeout: float = 300.0,
+        retention: float = 86400.0,
+        poll_interval: float = 1.0,
+    ):
+        self.db_path = db_path
+        self.runner = runner
+        self.workers = workers
+        self.max_depth = max_depth
+        self.job_timeout = job_timeout
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.owner = os.getpid()
+        self._secrets: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads: list = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, owner INTEGER NOT NULL, "
+                "payload TEXT NOT NULL, result TEXT, error TEXT, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_owner_status "
+                "ON jobs (owner, status, created_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def start(self) -> None:
+        """Запускает воркеры (повторный вызов ничего не делает)."""
+        with self._lock:
+            if self._threads:
+                return
+            self._recover_orphans()
+            # Отдельный пул исполняет сами генерации, чтобы воркер мог
+            # прекратить ожидание по таймауту.
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="job-runner"
+            )
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop, name=f"job-worker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Останавливает воркеры после завершения текущих задач."""
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, payload: Dict[str, Any], secrets: Dict[str, Any]) -> str:
+        """Ставит задачу в очередь и возвращает её id."""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished_at < ?", (now - self.retention,)
+            )
+            (depth,) = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE owner = ? AND status IN (?, ?)",
+                (self.owner, PENDING, RUNNING),
+            ).fetchone()
+            if depth >= self.max_depth:
+                raise QueueFullError(f"Job queue is full ({self.max_depth})")
+            with self._lock:
+                self._secrets[job_id] = secrets
+            conn.execute(
+                "INSERT INTO jobs (id, status, owner, payload, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    PENDING,
+                    self.owner,
+                    json.dumps(payload, ensure_ascii=False),
+                    now,
+                ),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает статус задачи и, если она завершена, результат или ошибку."""
+        row = (
+            self._connect()
+            .execute(
+                "SELECT status, result, error, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        status, result, error, created_at, started_at, finished_at = row
+        job: Dict[str, Any] = {
+            "id": job_id,
+            "status": status,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+        if result is not None:
+            job["result"] = json.loads(result)
+        if error is not None:
+            job["error"] = error
+        return job
+
+    def _recover_orphans(self) -> None:
+        conn = self._connect()
+        owners = conn.execute(
+            "SELECT DISTINCT owner FROM jobs WHERE status IN (?, ?) AND owner != ?",
+            (PENDING, RUNNING, self.owner),
+        ).fetchall()
+        for (owner,) in owners:
+            if not pid_alive(owner):
+                with conn:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                        "WHERE owner = ? AND status IN (?, ?)",
+                        (FAILED, ORPHANED_ERROR, time.time(), owner, PENDING, RUNNING),
+                    )
+
+    def _claim(self) -> Optional[str]:
+        conn = self._connect()
+        with conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE owner = ? AND status = ? "
+                "ORDER BY created_at LIMIT 1) AND status = ? RETURNING id",
+                (RUNNING, self.owner, PENDING, PENDING),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _finish(self, job_id: str, result: Optional[Dict], error: Optional[str]):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                "WHERE id = ?",
+                (
+                    FAILED if error else DONE,
+                    json.dumps(result, ensure_ascii=False) if result else None,
+                    error,
+                    time.time(),
+                    job_id,
+                ),
+            )
+
+    def _mark_started(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET started_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+    @staticmethod
+    def _drop_late_result(job_id: str) -> None:
+        logger.warning(f"Job {job_id} finished after its timeout, result dropped")
+
+    def _worker_loop(self) -> None:
+        while not self._stopped.is_set():
+            job_id = self._claim()
+            if job_id is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job_id)
+
+    def _run(self, job_id: str) -> None:
+        (payload,) = (
+            self._connect()
+            .execute("SELECT payload FROM jobs WHERE id = ?", (job_id,))
+            .fetchone()
+        )
+        with self._lock:
+            secrets = self._secrets.pop(job_id, None)
+        if secrets is None:
+            self._finish(job_id, None, ORPHANED_ERROR)
+            return
+
+        assert self._executor is not None
+        job = {**json.loads(payload), **secrets}
+        started = threading.Event()
+
+        def run() -> Dict[str, Any]:
+            started.set()
+            return self.runner(job)
+
+        future = self._executor.submit(run)
+        # Поток пула может быть ещё занят генерацией, которую бросили по
+        # таймауту, поэтому время задачи отсчитывается от её фактического старта.
+        while not started.wait(self.poll_interval):
+            if self._stopped.is_set() and future.cancel():
+                self._finish(job_id, None, ORPHANED_ERROR)
+                return
+        self._mark_started(job_id)
+        try:
+            result = future.result(timeout=self.job_timeout)
+        except FutureTimeoutError:
+            # Поток генерации нельзя прервать: задача сразу получает статус
+            # ошибки, а результат, если он всё же придёт, отбрасывается.
+            future.cancel()
+            future.add_done_callback(lambda _: self._drop_late_result(job_id))
+            logger.error(f"Job {job_id} timed out after {self.job_timeout}s")
+            self._finish(job_id, None, TIMEOUT_ERROR)
+            return
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self._finish(job_id, None, str(e))
+            return
+
+        if "error" in result:
+            self._finish(job_id, None, result["error"])
+        else:
+            self._finish(job_id, result, None)
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue(runner: Callable[[Dict[str, Any]], Dict[str, Any]]) -> JobQueue:
+    """Возвращает очередь процесса, создавая и запуская её при первом вызове."""
+    global _job_queue
+    with _job_queue_lock:
+        # Очередь создаётся лениво и заново после fork, чтобы воркеры
+        # gunicorn не делили потоки и соединения родительского процесса.
+        if _job_queue is None or _job_queue.owner != os.getpid():
+            _job_queue = JobQueue(
+                os.getenv(
+                    "JOB_QUEUE_DB", os.path.join(tempfile.gettempdir(), "quest_jobs.db")
+                ),
+                runner,
+                workers=int(os.getenv("JOB_WORKERS", "4")),
+                max_depth=int(os.getenv("JOB_QUEUE_MAX_DEPTH", "100")),
+                job_timeout=float(os.getenv("JOB_TIMEOUT", "300")),
+            )
+            _job_queue.start()
+        return _job_queue
@@ -0,0 +1,234 @@
+import json
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Символы, которые меняют состояние разбора; остальной текст пропускается.
+_STRUCTURAL = re.compile(r'["\\{}\[\]:,]')
+
+
+class QuestNodeStreamParser:
+    """
+    Инкрементальный разбор JSON квеста, приходящего по частям.
+
+    Парсер отслеживает строки и вложенность скобок и возвращает каждый
+    объект из массива "nodes", как только его закрывающая скобка получена.
+    Каждый фрагмент просматривается один раз: парсер хранит только куски
+    незавершённых узла и строки, а весь текст собирается в `text` по запросу.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_parts: List[str] = []
+        self._last_string: Optional[str] = None
+        # Стек открытых контейнеров: (скобка, ключ, под которым контейнер открыт).
+        self._stack: List[tuple] = []
+        self._pending_key: Optional[str] = None
+        self._in_node = False
+        self._node_parts: List[str] = []
+
+    @property
+    def text(self) -> str:
+        """Весь полученный текст."""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Добавляет фрагмент текста и возвращает узлы, завершённые в нём."""
+        self._chunks.append(chunk)
+        nodes = []
+        string_from = 0
+        node_from = 0
+        # Экранированный символ пропускается, даже если он пришёл в начале
+        # следующего фрагмента.
+        skip_to = 1 if self._escape else 0
+        self._escape = False
+        for match in _STRUCTURAL.finditer(chunk):
+            i = match.start()
+            if i < skip_to:
+                continue
+            ch = match.group()
+            if self._in_string:
+                if ch == "\\":
+                    skip_to = i + 2
+                    self._escape = skip_to > len(chunk)
+                elif ch == '"':
+                    self._in_string = False
+                    self._string_parts.append(chunk[string_from:i])
+                    self._last_string = "".join(self._string_parts)
+                    self._string_parts = []
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                string_from = i + 1
+            elif ch == ":":
+                self._pending_key = self._last_string
+            elif ch == ",":
+                self._pending_key = None
+            elif ch in "{[":
+                if ch == "{" and self._in_nodes_array():
+                    self._in_node = True
+                    node_from = i
+                key = self._pending_key if self._stack_top() == "{" else None
+                self._stack.append((ch, key))
+                self._pending_key = None
+            elif ch in "}]" and self._stack:
+                self._stack.pop()
+                if ch == "}" and self._in_node and self._in_nodes_array():
+                    end = i + 1
+                    self._node_parts.append(chunk[node_from:end])
+                    node = self._decode("".join(self._node_parts))
+                    if node is not None:
+                        nodes.append(node)
+                    self._node_parts = []
+                    self._in_node = False
+        if self._in_string:
+            self._string_parts.append(chunk[string_from:])
+        if self._in_node:
+            self._node_parts.append(chunk[node_from:])
+        return nodes
+
+    def _stack_top(self) -> Optional[str]:
+        return self._stack[-1][0] if self._stack else None
+
+    def _in_nodes_array(self) -> bool:
+        # Массив "nodes" должен лежать непосредственно в корневом объекте.
+        return (
+            len(self._stack) == 2
+            and self._stack[0][0] == "{"
+            and self._stack[1] == ("[", "nodes")
+        )
+
+    @staticmethod
+    def _decode(fragment: str) -> Optional[Dict[str, Any]]:
+        try:
+            node = json.loads(fragment)
+        except json.JSONDecodeError:
+            return None
+        return node if isinstance(node, dict) else None
+
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class ExtractedJSON(NamedTuple):
+    """Найденный JSON-объект; truncated — текст оборвался и объект достроен."""
+
+    value: Dict[str, Any]
+    truncated: bool
+
+
+def extract_json_object(text: str) -> Optional[ExtractedJSON]:
+    """
+    Находит внешний JSON-объект в ответе модели.
+
+    Текст вокруг объекта (пояснения, ```-блоки) пропускается, висячие
+    запятые перед `}`/`]` удаляются. Если ответ оборвался, объект
+    обрезается до последнего завершённого значения и закрывается. Если
+    первый кандидат не разбирается, поиск продолжается после него.
+
+    Корректный JSON без обрамления сразу разбирается json.loads, медленный
+    посимвольный разбор нужен только для «грязных» ответов.
+    """
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        try:
+            value = json.loads(stripped)
+        except json.JSONDecodeError:
+            pass
+        else:
+            if isinstance(value, dict) and value:
+                return ExtractedJSON(value, False)
+    start = text.find("{")
+    while start != -1:
+        extracted, resume = _scan_object(text, start)
+        if extracted is not None or resume is None:
+            return extracted
+        start = text.find("{", resume)
+    return None
+
+
+def _scan_object(
+    text: str, start: int
+) -> Tuple[Optional[ExtractedJSON], Optional[int]]:
+    # Возвращает (объект, позицию для продолжения поиска); позиция None —
+    # текст закончился и искать дальше нечего.
+    stack: List[str] = []
+    in_string = escape = string_is_key = expect_key = False
+    trailing_commas: List[int] = []
+    comma: Optional[int] = None
+    # Последняя точка, где объект можно обрезать: (позиция, закрывающие скобки).
+    safe: Optional[Tuple[int, str]] = None
+
+    def closers() -> str:
+        return "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                if not string_is_key:
+                    safe = (i + 1, closers())
+            continue
+
+        if ch == '"':
+            in_string = True
+            string_is_key = stack[-1] == "{" and expect_key
+            comma = None
+        elif ch in "{[":
+            stack.append(ch)
+            expect_key = ch == "{"
+            comma = None
+            if len(stack) == 1:
+                safe = (i + 1, "}")
+        elif ch in "}]":
+            if _CLOSERS[stack[-1]] != ch:
+                return None, i + 1
+            if comma is not None:
+                trailing_commas.append(comma)
+                comma = None
+            stack.pop()
+            if not stack:
+                value = _loads(text, start, i + 1, trailing_commas, "")
+                return (ExtractedJSON(value, False) if value else None), i + 1
+            expect_key = False
+            safe = (i + 1, closers())
+        elif ch == ",":
+            safe = (i, closers())
+            comma = i
+            expect_key = stack[-1] == "{"
+        elif ch == ":":
+            expect_key = False
+        elif not ch.isspace():
+            comma = None
+
+    if safe is None:
+        return None, None
+    end, closing = safe
+    value = _loads(text, start, end, trailing_commas, closing)
+    return (ExtractedJSON(value, True) if value else None), None
+
+
+def _loads(
+    text: str, start: int, end: int, skip: List[int], suffix: str
+) -> Optional[Dict[str, Any]]:
+    parts = []
+    pos = start
+    for index in skip:
+        if index < end:
+            parts.append(text[pos:index])
+            pos = index + 1
+    parts.append(text[pos:end])
+    try:
+        value = json.loads("".join(parts) + suffix)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
@@ -0,0 +1,305 @@
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from services.processes import pid_alive
+
+Labels = Tuple[Tuple[str, str], ...]
+SampleKey = Tuple[str, Labels]
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+
+def _labels(values: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in values.items()))
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class LabelValues:
+    """
+    Ограниченный набор значений метки, пришедших из запросов клиентов.
+
+    Значение попадает в метку как есть, только если его подтвердили через
+    allow() и набор ещё не заполнен; остальные сворачиваются в other, чтобы
+    число временных рядов не зависело от того, что присылают клиенты.
+    """
+
+    def __init__(self, max_size: int = 100, other: str = "other"):
+        self.max_size = max_size
+        self.other = other
+        self._lock = threading.Lock()
+        self._values: set = set()
+
+    def allow(self, value: str) -> None:
+        with self._lock:
+            if len(self._values) < self.max_size:
+                self._values.add(value)
+
+    def label(self, value: str) -> str:
+        return value if value in self._values else self.other
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class _SQLiteStore:
+    """
+    Общее для воркеров gunicorn хранилище метрик.
+
+    Каждый процесс записывает свои накопленные значения под своим pid,
+    а при выдаче /metrics значения суммируются по всем процессам. Значения
+    завершившихся процессов переносятся в строку с pid 0, поэтому счётчики
+    не уменьшаются после перезапуска воркеров.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.owner = os.getpid()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS samples ("
+                "pid INTEGER NOT NULL, name TEXT NOT NULL, labels TEXT NOT NULL, "
+                "value REAL NOT NULL, PRIMARY KEY (pid, name, labels))"
+            )
+        self._archive_dead_workers()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _archive_dead_workers(self) -> None:
+        with self._connect() as conn:
+            pids = [
+                pid
+                for (pid,) in conn.execute("SELECT DISTINCT pid FROM samples")
+                if pid not in (0, self.owner) and not pid_alive(pid)
+            ]
+            for pid in pids:
+                conn.execute(
+                    "INSERT INTO samples (pid, name, labels, value) "
+                    "SELECT 0, name, labels, value FROM samples WHERE pid = ? "
+                    "ON CONFLICT (pid, name, labels) "
+                    "DO UPDATE SET value = value + excluded.value",
+                    (pid,),
+                )
+                conn.execute("DELETE FROM samples WHERE pid = ?", (pid,))
+
+    def write(self, samples: Dict[SampleKey, float]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO samples (pid, name, labels, value) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (self.owner, name, json.dumps(labels), value)
+                    for (name, labels), value in samples.items()
+                ],
+            )
+
+    def read(self) -> Dict[SampleKey, float]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT name, labels, SUM(value) FROM samples GROUP BY name, labels"
+            ).fetchall()
+        return {
+            (name, tuple(tuple(pair) for pair in json.loads(labels))): value
+            for name, labels, value in rows
+        }
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM samples")
+
+
+class MetricsRegistry:
+    """
+    Счётчики и гистограммы в текстовом формате Prometheus.
+
+    Запись идёт в память процесса; раз в flush_interval секунд и перед
+    каждой выдачей /metrics накопленные значения сохраняются в SQLite
+    (METRICS_DB), откуда /metrics читает сумму по всем воркерам. Если
+    хранилище недоступно, отдаются значения текущего процесса.
+    """
+
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._families: Dict[str, Tuple[str, str, Sequence[float]]] = {}
+        self._values: Dict[SampleKey, float] = {}
+        self._store: Optional[_SQLiteStore] = None
+        self._flusher_owner: Optional[int] = None
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._families[name] = ("counter", help_text, ())
+
+    def histogram(
+        self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self._families[name] = ("histogram", help_text, tuple(buckets))
+
+    def inc(self, name: str, amount: float = 1.0, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        self._ensure_flusher()
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        buckets = self._families[name][2]
+        base = _labels(labels)
+        with self._lock:
+            for bound in (*buckets, math.inf):
+                if value <= bound:
+                    le = _format_value(bound) if math.isinf(bound) else repr(bound)
+                    key = (f"{name}_bucket", _labels({**labels, "le": le}))
+                    self._values[key] = self._values.get(key, 0.0) + 1
+            for suffix, amount in (("_sum", value), ("_count", 1.0)):
+                key = (name + suffix, base)
+                self._values[key] = self._values.get(key, 0.0) + amount
+        self._ensure_flusher()
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """Записывает в гистограмму name длительность блока в секундах."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def _get_store(self) -> _SQLiteStore:
+        # Хранилище открывается заново после fork: у каждого воркера свой pid.
+        if self._store is None or self._store.owner != os.getpid():
+            db_path = os.getenv(
+                "METRICS_DB", os.path.join(tempfile.gettempdir(), "quest_metrics.db")
+            )
+            self._store = _SQLiteStore(db_path)
+        return self._store
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher_owner == os.getpid() or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._flusher_owner == os.getpid():
+                return
+            self._flusher_owner = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics", daemon=True).start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def flush(self) -> None:
+        with self._lock:
+            values = dict(self._values)
+        if values:
+            self._get_store().write(values)
+
+    def collect(self) -> Dict[SampleKey, float]:
+        """Значения всех воркеров (или только текущего, если SQLite недоступен)."""
+        try:
+            self.flush()
+            return self._get_store().read()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        samples = self.collect()
+        lines: List[str] = []
+        for name, (kind, help_text, _) in sorted(self._families.items()):
+            names = (
+                (f"{name}_bucket", f"{name}_sum", f"{name}_count")
+                if kind == "histogram"
+                else (name,)
+            )
+            family = sorted(
+                (key, value) for key, value in samples.items() if key[0] in names
+            )
+            if not family:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (sample, labels), value in sorted(family, key=_sample_order):
+                lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+        if self._store is not None:
+            self._store.clear()
+        self._store = None
+
+
+def _sample_order(item: Tuple[SampleKey, float]) -> Tuple[Any, ...]:
+    # Корзины гистограммы выводятся по возрастанию границы, а не как строки.
+    (sample, labels), _ = item
+    rest = tuple(pair for pair in labels if pair[0] != "le")
+    bound = next((float(value) for name, value in labels if name == "le"), 0.0)
+    return rest, not sample.endswith("_bucket"), sample, bound
+
+
+metrics = MetricsRegistry(float(os.getenv("METRICS_FLUSH_INTERVAL", "5")))
+
+metrics.histogram(
+    "quest_stage_seconds",
+    "Duration of quest generation stages (rate_limit_wait, completion, ttft, parse, validate).",
+)
+metrics.counter("llm_requests_total", "Provider requests by outcome.")
+metrics.counter(
+    "quest_generation_errors_total", "Generation errors by provider, model and class."
+)
+metrics.counter("llm_tokens_total", "Tokens reported by providers, by kind.")
+metrics.histogram("http_request_duration_seconds", "HTTP request duration.")
+metrics.histogram(
+    "http_response_serialize_seconds", "Time spent serializing JSON responses."
+)
+metrics.counter("http_requests_total", "HTTP requests by endpoint and status.")
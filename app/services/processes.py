@@ -0,0 +1,17 @@
+import os
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    Жив ли процесс с данным pid.
+
+    Используется хранилищами на SQLite, общими для воркеров gunicorn, чтобы
+    найти записи завершившихся процессов.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
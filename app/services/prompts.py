@@ -0,0 +1,207 @@
+import hashlib
+import json
+import textwrap
+from typing import Any, NamedTuple, Optional
+
+from services.quest_schema import (
+    EXPANSION_SCHEMA,
+    NODES_SCHEMA,
+    OUTLINE_SCHEMA,
+    QUEST_SCHEMA,
+    Schema,
+)
+
+
+class Prompt(NamedTuple):
+    """
+    Готовый промпт: неизменная системная часть и сообщение пользователя.
+
+    schema — JSON Schema ответа для провайдеров со структурированным выводом,
+    name — имя шаблона, под которым схема передаётся провайдеру.
+    """
+
+    system: str
+    user: str
+    name: str = ""
+    schema: Optional[Schema] = None
+
+
+class PromptTemplate:
+    """
+    Версионированный шаблон промпта.
+
+    Инструкции и схема ответа собираются один раз при импорте и уходят
+    системным сообщением, одинаковым для всех запросов по шаблону, поэтому
+    провайдеры могут кэшировать этот префикс. Изменяемые данные (сеттинг,
+    узлы) подставляются только в сообщение пользователя, в самый конец.
+
+    version_id входит в ключ кэша квестов. Он вычисляется из хэша текста
+    шаблона и схемы, поэтому любая их правка сама отделяет новые квесты от
+    закэшированных по старому промпту.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        system: str,
+        user: str,
+        schema: Optional[Schema] = None,
+    ):
+        self.name = name
+        self.system = textwrap.dedent(system).strip()
+        self._user = textwrap.dedent(user).strip()
+        self.schema = schema
+        source = json.dumps(
+            [self.system, self._user, schema], ensure_ascii=False, sort_keys=True
+        )
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        self.version_id = f"{name}:{digest[:12]}"
+
+    def render(self, **values: Any) -> Prompt:
+        return Prompt(self.system, self._user.format(**values), self.name, self.schema)
+
+
+QUEST_TEMPLATE = PromptTemplate(
+    "quest",
+    system="""
+    Ты — профессиональный геймдизайнер и сценарист. Твоя задача — создать структуру нелинейного квеста в формате JSON на основе сеттинга, который пришлёт пользователь.
+
+    КЛЮЧЕВЫЕ ПРАВИЛА:
+    1.  ВЕСЬ СГЕНЕРИРОВАННЫЙ ТЕКСТ (в полях questTitle, title, description, text) ДОЛЖЕН БЫТЬ СТРОГО НА РУССКОМ ЯЗЫКЕ.
+    2.  JSON должен быть валидным и следовать структуре, описанной ниже.
+    3.  Квест должен иметь как минимум 3-4 узла (nodes).
+    4.  Обязательно должен быть хотя бы один узел с типом "ENDING_SUCCESS" и один с "ENDING_FAILURE".
+    5.  'startNodeId' должен указывать на 'id' одного из узлов.
+
+    Вот требуемая структура JSON:
+    {
+      "questTitle": "Название квеста",
+      "startNodeId": "id_стартового_узла",
+      "nodes": [
+        {
+          "id": "уникальный_id_узла",
+          "title": "Краткое название сцены",
+          "type": "STORY | CHOICE | ENDING_SUCCESS | ENDING_FAILURE",
+          "description": "Полное описание сцены, ситуации и окружения.",
+          "choices": [
+            {
+              "text": "Текст выбора для игрока",
+              "targetNodeId": "id_узла_к_которому_ведет_выбор"
+            }
+          ]
+        }
+      ]
+    }
+    """,
+    user="""
+    Сгенерируй JSON квеста на русском языке для этого сеттинга:
+    ---
+    {setting}
+    ---
+    """,
+    schema=QUEST_SCHEMA,
+)
+
+OUTLINE_TEMPLATE = PromptTemplate(
+    "outline",
+    system="""
+    Ты — профессиональный геймдизайнер и сценарист. Составь СКЕЛЕТ нелинейного квеста на основе сеттинга, который пришлёт пользователь. Описания сцен пока не нужны.
+
+    КЛЮЧЕВЫЕ ПРАВИЛА:
+    1.  Названия (questTitle, title) — на русском языке.
+    2.  Должен быть хотя бы один узел "ENDING_SUCCESS" и один "ENDING_FAILURE".
+    3.  'startNodeId' и все 'targetNodeId' указывают на 'id' узлов из списка.
+    4.  У каждого узла, кроме концовок, есть хотя бы один выбор.
+
+    Вот требуемая структура JSON:
+    {
+      "questTitle": "Название квеста",
+      "startNodeId": "id_стартового_узла",
+      "nodes": [
+        {
+          "id": "уникальный_id_узла",
+          "title": "Краткое название сцены",
+          "type": "STORY | CHOICE | ENDING_SUCCESS | ENDING_FAILURE",
+          "choices": [{"targetNodeId": "id_узла_к_которому_ведет_выбор"}]
+        }
+      ]
+    }
+    """,
+    user="""
+    Скелет должен состоять примерно из {node_count} узлов. Сеттинг:
+    ---
+    {setting}
+    ---
+    """,
+    schema=OUTLINE_SCHEMA,
+)
+
+# Сеттинг идёт перед списком узлов: так у параллельных запросов одного
+# квеста общий префикс длиннее.
+EXPAND_TEMPLATE = PromptTemplate(
+    "expand",
+    system="""
+    Ты — профессиональный сценарист. Пользователь пришлёт сеттинг квеста и список его узлов с переходами.
+
+    Для каждого узла дай полное описание сцены и текст каждого выбора. Не меняй id и переходы. Весь текст на русском языке. Ответ — JSON вида:
+    {"nodes": [{"id": "id_узла", "description": "Описание сцены",
+    "choices": [{"text": "Текст выбора", "targetNodeId": "id_узла"}]}]}
+    """,
+    user="""
+    Квест "{title}" по сеттингу:
+    ---
+    {setting}
+    ---
+
+    Напиши сцены для узлов:
+    {scenes}
+    """,
+    schema=EXPANSION_SCHEMA,
+)
+
+_NODES_ANSWER = """
+    Ответ — JSON вида {"nodes": [...]} только с изменёнными и новыми узлами, в той же структуре, что и узлы квеста, весь текст на русском языке.
+"""
+
+REPAIR_TEMPLATE = PromptTemplate(
+    "repair",
+    system="""
+    Ты — профессиональный геймдизайнер. Пользователь пришлёт квест с ошибками в структуре: список всех узлов, узлы, которые нужно исправить, и описание проблем.
+
+    Исправь только эти узлы и при необходимости добавь новые узлы-концовки. Каждый выбор должен вести на id существующего узла или нового узла из ответа.
+    """ + _NODES_ANSWER,
+    user="""
+    Квест "{title}".
+
+    Все узлы квеста (id: название (тип)):
+    {outline}
+
+    Узлы, которые нужно исправить:
+    {broken_nodes}
+
+    Проблемы:
+    {problems}
+    """,
+    schema=NODES_SCHEMA,
+)
+
+REGENERATE_TEMPLATE = PromptTemplate(
+    "regenerate",
+    system="""
+    Ты — профессиональный геймдизайнер. Пользователь пришлёт узлы квеста, которые нужно переписать, их соседние узлы и, возможно, пожелания автора.
+
+    Сохрани id переписываемых узлов. Выборы могут вести на эти узлы, на соседние узлы или на новые узлы, которые ты добавишь в ответ с новыми уникальными id.
+    """ + _NODES_ANSWER,
+    user="""
+    Квест "{title}".
+
+    Узлы, которые нужно переписать:
+    {selected}
+
+    Соседние узлы (id: название (тип)):
+    {neighbours}
+
+    Пожелания автора: {instruction}
+    """,
+    schema=NODES_SCHEMA,
+)
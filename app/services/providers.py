@@ -0,0 +1,107 @@
+import importlib
+import logging
+import os
+import sys
+import threading
+from types import ModuleType
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Модули SDK, которые нужны каждому провайдеру.
+PROVIDER_SDKS: Dict[str, Tuple[str, ...]] = {
+    "groq": ("groq",),
+    "openai": ("openai",),
+    "gemini": (
+        "google.generativeai",
+        "google.ai.generativelanguage",
+        "google.api_core.exceptions",
+    ),
+    "fake": ("openai",),
+}
+
+
+class LazySDK:
+    """
+    Модуль SDK, который импортируется при первом обращении к атрибуту.
+
+    Импорт google.generativeai, openai и groq занимает заметное время и
+    память, поэтому воркер загружает только SDK провайдеров, к которым
+    действительно обращается. Атрибуты можно подменять через patch, как
+    у обычного модуля.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None or self._name in sys.modules
+
+    def load(self) -> ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazySDK {self._name} ({state})>"
+
+
+_sdks: Dict[str, LazySDK] = {}
+_sdks_lock = threading.Lock()
+
+
+def lazy_sdk(name: str) -> LazySDK:
+    """Общий для процесса ленивый модуль SDK с именем name."""
+    with _sdks_lock:
+        if name not in _sdks:
+            _sdks[name] = LazySDK(name)
+        return _sdks[name]
+
+
+def loaded_attrs(sdks: Iterable[LazySDK], *names: str) -> Tuple[Any, ...]:
+    """
+    Атрибуты names только из уже импортированных SDK.
+
+    Нужно для проверок isinstance по классам ошибок: исключение SDK,
+    который ещё не импортирован, появиться не могло, а импортировать его
+    ради проверки незачем.
+    """
+    return tuple(getattr(sdk, name) for sdk in sdks if sdk.loaded for name in names)
+
+
+def enabled_providers() -> List[str]:
+    """Провайдеры из LLM_PROVIDERS (через запятую); пустой список — все лениво."""
+    value = os.getenv("LLM_PROVIDERS", "")
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def preload_provider_sdks(providers: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Импортирует SDK провайдеров заранее и возвращает имена модулей.
+
+    Вызывается при импорте приложения: с gunicorn --preload это происходит
+    в мастер-процессе один раз, и воркеры получают уже загруженные модули
+    при fork вместе с общими страницами памяти. SDK остальных провайдеров
+    по-прежнему импортируются при первом обращении.
+    """
+    modules: List[str] = []
+    for provider in enabled_providers() if providers is None else providers:
+        if provider not in PROVIDER_SDKS:
+            logger.warning(f"Unknown provider in LLM_PROVIDERS: {provider}")
+            continue
+        for name in PROVIDER_SDKS[provider]:
+            if name not in modules:
+                lazy_sdk(name).load()
+                modules.append(name)
+    if modules:
+        logger.info(f"Preloaded provider SDKs: {', '.join(modules)}")
+    return modules
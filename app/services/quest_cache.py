@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def normalize_setting(setting_text: str) -> str:
+    """Приводит сеттинг к каноническому виду: NFC и схлопнутые пробелы."""
+    return " ".join(unicodedata.normalize("NFC", setting_text).split())
+
+
+def make_cache_key(
+    setting_text: str, api_provider: str, model: str, prompt_version: str
+) -> str:
+    """Возвращает хэш, однозначно описывающий запрос на генерацию."""
+    payload = json.dumps(
+        [normalize_setting(setting_text), api_provider, model, prompt_version],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """Потокобезопасный LRU-кэш в памяти процесса с TTL."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 86400.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._clock() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """
+    Дисковый кэш в SQLite с TTL и ограничением числа записей.
+
+    База в режиме WAL может использоваться несколькими воркерами gunicorn
+    одновременно, поэтому результат, полученный одним воркером, доступен всем.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 86400.0,
+        max_entries: int = 10000,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._path = path
+        self._owner: Optional[int] = None
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS quest_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_quest_cache_accessed "
+                "ON quest_cache (accessed_at)"
+            )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Соединение SQLite нельзя использовать после fork, поэтому при
+        # gunicorn --preload каждый воркер открывает своё.
+        if self._owner != os.getpid():
+            self._connection = sqlite3.connect(
+                self._path, check_same_thread=False, timeout=10
+            )
+            self._owner = os.getpid()
+        return self._connection
+
+    def get(self, key: str) -> Optional[str]:
+        now = self._clock()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM quest_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM quest_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE quest_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = self._clock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO quest_cache VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM quest_cache WHERE created_at < ?", (now - self.ttl,)
+            )
+            # Вытесняем записи, к которым дольше всего не обращались.
+            self._conn.execute(
+                "DELETE FROM quest_cache WHERE key IN ("
+                "SELECT key FROM quest_cache ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM quest_cache")
+
+
+class QuestCache:
+    """
+    Многоуровневый кэш сгенерированных квестов.
+
+    Уровни (backends) опрашиваются по порядку; найденное значение
+    копируется в более быстрые уровни. Любой объект с методами
+    get/set/clear может быть уровнем кэша.
+    """
+
+    def __init__(self, tiers: List[Any]):
+        self.tiers = tiers
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        for index, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster_tier in self.tiers[:index]:
+                    faster_tier.set(key, value)
+                return json.loads(value)
+        return None
+
+    def set(self, key: str, quest: Dict[str, Any]) -> None:
+        value = json.dumps(quest, ensure_ascii=False)
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def clear(self) -> None:
+        for tier in self.tiers:
+            tier.clear()
+
+
+def build_cache_from_env() -> QuestCache:
+    """Собирает кэш по переменным окружения QUEST_CACHE_*."""
+    ttl = float(os.getenv("QUEST_CACHE_TTL", "86400"))
+    tiers: List[Any] = [
+        MemoryCache(max_entries=int(os.getenv("QUEST_CACHE_SIZE", "256")), ttl=ttl)
+    ]
+    db_path = os.getenv("QUEST_CACHE_DB")
+    if db_path:
+        tiers.append(
+            SQLiteCache(
+                db_path,
+                ttl=ttl,
+                max_entries=int(os.getenv("QUEST_CACHE_DB_MAX_ENTRIES", "10000")),
+            )
+        )
+    return QuestCache(tiers)
+
+
+quest_cache = build_cache_from_env()
@@ -0,0 +1,255 @@
+"""
+Компактный экспорт квеста для игровых движков (формат QSTB).
+
+Все строки квеста собраны в одну таблицу без повторов, узлы и переходы
+ссылаются на них и друг на друга целыми индексами, поэтому движку не нужно
+искать узлы по строковым id. Файл состоит из выровненных по 4 байта
+таблиц фиксированного размера и читается без разбора: достаточно
+отобразить его в память (mmap) и читать числа по смещениям из заголовка.
+
+Все числа — uint32 little-endian. NONE (0xFFFFFFFF) означает отсутствие
+значения: неизвестный тип узла, неверный startNodeId или выбор, который
+ведёт на несуществующий узел.
+
+    Заголовок (52 байта):
+        magic "QSTB", version u16, flags u16,
+        node_count, edge_count, string_count,
+        start_node (индекс узла), title (индекс строки),
+        nodes_offset, edge_index_offset, edges_offset,
+        string_offsets_offset, string_data_offset, string_data_size
+    nodes:          node_count записей [id, title, description, type]
+    edge_index:     node_count + 1 смещений в edges (как в CSR): выборы
+                    узла i — edges[edge_index[i]:edge_index[i + 1]]
+    edges:          edge_count записей [target_node, text]
+    string_offsets: string_count + 1 смещений в string_data
+    string_data:    строки UTF-8 подряд, дополненные нулями до 4 байт
+
+type — индекс в NODE_TYPES. Строка с индексом 0 всегда пустая.
+
+export_quest_index возвращает те же таблицы в виде JSON (по столбцам)
+для сред, где работать с бинарными данными неудобно.
+"""
+
+import struct
+from typing import Any, Dict, List, Sequence, Tuple
+
+from services.quest_schema import NODE_TYPES
+from services.quest_validator import QuestGraph
+
+MAGIC = b"QSTB"
+FORMAT_VERSION = 1
+NONE = 0xFFFFFFFF
+
+_HEADER = struct.Struct("<4sHH11I")
+_NODE_FIELDS = 4
+_EDGE_FIELDS = 2
+
+
+class QuestFormatError(ValueError):
+    """Данные не являются квестом в формате QSTB."""
+
+
+class QuestIndex:
+    """
+    Таблицы квеста с целочисленными ссылками: общая основа двоичного и
+    JSON-экспорта.
+    """
+
+    def __init__(self, quest: Dict[str, Any]):
+        self.strings: List[str] = [""]
+        self._string_ids: Dict[str, int] = {"": 0}
+        graph = QuestGraph(quest)
+        # Узлы без id или с повторным id не экспортируются: на них
+        # невозможно сослаться из выборов.
+        node_ids = list(graph.index)
+        positions = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        self.title = self.intern(quest.get("questTitle"))
+        self.start = positions.get(graph.start, NONE) if graph.start else NONE
+        self.nodes: List[Tuple[int, int, int, int]] = []
+        self.edge_index: List[int] = [0]
+        self.edges: List[Tuple[int, int]] = []
+        for node_id in node_ids:
+            node = graph.index[node_id]
+            node_type = node.get("type")
+            self.nodes.append(
+                (
+                    self.intern(node_id),
+                    self.intern(node.get("title")),
+                    self.intern(node.get("description")),
+                    NODE_TYPES.index(node_type) if node_type in NODE_TYPES else NONE,
+                )
+            )
+            choices = node.get("choices")
+            for choice in choices if isinstance(choices, list) else []:
+                if not isinstance(choice, dict):
+                    continue
+                target = positions.get(choice.get("targetNodeId"), NONE)
+                self.edges.append((target, self.intern(choice.get("text"))))
+            self.edge_index.append(len(self.edges))
+
+    def intern(self, value: Any) -> int:
+        """Индекс строки в общей таблице (не-строки считаются пустыми)."""
+        if not isinstance(value, str):
+            return 0
+        index = self._string_ids.get(value)
+        if index is None:
+            index = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+
+def _u32(values: Sequence[int]) -> bytes:
+    return struct.pack(f"<{len(values)}I", *values)
+
+
+def encode_quest(quest: Dict[str, Any]) -> bytes:
+    """Кодирует квест в формат QSTB."""
+    index = QuestIndex(quest)
+    encoded = [value.encode("utf-8") for value in index.strings]
+    string_offsets = [0]
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+    string_data = b"".join(encoded)
+    string_data += b"\0" * (-len(string_data) % 4)
+
+    sections = [
+        _u32([field for node in index.nodes for field in node]),
+        _u32(index.edge_index),
+        _u32([field for edge in index.edges for field in edge]),
+        _u32(string_offsets),
+        string_data,
+    ]
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+
+    header = _HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        0,
+        len(index.nodes),
+        len(index.edges),
+        len(index.strings),
+        index.start,
+        index.title,
+        *offsets,
+        string_offsets[-1],
+    )
+    return header + b"".join(sections)
+
+
+class QuestBinary:
+    """
+    Чтение QSTB без копирования данных: значения читаются по смещениям
+    прямо из переданного буфера (bytes, mmap и т. п.).
+    """
+
+    def __init__(self, data: Any):
+        self._data = memoryview(data)
+        if len(self._data) < _HEADER.size:
+            raise QuestFormatError("Data is shorter than the QSTB header")
+        fields = _HEADER.unpack_from(self._data)
+        magic, version = fields[0], fields[1]
+        if magic != MAGIC:
+            raise QuestFormatError("Not a QSTB file")
+        if version != FORMAT_VERSION:
+            raise QuestFormatError(f"Unsupported QSTB version {version}")
+        (
+            self.node_count,
+            self.edge_count,
+            self.string_count,
+            self.start_node,
+            self.title,
+            self._nodes,
+            self._edge_index,
+            self._edges,
+            self._string_offsets,
+            self._string_data,
+            string_data_size,
+        ) = fields[3:]
+        if self._string_data + string_data_size > len(self._data):
+            raise QuestFormatError("QSTB data is truncated")
+
+    def _u32(self, offset: int, index: int) -> int:
+        return struct.unpack_from("<I", self._data, offset + 4 * index)[0]
+
+    def string(self, index: int) -> str:
+        start = self._u32(self._string_offsets, index)
+        end = self._u32(self._string_offsets, index + 1)
+        begin = self._string_data + start
+        stop = self._string_data + end
+        return bytes(self._data[begin:stop]).decode("utf-8")
+
+    def node(self, index: int) -> Tuple[int, int, int, int]:
+        """(id, title, description, type) узла; первые три — индексы строк."""
+        return struct.unpack_from(
+            "<4I", self._data, self._nodes + 4 * _NODE_FIELDS * index
+        )
+
+    def choices(self, index: int) -> List[Tuple[int, int]]:
+        """Выборы узла: (индекс целевого узла, индекс строки текста)."""
+        start = self._u32(self._edge_index, index)
+        end = self._u32(self._edge_index, index + 1)
+        return [
+            struct.unpack_from("<2I", self._data, self._edges + 4 * _EDGE_FIELDS * i)
+            for i in range(start, end)
+        ]
+
+
+def decode_quest(data: Any) -> Dict[str, Any]:
+    """Восстанавливает квест из QSTB (выборы на несуществующие узлы теряются)."""
+    binary = QuestBinary(data)
+    ids = [binary.string(binary.node(i)[0]) for i in range(binary.node_count)]
+    nodes = []
+    for i in range(binary.node_count):
+        _, title, description, node_type = binary.node(i)
+        nodes.append(
+            {
+                "id": ids[i],
+                "title": binary.string(title),
+                "type": NODE_TYPES[node_type] if node_type != NONE else "",
+                "description": binary.string(description),
+                "choices": [
+                    {"text": binary.string(text), "targetNodeId": ids[target]}
+                    for target, text in binary.choices(i)
+                    if target != NONE
+                ],
+            }
+        )
+    start = binary.start_node
+    return {
+        "questTitle": binary.string(binary.title),
+        "startNodeId": ids[start] if start != NONE else "",
+        "nodes": nodes,
+    }
+
+
+def export_quest_index(quest: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Те же таблицы, что и в QSTB, в виде JSON.
+
+    Таблицы хранятся по столбцам, поэтому загрузчик может использовать
+    одну логику для обоих форматов.
+    """
+    index = QuestIndex(quest)
+    columns = list(zip(*index.nodes)) or [(), (), (), ()]
+    edge_columns = list(zip(*index.edges)) or [(), ()]
+    return {
+        "format": "qstb-json",
+        "version": FORMAT_VERSION,
+        "nodeTypes": list(NODE_TYPES),
+        "title": index.title,
+        "startNode": index.start,
+        "strings": index.strings,
+        "nodes": {
+            "id": list(columns[0]),
+            "title": list(columns[1]),
+            "description": list(columns[2]),
+            "type": list(columns[3]),
+        },
+        "edgeIndex": index.edge_index,
+        "edges": {"target": list(edge_columns[0]), "text": list(edge_columns[1])},
+    }
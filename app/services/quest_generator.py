@@ -1,174 +1,1683 @@
+import asyncio
 import json
 import logging
+import os
 import re
-from typing import Any, Dict
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import google.generativeai as genai
-import openai
-from groq import Groq
+import httpx
+
+from services.client_pool import default_pool, hash_api_key
+from services.job_queue import get_job_queue
+from services.providers import lazy_sdk, loaded_attrs
+from services.prompts import (
+    EXPAND_TEMPLATE,
+    OUTLINE_TEMPLATE,
+    QUEST_TEMPLATE,
+    REGENERATE_TEMPLATE,
+    REPAIR_TEMPLATE,
+    Prompt,
+)
+from services.json_extract import (
+    ExtractedJSON,
+    QuestNodeStreamParser,
+    extract_json_object,
+)
+from services.metrics import LabelValues, metrics
+from services.quest_cache import make_cache_key, quest_cache
+from services.quest_schema import (
+    QUEST_SCHEMA,
+    Schema,
+    gemini_schema,
+    schema_errors,
+    strict_schema,
+)
+from services.quest_validator import (
+    DEAD_END,
+    MISSING_ENDING,
+    NO_NODES,
+    NO_PATH_TO_ENDING,
+    REGENERATE_CODES,
+    UNREACHABLE,
+    Issue,
+    QuestGraph,
+    broken_node_ids,
+    close_dead_ends,
+    merge_nodes,
+    repair_quest,
+)
+from services.rate_limiter import ProviderLimiter, RateLimitExceeded, rate_limiters
+from services.refreshing_cache import NEGATIVE, POSITIVE, RefreshingCache
+from services.resilience import (
+    CircuitOpenError,
+    DeadlineExceeded,
+    circuit_breakers,
+    retry_policy,
+)
+from services.router import RoutesExhausted, latency_router
+from services.single_flight import single_flight
 
 logger = logging.getLogger(__name__)
 
+# SDK провайдеров импортируются при первом обращении (см. services.providers),
+# поэтому воркер не тратит время и память на SDK неиспользуемых провайдеров.
+genai = lazy_sdk("google.generativeai")
+glm = lazy_sdk("google.ai.generativelanguage")
+google_exceptions = lazy_sdk("google.api_core.exceptions")
+groq = lazy_sdk("groq")
+openai = lazy_sdk("openai")
+
+
+def _request_model(request: httpx.Request) -> Optional[str]:
+    try:
+        return json.loads(request.content).get("model")
+    except (ValueError, AttributeError, httpx.RequestNotRead):
+        return None
+
+
+def _update_rate_limits(
+    api_provider: str, api_key: str, response: httpx.Response
+) -> None:
+    model = _request_model(response.request)
+    if model:
+        rate_limiters.get(api_provider, api_key, model).update_from_headers(
+            response.headers
+        )
+
+
+def _fake_base_url() -> Optional[str]:
+    return os.getenv("FAKE_LLM_BASE_URL") or None
+
+
+def _http_client(api_provider: str, api_key: str) -> httpx.Client:
+    """HTTP-клиент, передающий заголовки rate-limit каждого ответа в лимитер."""
+    sdk = groq if api_provider == "groq" else openai
+    return sdk.DefaultHttpxClient(
+        event_hooks={
+            "response": [
+                lambda response: _update_rate_limits(api_provider, api_key, response)
+            ]
+        }
+    )
+
+
+def _async_http_client(api_provider: str, api_key: str) -> httpx.AsyncClient:
+    async def on_response(response: httpx.Response) -> None:
+        _update_rate_limits(api_provider, api_key, response)
+
+    sdk = groq if api_provider == "groq" else openai
+    return sdk.DefaultAsyncHttpxClient(event_hooks={"response": [on_response]})
+
+
+# Фабрики клиентов обращаются к именам модуля в момент вызова,
+# поэтому их можно подменять в тестах через patch.
+_CLIENT_FACTORIES = {
+    "groq": lambda api_key: groq.Groq(
+        api_key=api_key, max_retries=0, http_client=_http_client("groq", api_key)
+    ),
+    "openai": lambda api_key: openai.OpenAI(
+        api_key=api_key, max_retries=0, http_client=_http_client("openai", api_key)
+    ),
+    # Gemini получает ключ через собственные клиенты, а не через
+    # genai.configure, который меняет глобальное состояние процесса.
+    "gemini": lambda api_key: glm.GenerativeServiceClient(
+        client_options={"api_key": api_key}
+    ),
+    "gemini_models": lambda api_key: glm.ModelServiceClient(
+        client_options={"api_key": api_key}
+    ),
+    # Локальный OpenAI-совместимый сервер services.fake_llm для нагрузочных
+    # тестов и бенчмарков без сети.
+    "fake": lambda api_key: openai.OpenAI(
+        api_key=api_key,
+        base_url=_fake_base_url(),
+        max_retries=0,
+        http_client=_http_client("fake", api_key),
+    ),
+}
+
+
+# Асинхронные клиенты поддерживают `async with` и закрываются после вызова.
+_ASYNC_CLIENT_FACTORIES = {
+    "groq": lambda api_key: groq.AsyncGroq(
+        api_key=api_key, max_retries=0, http_client=_async_http_client("groq", api_key)
+    ),
+    "openai": lambda api_key: openai.AsyncOpenAI(
+        api_key=api_key,
+        max_retries=0,
+        http_client=_async_http_client("openai", api_key),
+    ),
+    "gemini": lambda api_key: glm.GenerativeServiceAsyncClient(
+        client_options={"api_key": api_key}
+    ),
+    "fake": lambda api_key: openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=_fake_base_url(),
+        max_retries=0,
+        http_client=_async_http_client("fake", api_key),
+    ),
+}
 
-def _get_master_prompt(setting_text: str) -> str:
+SUPPORTED_PROVIDERS = ("groq", "openai", "gemini")
+
+
+def _is_supported(api_provider: str) -> bool:
+    """
+    Известен ли провайдер.
+
+    Поддельный провайдер fake подключается только при явно заданном
+    FAKE_LLM_BASE_URL (нагрузочные тесты), чтобы клиенты рабочего сервера
+    не могли направить запросы на него.
+    """
+    if api_provider == "fake":
+        return _fake_base_url() is not None
+    return api_provider in SUPPORTED_PROVIDERS
+
+
+# Провайдеры с API chat.completions в формате OpenAI.
+CHAT_PROVIDERS = ("groq", "openai", "fake")
+
+INVALID_API_KEY_MESSAGE = "Неверный API ключ."
+
+
+def _get_client(api_provider: str, api_key: str) -> Any:
+    """Возвращает переиспользуемый клиент провайдера из пула."""
+    return default_pool.get(api_provider, api_key, _CLIENT_FACTORIES[api_provider])
+
+
+def _get_gemini_model(
+    api_key: str, model: str, system_instruction: Optional[str] = None
+) -> Any:
+    """Создаёт модель Gemini, привязанную к клиенту конкретного ключа."""
+    gemini_model = genai.GenerativeModel(  # type: ignore
+        model, system_instruction=system_instruction
+    )
+    gemini_model._client = _get_client("gemini", api_key)
+    return gemini_model
+
+
+def _list_gemini_models(api_key: str) -> Any:
+    """Возвращает модели Gemini, доступные для ключа, без genai.configure."""
+    return genai.list_models(  # type: ignore[reportPrivateImportUsage]
+        client=_get_client("gemini_models", api_key)
+    )
+
+
+def _get_master_prompt(setting_text: str) -> Prompt:
     """Генерирует основной промпт для LLM."""
-    return f"""
-  Ты — профессиональный геймдизайнер и сценарист. Твоя задача — создать структуру нелинейного квеста в формате JSON на основе предоставленного сеттинга.
-
-  КЛЮЧЕВЫЕ ПРАВИЛА:
-  1.  ВЕСЬ СГЕНЕРИРОВАННЫЙ ТЕКСТ (в полях questTitle, title, description, text) ДОЛЖЕН БЫТРО СТРОГО НА РУССКОМ ЯЗЫКЕ.
-  2.  JSON должен быть валидным и следовать структуре, описанной ниже.
-  3.  Квест должен иметь как минимум 3-4 узла (nodes).
-  4.  Обязательно должен быть хотя бы один узел с типом "ENDING_SUCCESS" и один с "ENDING_FAILURE".
-  5.  'startNodeId' должен указывать на 'id' одного из узлов.
-
-  Вот требуемая структура JSON:
-  {{
-    "questTitle": "Название квеста",
-    "startNodeId": "id_стартового_узла",
-    "nodes": [
-    {{
-      "id": "уникальный_id_узла",
-      "title": "Краткое название сцены",
-      "type": "STORY | CHOICE | ENDING_SUCCESS | ENDING_FAILURE",
-      "description": "Полное описание сцены, ситуации и окружения.",
-      "choices": [
-      {{
-        "text": "Текст выбора для игрока",
-        "targetNodeId": "id_узла_к_которому_ведет_выбор"
-      }}
-      ]
-    }}
-    ]
-  }}
+    return QUEST_TEMPLATE.render(setting=setting_text)
 
-  Сеттинг для генерации:
-  ---
-  {setting_text}
-  ---
 
-  Теперь сгенерируй JSON для этого квеста на русском языке.
-  """
+CONTINUE_INSTRUCTION = (
+    "Твой ответ оборвался. Продолжи JSON ровно с того символа, на котором он "
+    "остановился, без повторов, пояснений и markdown."
+)
 
 
-def create_quest_from_setting(
-    setting_text: str, api_key: str, api_provider: str, model: str
+# Префиксы моделей, которые принимают JSON Schema ответа. Остальные
+# получают режим json_object (Groq, OpenAI) или обычный текст (Gemini).
+STRUCTURED_OUTPUT_MODELS = {
+    "openai": ("gpt-4o", "gpt-4.1", "gpt-5", "o3", "o4"),
+    "groq": ("openai/gpt-oss", "moonshotai/kimi-k2", "meta-llama/llama-4"),
+    "gemini": ("gemini-1.5", "gemini-2", "gemini-3"),
+    "fake": ("fake",),
+}
+
+_SCHEMA_CONVERTERS = {"openai": strict_schema, "gemini": gemini_schema}
+_provider_schemas: Dict[Tuple[str, str], Schema] = {}
+
+
+def _supports_schema(api_provider: str, model: str, prompt: Prompt) -> bool:
+    if prompt.schema is None or os.getenv("STRUCTURED_OUTPUT", "1") != "1":
+        return False
+    prefixes = STRUCTURED_OUTPUT_MODELS.get(api_provider, ())
+    return model.removeprefix("models/").startswith(prefixes)
+
+
+def _provider_schema(api_provider: str, prompt: Prompt) -> Schema:
+    """Схема ответа в диалекте провайдера; каждый вариант строится один раз."""
+    key = (api_provider, prompt.name)
+    schema = _provider_schemas.get(key)
+    if schema is None:
+        convert = _SCHEMA_CONVERTERS.get(api_provider)
+        schema = convert(prompt.schema) if convert else prompt.schema
+        _provider_schemas[key] = schema
+    return schema
+
+
+def _max_output_tokens() -> Optional[int]:
+    value = os.getenv("GENERATION_MAX_TOKENS")
+    return int(value) if value else None
+
+
+def _chat_request(
+    api_provider: str, prompt: Prompt, model: str, partial: Optional[str] = None
 ) -> Dict[str, Any]:
-    """Генерирует квест, используя указанного API-провайдера."""
-    master_prompt = _get_master_prompt(setting_text)
-    response_content = None
+    """
+    Параметры запроса chat.completions, общие для Groq и OpenAI.
 
-    try:
-        if api_provider == "groq":
-            client = Groq(api_key=api_key)
-            chat_completion = client.chat.completions.create(
-                messages=[{"role": "user", "content": master_prompt}],
-                model=model,
-                temperature=0.7,
-                response_format={"type": "json_object"},
-            )
-            response_content = chat_completion.choices[0].message.content
+    Модели со структурированным выводом получают JSON Schema ответа
+    (у OpenAI — в строгом режиме), остальные — режим json_object.
+    partial — оборванный ответ модели, который нужно продолжить.
+    """
+    request: Dict[str, Any] = {
+        "messages": [
+            {"role": "system", "content": prompt.system},
+            {"role": "user", "content": prompt.user},
+        ],
+        "model": model,
+        "temperature": 0.7,
+    }
+    max_tokens = _max_output_tokens()
+    if max_tokens:
+        # OpenAI принимает для новых моделей только max_completion_tokens.
+        field = "max_completion_tokens" if api_provider == "openai" else "max_tokens"
+        request[field] = max_tokens
+    if partial is not None:
+        # Режим json_object требует целый объект, поэтому продолжение
+        # запрашивается обычным текстом.
+        request["messages"] += [
+            {"role": "assistant", "content": partial},
+            {"role": "user", "content": CONTINUE_INSTRUCTION},
+        ]
+    elif _supports_schema(api_provider, model, prompt):
+        request["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": prompt.name or "response",
+                "schema": _provider_schema(api_provider, prompt),
+                "strict": api_provider == "openai",
+            },
+        }
+    else:
+        request["response_format"] = {"type": "json_object"}
+    return request
 
-        elif api_provider == "openai":
-            client = openai.OpenAI(api_key=api_key)
-            chat_completion = client.chat.completions.create(
-                messages=[{"role": "user", "content": master_prompt}],
-                model=model,
-                temperature=0.7,
-                response_format={"type": "json_object"},
+
+def _gemini_contents(prompt: Prompt, partial: Optional[str] = None) -> Any:
+    # Системная часть промпта передаётся в system_instruction модели.
+    if partial is None:
+        return prompt.user
+    return [
+        {"role": "user", "parts": [prompt.user]},
+        {"role": "model", "parts": [partial]},
+        {"role": "user", "parts": [CONTINUE_INSTRUCTION]},
+    ]
+
+
+def _gemini_options(
+    prompt: Prompt, model: str, partial: Optional[str] = None
+) -> Dict[str, Any]:
+    """Аргументы generate_content: response_schema и лимит токенов ответа."""
+    config: Dict[str, Any] = {}
+    if partial is None and _supports_schema("gemini", model, prompt):
+        config["response_mime_type"] = "application/json"
+        config["response_schema"] = _provider_schema("gemini", prompt)
+    max_tokens = _max_output_tokens()
+    if max_tokens:
+        config["max_output_tokens"] = max_tokens
+    return {"generation_config": config} if config else {}
+
+
+def _estimate_tokens(prompt: Prompt, partial: Optional[str] = None) -> int:
+    """Грубая оценка расхода токенов до ответа: ~4 символа на токен плюс ответ."""
+    length = len(prompt.system) + len(prompt.user) + len(partial or "")
+    output = _max_output_tokens() or int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", "2048"))
+    return length // 4 + output
+
+
+def _chat_usage(response: Any) -> Any:
+    # Groq в потоковом режиме присылает расход в x_groq последнего фрагмента.
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        usage = getattr(getattr(response, "x_groq", None), "usage", None)
+    return usage
+
+
+def _total_tokens(response: Any) -> Any:
+    usage = _chat_usage(response)
+    if usage is not None:
+        return getattr(usage, "total_tokens", None)
+    usage_metadata = getattr(response, "usage_metadata", None)
+    return getattr(usage_metadata, "total_token_count", None)
+
+
+# Модель приходит из запроса клиента, поэтому в метки попадают только
+# модели, от которых провайдер хотя бы раз вернул ответ; остальные — other.
+model_labels = LabelValues(int(os.getenv("METRICS_MAX_MODELS", "100")))
+
+
+def _record_completion(
+    api_provider: str, model: str, started: float, ok: bool, response: Any = None
+) -> None:
+    """
+    Метрики одного запроса к провайдеру: длительность, исход и токены.
+
+    response — ответ или фрагмент потока с расходом токенов, если он есть.
+    """
+    if ok:
+        model_labels.allow(model)
+    model = model_labels.label(model)
+    metrics.observe(
+        "quest_stage_seconds",
+        time.perf_counter() - started,
+        stage="completion",
+        provider=api_provider,
+        model=model,
+    )
+    metrics.inc(
+        "llm_requests_total",
+        provider=api_provider,
+        model=model,
+        outcome="ok" if ok else "error",
+    )
+    usage = _chat_usage(response)
+    if usage is not None:
+        counts = (
+            ("prompt", getattr(usage, "prompt_tokens", None)),
+            ("completion", getattr(usage, "completion_tokens", None)),
+        )
+    else:
+        usage_metadata = getattr(response, "usage_metadata", None)
+        counts = (
+            ("prompt", getattr(usage_metadata, "prompt_token_count", None)),
+            ("completion", getattr(usage_metadata, "candidates_token_count", None)),
+        )
+    for kind, count in counts:
+        if isinstance(count, int):
+            metrics.inc(
+                "llm_tokens_total", count, provider=api_provider, model=model, kind=kind
             )
-            response_content = chat_completion.choices[0].message.content
 
-        elif api_provider == "gemini":
-            genai.configure(api_key=api_key)  # type: ignore[reportPrivateImportUsage]
-            gemini_model = genai.GenerativeModel(model)  # type: ignore
-            response = gemini_model.generate_content(master_prompt)
-            response_content = response.text
 
+def _after_wait(api_provider: str, model: str, timeout: float, waited: float) -> float:
+    """
+    Учитывает ожидание лимита и возвращает оставшийся таймаут попытки.
+
+    Ожидание входит в таймаут, который выдал retry_policy, поэтому запрос
+    к SDK не выходит за общий дедлайн.
+    """
+    metrics.observe(
+        "quest_stage_seconds",
+        waited,
+        stage="rate_limit_wait",
+        provider=api_provider,
+        model=model_labels.label(model),
+    )
+    remaining = timeout - waited
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded while waiting for rate limit")
+    return remaining
+
+
+def _penalize_rate_limit(limiter: ProviderLimiter, e: Exception) -> None:
+    """
+    Учитывает 429 без HTTP-заголовков (например, gRPC-ошибки Gemini).
+
+    Ответы Groq и OpenAI уже обработаны хуком HTTP-клиента.
+    """
+    message = str(e).lower()
+    if not (
+        "429" in message or "resource exhausted" in message or "rate limit" in message
+    ):
+        return
+    match = re.search(r"(?:retry|try again) in ([\d.]+)s|seconds: (\d+)", message)
+    delay = float(next(g for g in match.groups() if g)) if match else 10.0
+    limiter.block_for(delay)
+
+
+def _is_transient_error(e: BaseException) -> bool:
+    """Ошибки, после которых имеет смысл обратиться к провайдеру ещё раз."""
+    if isinstance(
+        e,
+        (asyncio.TimeoutError, DeadlineExceeded, RateLimitExceeded, CircuitOpenError),
+    ):
+        return True
+    if isinstance(e, loaded_attrs((openai, groq), "APIConnectionError")):
+        return True
+    if isinstance(e, loaded_attrs((openai, groq), "APIStatusError")):
+        return e.status_code == 429 or e.status_code >= 500
+    return isinstance(
+        e, loaded_attrs((google_exceptions,), "ServerError", "TooManyRequests")
+    )
+
+
+def _is_retryable_error(e: Exception) -> bool:
+    # Клиентский лимитер уже ждал сколько мог, а открытая цепь не пропустит
+    # повтор, поэтому повторяются только ответы провайдера и сетевые сбои.
+    return _is_transient_error(e) and not isinstance(
+        e, (DeadlineExceeded, RateLimitExceeded, CircuitOpenError)
+    )
+
+
+def _is_provider_failure(e: Exception) -> bool:
+    """Сбой самого провайдера (5xx, таймаут), а не исчерпанный лимит ключа."""
+    if isinstance(
+        e,
+        loaded_attrs((openai, groq), "RateLimitError")
+        + loaded_attrs((google_exceptions,), "TooManyRequests"),
+    ):
+        return False
+    return _is_retryable_error(e)
+
+
+def _request_completion_once(
+    api_provider: str,
+    api_key: str,
+    model: str,
+    prompt: Prompt,
+    timeout: float,
+    partial: Optional[str] = None,
+) -> Optional[str]:
+    limiter = rate_limiters.get(api_provider, api_key, model)
+    estimated_tokens = _estimate_tokens(prompt, partial)
+    waited = limiter.acquire(estimated_tokens, min(rate_limiters.max_wait, timeout))
+    timeout = _after_wait(api_provider, model, timeout, waited)
+    started = time.perf_counter()
+    try:
+        if api_provider in CHAT_PROVIDERS:
+            client = _get_client(api_provider, api_key)
+            response = client.chat.completions.create(
+                **_chat_request(api_provider, prompt, model, partial), timeout=timeout
+            )
+            content = response.choices[0].message.content
         else:
-            logger.error(f"Unknown API provider: {api_provider}")
-            return {"error": f"Unknown API provider: {api_provider}"}
+            gemini_model = _get_gemini_model(api_key, model, prompt.system)
+            response = gemini_model.generate_content(
+                _gemini_contents(prompt, partial),
+                request_options={"timeout": timeout},
+                **_gemini_options(prompt, model, partial),
+            )
+            content = response.text
+    except Exception as e:
+        _record_completion(api_provider, model, started, False)
+        _penalize_rate_limit(limiter, e)
+        raise
+
+    _record_completion(api_provider, model, started, True, response)
+    limiter.record_usage(_total_tokens(response), estimated_tokens)
+    return content
 
-        if response_content is None:
-            logger.error("LLM returned no content.")
-            return {"error": "LLM returned no content."}
 
-        # Clean response content for markdown code blocks
-        json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", response_content)
-        if json_match:
-            cleaned_content = json_match.group(1)
+def _request_completion(
+    api_provider: str,
+    api_key: str,
+    model: str,
+    prompt: Prompt,
+    partial: Optional[str] = None,
+    deadline_at: Optional[float] = None,
+) -> Optional[str]:
+    """
+    Выполняет запрос к провайдеру и возвращает текст ответа модели.
+
+    Временные сбои повторяются по retry_policy в пределах общего дедлайна
+    (deadline_at, если запрос — этап более длинной генерации), а пока цепь
+    провайдера разомкнута, запрос отклоняется сразу.
+    """
+    return retry_policy.call(
+        lambda timeout: _request_completion_once(
+            api_provider, api_key, model, prompt, timeout, partial
+        ),
+        _is_retryable_error,
+        circuit_breakers.get(api_provider),
+        _is_provider_failure,
+        deadline_at,
+    )
+
+
+async def _request_completion_async_once(
+    api_provider: str,
+    api_key: str,
+    model: str,
+    prompt: Prompt,
+    timeout: float,
+    partial: Optional[str] = None,
+) -> Optional[str]:
+    limiter = rate_limiters.get(api_provider, api_key, model)
+    estimated_tokens = _estimate_tokens(prompt, partial)
+    waited = await limiter.acquire_async(
+        estimated_tokens, min(rate_limiters.max_wait, timeout)
+    )
+    timeout = _after_wait(api_provider, model, timeout, waited)
+    started = time.perf_counter()
+    try:
+        if api_provider in CHAT_PROVIDERS:
+            async with _ASYNC_CLIENT_FACTORIES[api_provider](api_key) as client:
+                response = await client.chat.completions.create(
+                    **_chat_request(api_provider, prompt, model, partial),
+                    timeout=timeout,
+                )
+            content = response.choices[0].message.content
         else:
-            # If no markdown block found, assume the content is raw JSON
-            cleaned_content = response_content
+            async with _ASYNC_CLIENT_FACTORIES["gemini"](api_key) as client:
+                gemini_model = genai.GenerativeModel(  # type: ignore
+                    model, system_instruction=prompt.system
+                )
+                gemini_model._async_client = client
+                response = await gemini_model.generate_content_async(
+                    _gemini_contents(prompt, partial),
+                    request_options={"timeout": timeout},
+                    **_gemini_options(prompt, model, partial),
+                )
+            content = response.text
+    except Exception as e:
+        _record_completion(api_provider, model, started, False)
+        _penalize_rate_limit(limiter, e)
+        raise
+
+    _record_completion(api_provider, model, started, True, response)
+    limiter.record_usage(_total_tokens(response), estimated_tokens)
+    return content
+
+
+async def _request_completion_async(
+    api_provider: str,
+    api_key: str,
+    model: str,
+    prompt: Prompt,
+    partial: Optional[str] = None,
+    deadline_at: Optional[float] = None,
+) -> Optional[str]:
+    """
+    Асинхронный вариант _request_completion.
+
+    Асинхронные клиенты привязаны к event loop, в котором созданы, поэтому
+    они не кладутся в пул, а создаются и закрываются в рамках вызова.
+    """
+    return await retry_policy.call_async(
+        lambda timeout: _request_completion_async_once(
+            api_provider, api_key, model, prompt, timeout, partial
+        ),
+        _is_retryable_error,
+        circuit_breakers.get(api_provider),
+        _is_provider_failure,
+        deadline_at,
+    )
+
+
+class ModelResponse(NamedTuple):
+    """Текст ответа модели и JSON-объект, найденный в нём (None — не найден)."""
+
+    text: Optional[str]
+    extracted: Optional[ExtractedJSON]
+
+
+def _extract_response(content: Optional[str]) -> ModelResponse:
+    if not content:
+        return ModelResponse(content, None)
+    # Ответ может быть обёрнут в ```json-блок.
+    json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", content)
+    cleaned_content = json_match.group(1) if json_match else content
+    return ModelResponse(content, extract_json_object(cleaned_content))
+
+
+def _parse_quest_response(
+    response: ModelResponse, api_provider: str, model: str
+) -> Dict[str, Any]:
+    """Возвращает JSON квеста, уже извлечённый из ответа модели."""
+    label = model_labels.label(model)
+    with metrics.timer(
+        "quest_stage_seconds", stage="parse", provider=api_provider, model=label
+    ):
+        quest = _extract_quest(response, api_provider, model)
+    if "error" in quest:
+        metrics.inc(
+            "quest_generation_errors_total",
+            provider=api_provider,
+            model=label,
+            error="parse",
+        )
+    return quest
+
+
+def _extract_quest(
+    response: ModelResponse, api_provider: str, model: str
+) -> Dict[str, Any]:
+    if response.text is None:
+        logger.error("LLM returned no content.")
+        return {"error": "LLM returned no content."}
+
+    extracted = response.extracted
+    if extracted is None:
+        logger.error(
+            f"Failed to parse JSON from {api_provider} ({model}). "
+            f"Raw content (original): '{response.text}'. "
+            "Error: no JSON object found"
+        )
+        return {
+            "error": "Модель не смогла сгенерировать валидный JSON. "
+            "Попробуйте изменить сеттинг или выбрать другую модель/провайдера."
+            " (Возможно, модель вернула неполный или некорректный JSON)"
+        }
+    if extracted.truncated:
+        logger.warning(
+            f"Truncated JSON from {api_provider} ({model}) "
+            "was closed after the last complete value"
+        )
+    return extracted.value
+
+
+def _is_truncated(response: ModelResponse) -> bool:
+    return response.extracted is not None and response.extracted.truncated
+
+
+def _continuation_attempts() -> int:
+    return int(os.getenv("JSON_CONTINUATION_ATTEMPTS", "1"))
+
+
+def _continue_truncated(
+    content: Optional[str],
+    api_provider: str,
+    api_key: str,
+    model: str,
+    prompt: Prompt,
+    deadline_at: Optional[float] = None,
+) -> ModelResponse:
+    """
+    Дозапрашивает продолжение оборванного ответа.
+
+    Модель получает свой ответ и просьбу продолжить с места обрыва, поэтому
+    генерирует только недостающий хвост, а не весь квест заново. Возвращает
+    итоговый текст вместе с извлечённым JSON, чтобы не разбирать его повторно.
+    """
+    response = _extract_response(content)
+    for _ in range(_continuation_attempts()):
+        if not _is_truncated(response):
+            break
+        logger.warning(f"Requesting continuation of truncated {api_provider} output")
+        try:
+            more = _request_completion(
+                api_provider,
+                api_key,
+                model,
+                prompt,
+                partial=content,
+                deadline_at=deadline_at,
+            )
+        except Exception as e:
+            logger.warning(f"Continuation request to {api_provider} failed: {e}")
+            break
+        if not more:
+            break
+        content = f"{content}{more}"
+        response = _extract_response(content)
+    return response
+
+
+async def _continue_truncated_async(
+    content: Optional[str],
+    api_provider: str,
+    api_key: str,
+    model: str,
+    prompt: Prompt,
+    deadline_at: Optional[float] = None,
+) -> ModelResponse:
+    """Асинхронный вариант _continue_truncated."""
+    response = _extract_response(content)
+    for _ in range(_continuation_attempts()):
+        if not _is_truncated(response):
+            break
+        logger.warning(f"Requesting continuation of truncated {api_provider} output")
+        try:
+            more = await _request_completion_async(
+                api_provider,
+                api_key,
+                model,
+                prompt,
+                partial=content,
+                deadline_at=deadline_at,
+            )
+        except Exception as e:
+            logger.warning(f"Continuation request to {api_provider} failed: {e}")
+            break
+        if not more:
+            break
+        content = f"{content}{more}"
+        response = _extract_response(content)
+    return response
+
+
+def _error_class(e: Exception) -> str:
+    """Класс ошибки для метрик и сообщения пользователю."""
+    if isinstance(e, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(e, (asyncio.TimeoutError, DeadlineExceeded)):
+        return "timeout"
+    error_message_lower = str(e).lower()
+    if "quota" in error_message_lower or "insufficient_quota" in error_message_lower:
+        return "quota"
+    if "rate limit" in error_message_lower:
+        return "rate_limit"
+    if (
+        "authentication" in error_message_lower
+        or "invalid api key" in error_message_lower
+        or "401" in error_message_lower
+    ):
+        return "auth"
+    if (
+        "model not found" in error_message_lower
+        or "model_not_found" in error_message_lower
+        or "modelnotfounderror" in error_message_lower
+        or "deprecated" in error_message_lower
+        or ("404" in error_message_lower and "model" in error_message_lower)
+    ):
+        return "model_not_found"
+    return "other"
+
+
+def _classify_error(e: Exception, api_provider: str, model: str) -> Dict[str, Any]:
+    """Превращает исключение провайдера в понятное пользователю сообщение."""
+    logger.error(f"An error occurred while generating quest with {api_provider}: {e}")
+    error_class = _error_class(e)
+    metrics.inc(
+        "quest_generation_errors_total",
+        provider=api_provider,
+        model=model_labels.label(model),
+        error=error_class,
+    )
+    if error_class == "circuit_open":
+        return {
+            "error": f"Провайдер {api_provider} временно недоступен. Попробуйте позже или выберите другого провайдера."
+        }
+    if error_class == "timeout":
+        return {
+            "error": f"Провайдер {api_provider} не ответил вовремя. Попробуйте позже."
+        }
+    # Добавлена проверка на ошибку квоты
+    if error_class == "quota":
+        return {
+            "error": "Превышен лимит использования API или недостаточно средств. Пожалуйста, проверьте ваш тарифный план или баланс."
+        }
+    if error_class == "rate_limit":
+        return {"error": "Превышен лимит запросов к API. Попробуйте позже."}
+    if error_class == "auth":
+        return {"error": "Неверный API ключ. Пожалуйста, проверьте ваш ключ."}
+    if error_class == "model_not_found":
+        return {
+            "error": f"Выбранная модель '{model}' не найдена, недоступна или устарела у провайдера {api_provider}. Попробуйте другую модель."
+        }
+
+    return {"error": f"Произошла ошибка при обращении к API {api_provider}: {str(e)}"}
+
+
+def _unknown_provider(api_provider: str) -> Dict[str, Any]:
+    logger.error(f"Unknown API provider: {api_provider}")
+    return {"error": f"Unknown API provider: {api_provider}"}
+
+
+NO_NODES_MESSAGE = (
+    "Модель вернула квест без узлов. Попробуйте сгенерировать квест ещё раз "
+    "или выберите другую модель."
+)
+
+
+def _get_repair_prompt(quest: Dict[str, Any], issues: List[Issue]) -> Prompt:
+    """Промпт для перегенерации только сломанных узлов квеста."""
+    broken = set(broken_node_ids(issues))
+    outline = "\n".join(
+        f"- {node['id']}: {node.get('title', '')} ({node.get('type', '')})"
+        for node in quest["nodes"]
+    )
+    broken_nodes = [node for node in quest["nodes"] if node["id"] in broken]
+    problems = []
+    for issue in issues:
+        if issue.code == DEAD_END:
+            problems.append(f"- узел {issue.node_id}: не концовка, но без выборов")
+        elif issue.code == NO_PATH_TO_ENDING:
+            problems.append(f"- узел {issue.node_id}: из него нельзя дойти до концовки")
+        elif issue.code == MISSING_ENDING:
+            problems.append(f"- в квесте нет достижимой концовки {issue.detail}")
+    return REPAIR_TEMPLATE.render(
+        title=quest.get("questTitle", ""),
+        outline=outline,
+        broken_nodes=json.dumps(broken_nodes, ensure_ascii=False),
+        problems="\n".join(problems),
+    )
+
+
+def _prepare_repair(
+    quest: Dict[str, Any],
+) -> Tuple[Dict[str, Any], List[Issue], Optional[str]]:
+    # Возвращает починенный локально квест, оставшиеся проблемы и промпт
+    # для перегенерации узлов (None, если она не нужна).
+    if "error" in quest:
+        return quest, [], None
+    errors = schema_errors(quest, QUEST_SCHEMA)
+    if errors:
+        logger.warning(f"Quest does not match the schema: {errors[:5]}")
+    quest, issues = repair_quest(quest)
+    if any(issue.code == NO_NODES for issue in issues):
+        logger.error("Generated quest has no nodes")
+        return {"error": NO_NODES_MESSAGE}, [], None
+    needs_regeneration = any(issue.code in REGENERATE_CODES for issue in issues)
+    if needs_regeneration and os.getenv("QUEST_REPAIR_REGENERATE", "1") == "1":
+        return quest, issues, _get_repair_prompt(quest, issues)
+    return quest, issues, None
+
+
+def _finish_repair(
+    quest: Dict[str, Any],
+    issues: List[Issue],
+    regenerated: Optional[str],
+    api_provider: str,
+    model: str,
+) -> Tuple[Dict[str, Any], List[Issue]]:
+    if "error" in quest or not issues:
+        return quest, issues
+    extracted = extract_json_object(regenerated) if regenerated else None
+    if extracted is not None and isinstance(extracted.value.get("nodes"), list):
+        quest, issues = repair_quest(merge_nodes(quest, extracted.value["nodes"]))
+    if any(issue.code in REGENERATE_CODES for issue in issues):
+        quest, issues = repair_quest(close_dead_ends(quest))
+    if issues:
+        codes = sorted({issue.code for issue in issues})
+        logger.warning(f"Quest from {api_provider} ({model}) still has issues: {codes}")
+    return quest, issues
+
+
+def _is_complete(response: ModelResponse, issues: List[Issue]) -> bool:
+    # Недостижимые узлы игрок не увидит, поэтому квест с ними готов к
+    # кэшированию; остальные проблемы и оборванный ответ — нет.
+    return not _is_truncated(response) and all(
+        issue.code == UNREACHABLE for issue in issues
+    )
+
+
+def _record_validate(api_provider: str, model: str, elapsed: float) -> None:
+    # Одна запись на проверку квеста; перегенерация узлов — запрос к
+    # провайдеру — учитывается в метриках запросов, а не здесь.
+    metrics.observe(
+        "quest_stage_seconds",
+        elapsed,
+        stage="validate",
+        provider=api_provider,
+        model=model_labels.label(model),
+    )
+
 
+def _validate_quest(
+    quest: Dict[str, Any],
+    api_provider: str,
+    api_key: str,
+    model: str,
+    deadline_at: Optional[float] = None,
+) -> Tuple[Dict[str, Any], List[Issue]]:
+    """
+    Проверяет граф квеста и чинит его.
+
+    Структурные ошибки исправляются локально; тупики и отсутствующие
+    концовки — перегенерацией только сломанных узлов, а если она не помогла,
+    тупики превращаются в концовки. Возвращает квест и проблемы, которые
+    остались после починки.
+    """
+    started = time.perf_counter()
+    quest, issues, prompt = _prepare_repair(quest)
+    elapsed = time.perf_counter() - started
+    regenerated = None
+    if prompt is not None:
+        try:
+            regenerated = _request_completion(
+                api_provider, api_key, model, prompt, deadline_at=deadline_at
+            )
+        except Exception as e:
+            logger.warning(f"Node regeneration with {api_provider} failed: {e}")
+    started = time.perf_counter()
+    result = _finish_repair(quest, issues, regenerated, api_provider, model)
+    _record_validate(api_provider, model, elapsed + time.perf_counter() - started)
+    return result
+
+
+async def _validate_quest_async(
+    quest: Dict[str, Any],
+    api_provider: str,
+    api_key: str,
+    model: str,
+    deadline_at: Optional[float] = None,
+) -> Tuple[Dict[str, Any], List[Issue]]:
+    """Асинхронный вариант _validate_quest."""
+    started = time.perf_counter()
+    quest, issues, prompt = _prepare_repair(quest)
+    elapsed = time.perf_counter() - started
+    regenerated = None
+    if prompt is not None:
         try:
-            return json.loads(cleaned_content)
-        except json.JSONDecodeError as e:
-            logger.error(
-                f"Failed to parse JSON from {api_provider} ({model}). "
-                f"Raw content (original): '{response_content}'. "
-                f"Cleaned content: '{cleaned_content}'. Error: {e}"
+            regenerated = await _request_completion_async(
+                api_provider, api_key, model, prompt, deadline_at=deadline_at
             )
-            return {
-                "error": "Модель не смогла сгенерировать валидный JSON. "
-                "Попробуйте изменить сеттинг или выбрать другую модель/провайдера."
-                " (Возможно, модель вернула неполный или некорректный JSON)"
-            }
+        except Exception as e:
+            logger.warning(f"Node regeneration with {api_provider} failed: {e}")
+    started = time.perf_counter()
+    result = _finish_repair(quest, issues, regenerated, api_provider, model)
+    _record_validate(api_provider, model, elapsed + time.perf_counter() - started)
+    return result
 
+
+def _generate_quest(
+    setting_text: str, api_key: str, api_provider: str, model: str
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Генерирует квест запросом к провайдеру, минуя кэш.
+
+    Возвращает квест и признак того, что он полный и его можно кэшировать.
+    Запрос, дозапросы продолжения и перегенерация узлов укладываются в один
+    общий дедлайн.
+    """
+    prompt = _get_master_prompt(setting_text)
+    deadline_at = retry_policy.deadline_from_now()
+    try:
+        response_content = _request_completion(
+            api_provider, api_key, model, prompt, deadline_at=deadline_at
+        )
     except Exception as e:
-        logger.error(
-            f"An error occurred while generating quest with {api_provider}: {e}"
+        return _classify_error(e, api_provider, model), False
+
+    response = _continue_truncated(
+        response_content, api_provider, api_key, model, prompt, deadline_at
+    )
+
+    quest = _parse_quest_response(response, api_provider, model)
+    quest, issues = _validate_quest(quest, api_provider, api_key, model, deadline_at)
+    return quest, _is_complete(response, issues)
+
+
+def _store_in_cache(cache_key: str, quest: Dict[str, Any], complete: bool) -> None:
+    # Ошибки не кэшируются: следующая попытка должна снова обратиться к API.
+    # Квест, оставшийся оборванным после дозапроса или с проблемами графа
+    # после починки, тоже: он отдаётся пользователю, но повторный запрос
+    # может получить полный и корректный квест.
+    if complete and "error" not in quest:
+        quest_cache.set(cache_key, quest)
+
+
+def _cache_recheck(
+    cache_key: str, use_cache: bool
+) -> Optional[Callable[[], Optional[Dict[str, Any]]]]:
+    # Пока лидер ждал блокировку другого воркера, тот мог уже сохранить результат.
+    return (lambda: quest_cache.get(cache_key)) if use_cache else None
+
+
+def _flight_key(cache_key: str, api_key: str) -> str:
+    # Ошибки лидера (неверный ключ, исчерпанная квота) относятся к его ключу
+    # API, поэтому одновременные вызовы объединяются только с тем же ключом.
+    return f"{cache_key}-{hash_api_key(api_key)}"
+
+
+def create_quest_from_setting(
+    setting_text: str,
+    api_key: str,
+    api_provider: str,
+    model: str,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Генерирует квест, используя указанного API-провайдера.
+
+    Результат берётся из кэша, если такой же сеттинг уже генерировался
+    той же моделью; use_cache=False принудительно запрашивает новый квест.
+    """
+    if not _is_supported(api_provider):
+        return _unknown_provider(api_provider)
+
+    cache_key = make_cache_key(
+        setting_text, api_provider, model, QUEST_TEMPLATE.version_id
+    )
+    if use_cache:
+        cached = quest_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    def generate() -> Dict[str, Any]:
+        quest, complete = _generate_quest(setting_text, api_key, api_provider, model)
+        _store_in_cache(cache_key, quest, complete)
+        return quest
+
+    # Одновременные одинаковые запросы ждут один вызов провайдера.
+    return single_flight.do(
+        _flight_key(cache_key, api_key),
+        generate,
+        recheck=_cache_recheck(cache_key, use_cache),
+    )
+
+
+ROUTE_FIELDS = ("api_provider", "model", "api_key")
+
+
+class InvalidQuestResponse(Exception):
+    """Провайдер ответил, но квест из ответа получить не удалось."""
+
+    def __init__(self, quest: Dict[str, Any]):
+        super().__init__(quest["error"])
+        self.quest = quest
+
+
+def _is_fallback_error(e: BaseException) -> bool:
+    # Невалидный ответ одной модели не означает, что другая ответит так же.
+    return isinstance(e, InvalidQuestResponse) or _is_transient_error(e)
+
+
+async def create_quest_routed_async(
+    setting_text: str, routes: List[Dict[str, Any]], use_cache: bool = True
+) -> Dict[str, Any]:
+    """
+    Генерирует квест по ранжированному списку маршрутов (провайдер, модель, ключ).
+
+    Медленный маршрут дублируется запросом к следующему, при 5xx и таймаутах
+    запрос сразу переходит к следующему маршруту (см. LatencyRouter).
+    Возвращает квест первого успешного маршрута или ошибку последнего.
+    """
+    for route in routes:
+        if not _is_supported(route["api_provider"]):
+            return _unknown_provider(route["api_provider"])
+
+    def cache_key(route: Dict[str, Any]) -> str:
+        return make_cache_key(
+            setting_text,
+            route["api_provider"],
+            route["model"],
+            QUEST_TEMPLATE.version_id,
         )
-        error_message_lower = str(e).lower()
-        # Добавлена проверка на ошибку квоты
-        if (
-            "quota" in error_message_lower
-            or "insufficient_quota" in error_message_lower
-        ):
-            return {
-                "error": "Превышен лимит использования API или недостаточно средств. Пожалуйста, проверьте ваш тарифный план или баланс."
-            }
-        if "rate limit" in error_message_lower:
-            return {"error": "Превышен лимит запросов к API. Попробуйте позже."}
-        if (
-            "authentication" in error_message_lower
-            or "invalid api key" in error_message_lower
-            or "401" in error_message_lower
-        ):
-            return {"error": "Неверный API ключ. Пожалуйста, проверьте ваш ключ."}
-        if (
-            "model not found" in error_message_lower
-            or "model_not_found" in error_message_lower
-            or "modelnotfounderror" in error_message_lower
-            or "deprecated" in error_message_lower
-            or ("404" in error_message_lower and "model" in error_message_lower)
+
+    if use_cache:
+        for route in routes:
+            cached = quest_cache.get(cache_key(route))
+            if cached is not None:
+                return cached
+
+    prompt = _get_master_prompt(setting_text)
+    timeout = float(os.getenv("ROUTING_ATTEMPT_TIMEOUT", "120"))
+
+    async def request(route: Dict[str, Any], deadline_at: float) -> ModelResponse:
+        args = (route["api_provider"], route["api_key"], route["model"], prompt)
+        content = await _request_completion_async(*args, deadline_at=deadline_at)
+        return await _continue_truncated_async(content, *args, deadline_at)
+
+    async def attempt(route: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        deadline_at = retry_policy.deadline_from_now()
+        response = await asyncio.wait_for(request(route, deadline_at), timeout)
+        quest = _parse_quest_response(response, route["api_provider"], route["model"])
+        quest, issues = await _validate_quest_async(
+            quest,
+            route["api_provider"],
+            route["api_key"],
+            route["model"],
+            deadline_at,
+        )
+        if "error" in quest:
+            raise InvalidQuestResponse(quest)
+        return quest, _is_complete(response, issues)
+
+    try:
+        route, (quest, complete) = await latency_router.race(
+            routes, attempt, _is_fallback_error
+        )
+    except RoutesExhausted as e:
+        route, error = e.errors[-1]
+        if isinstance(error, InvalidQuestResponse):
+            return error.quest
+        return _classify_error(error, route["api_provider"], route["model"])
+
+    logger.info(f"Routed generation served by {route['api_provider']}/{route['model']}")
+    _store_in_cache(cache_key(route), quest, complete)
+    return quest
+
+
+def get_provider_status() -> Dict[str, Any]:
+    """Состояние цепей провайдеров и статистика задержек в текущем воркере."""
+    return {
+        "circuit_breakers": circuit_breakers.snapshot(),
+        "latency": latency_router.snapshot(),
+    }
+
+
+def _stream_request(api_provider: str, prompt: Prompt, model: str) -> Dict[str, Any]:
+    request = _chat_request(api_provider, prompt, model)
+    # OpenAI-совместимые API сообщают расход токенов в потоке только по
+    # запросу; Groq присылает его сам, а его SDK не знает stream_options.
+    if api_provider != "groq":
+        request["stream_options"] = {"include_usage": True}
+    return request
+
+
+def _stream_chunks(
+    api_provider: str, api_key: str, model: str, prompt: Prompt, timeout: float
+) -> Iterator[str]:
+    limiter = rate_limiters.get(api_provider, api_key, model)
+    estimated_tokens = _estimate_tokens(prompt)
+    waited = limiter.acquire(estimated_tokens, min(rate_limiters.max_wait, timeout))
+    timeout = _after_wait(api_provider, model, timeout, waited)
+    # Последний фрагмент с расходом токенов (у Gemini он есть в каждом).
+    final = None
+    started = time.perf_counter()
+    try:
+        if api_provider in CHAT_PROVIDERS:
+            client = _get_client(api_provider, api_key)
+            stream = client.chat.completions.create(
+                **_stream_request(api_provider, prompt, model),
+                stream=True,
+                timeout=timeout,
+            )
+            for chunk in stream:
+                if _chat_usage(chunk) is not None:
+                    final = chunk
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        else:
+            gemini_model = _get_gemini_model(api_key, model, prompt.system)
+            # Для gRPC-потока таймаут — дедлайн всего ответа, поэтому зависший
+            # поток не держит воркер дольше общего дедлайна запроса.
+            chunks = gemini_model.generate_content(
+                prompt.user,
+                stream=True,
+                request_options={"timeout": timeout},
+                **_gemini_options(prompt, model),
+            )
+            for chunk in chunks:
+                final = chunk
+                # Служебные фрагменты (например, с finish_reason) не содержат текста.
+                if chunk.parts:
+                    yield chunk.text
+    except Exception as e:
+        _record_completion(api_provider, model, started, False)
+        _penalize_rate_limit(limiter, e)
+        raise
+
+    _record_completion(api_provider, model, started, True, final)
+    limiter.record_usage(_total_tokens(final), estimated_tokens)
+
+
+def _stream_completion(
+    api_provider: str, api_key: str, model: str, prompt: Prompt, deadline_at: float
+) -> Iterator[str]:
+    """
+    Запрашивает ответ в потоковом режиме и отдаёт фрагменты текста.
+
+    Повторяется только установка потока (до первого фрагмента): после него
+    клиент уже получил часть ответа.
+    """
+
+    def open_stream(timeout: float) -> Tuple[Optional[str], Iterator[str]]:
+        chunks = _stream_chunks(api_provider, api_key, model, prompt, timeout)
+        started = time.perf_counter()
+        first = next(chunks, None)
+        # Провайдер начал отвечать, поэтому модель получает собственную метку.
+        model_labels.allow(model)
+        metrics.observe(
+            "quest_stage_seconds",
+            time.perf_counter() - started,
+            stage="ttft",
+            provider=api_provider,
+            model=model_labels.label(model),
+        )
+        return first, chunks
+
+    first, chunks = retry_policy.call(
+        open_stream,
+        _is_retryable_error,
+        circuit_breakers.get(api_provider),
+        _is_provider_failure,
+        deadline_at,
+    )
+    if first is None:
+        return
+    yield first
+    yield from chunks
+
+
+def stream_quest_from_setting(
+    setting_text: str,
+    api_key: str,
+    api_provider: str,
+    model: str,
+    use_cache: bool = True,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Генерирует квест в потоковом режиме.
+
+    Отдаёт события ("token", {"text": ...}) по мере поступления текста,
+    ("node", {"node": ...}) для каждого завершённого узла и в конце либо
+    ("result", квест), либо ("error", {"error": ...}).
+    """
+    if not _is_supported(api_provider):
+        yield "error", _unknown_provider(api_provider)
+        return
+
+    cache_key = make_cache_key(
+        setting_text, api_provider, model, QUEST_TEMPLATE.version_id
+    )
+    cached = quest_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        for node in cached.get("nodes") or []:
+            yield "node", {"node": node}
+        yield "result", cached
+        return
+
+    prompt = _get_master_prompt(setting_text)
+    parser = QuestNodeStreamParser()
+    deadline_at = retry_policy.deadline_from_now()
+    try:
+        for text in _stream_completion(
+            api_provider, api_key, model, prompt, deadline_at
         ):
-            return {
-                "error": f"Выбранная модель '{model}' не найдена, недоступна или устарела у провайдера {api_provider}. Попробуйте другую модель."
-            }
+            yield "token", {"text": text}
+            for node in parser.feed(text):
+                yield "node", {"node": node}
+    except Exception as e:
+        yield "error", _classify_error(e, api_provider, model)
+        return
 
-        return {
-            "error": f"Произошла ошибка при обращении к API {api_provider}: {str(e)}"
+    streamed = parser.text
+    response = _continue_truncated(
+        streamed or None, api_provider, api_key, model, prompt, deadline_at
+    )
+    if response.text and response.text != streamed:
+        offset = len(streamed)
+        tail = response.text[offset:]
+        yield "token", {"text": tail}
+        for node in parser.feed(tail):
+            yield "node", {"node": node}
+
+    quest = _parse_quest_response(response, api_provider, model)
+    quest, issues = _validate_quest(quest, api_provider, api_key, model, deadline_at)
+    _store_in_cache(cache_key, quest, _is_complete(response, issues))
+    yield ("error" if "error" in quest else "result"), quest
+
+
+def _get_outline_prompt(setting_text: str, node_count: int) -> Prompt:
+    """Промпт первого этапа: только скелет графа квеста."""
+    return OUTLINE_TEMPLATE.render(setting=setting_text, node_count=node_count)
+
+
+def _get_expand_prompt(
+    setting_text: str, outline: Dict[str, Any], batch: List[Dict[str, Any]]
+) -> Prompt:
+    """Промпт второго этапа: описания и тексты выборов для группы узлов."""
+    titles = {node["id"]: node.get("title", "") for node in outline["nodes"]}
+    scenes = []
+    for node in batch:
+        exits = ", ".join(
+            f"{choice['targetNodeId']} ({titles.get(choice['targetNodeId'], '')})"
+            for choice in node.get("choices") or []
+        )
+        scenes.append(
+            f"- {node['id']}: {node.get('title', '')} ({node.get('type', '')});"
+            f" переходы: {exits or 'нет'}"
+        )
+    return EXPAND_TEMPLATE.render(
+        title=outline.get("questTitle", ""),
+        setting=setting_text,
+        scenes="\n".join(scenes),
+    )
+
+
+def _apply_expansion(
+    nodes_by_id: Dict[str, Dict[str, Any]], expanded: List[Any]
+) -> None:
+    # Переходы берутся из скелета: модель дописывает только тексты.
+    for update in expanded:
+        if not isinstance(update, dict):
+            continue
+        node = nodes_by_id.get(update.get("id"))
+        if node is None:
+            continue
+        if update.get("description"):
+            node["description"] = update["description"]
+        texts = {
+            choice.get("targetNodeId"): choice.get("text")
+            for choice in update.get("choices") or []
+            if isinstance(choice, dict)
         }
+        for choice in node.get("choices") or []:
+            if texts.get(choice["targetNodeId"]):
+                choice["text"] = texts[choice["targetNodeId"]]
 
 
-def validate_api_key(api_provider: str, api_key: str) -> Dict[str, Any]:
+def _fill_from_outline(nodes_by_id: Dict[str, Dict[str, Any]]) -> None:
+    # Узлы, которые дописать не удалось, сохраняют текст скелета: описанием
+    # служит название сцены, текстом выбора — название следующей.
+    for node in nodes_by_id.values():
+        node.setdefault("description", node.get("title", ""))
+        for choice in node.get("choices") or []:
+            target = nodes_by_id.get(choice["targetNodeId"], {})
+            choice.setdefault("text", target.get("title", ""))
+
+
+async def create_quest_hierarchical_async(
+    setting_text: str,
+    api_key: str,
+    api_provider: str,
+    model: str,
+    node_count: Optional[int] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Генерирует большой квест в два этапа.
+
+    Первый запрос строит скелет графа (id, названия, типы, переходы), затем
+    описания узлов дописываются группами по HIERARCHICAL_BATCH_SIZE узлов,
+    не больше HIERARCHICAL_CONCURRENCY запросов одновременно. Группа,
+    которую не удалось дописать и со второй попытки, остаётся с текстом
+    скелета, а квест не кэшируется. Собранный квест проходит ту же проверку
+    графа, что и обычная генерация.
+    """
+    if not _is_supported(api_provider):
+        return _unknown_provider(api_provider)
+
+    node_count = node_count or int(os.getenv("HIERARCHICAL_NODE_COUNT", "30"))
+    prompt_version = f"{OUTLINE_TEMPLATE.version_id}+{EXPAND_TEMPLATE.version_id}"
+    cache_key = make_cache_key(
+        setting_text, api_provider, model, f"{prompt_version}:{node_count}"
+    )
+    if use_cache:
+        cached = quest_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    outline_prompt = _get_outline_prompt(setting_text, node_count)
+    try:
+        content = await _request_completion_async(
+            api_provider, api_key, model, outline_prompt
+        )
+    except Exception as e:
+        return _classify_error(e, api_provider, model)
+    response = await _continue_truncated_async(
+        content, api_provider, api_key, model, outline_prompt
+    )
+    outline, issues = repair_quest(_parse_quest_response(response, api_provider, model))
+    if "error" in outline:
+        return outline
+    if any(issue.code == NO_NODES for issue in issues):
+        return {"error": NO_NODES_MESSAGE}
+
+    nodes = outline["nodes"]
+    batch_size = max(1, int(os.getenv("HIERARCHICAL_BATCH_SIZE", "10")))
+    batches = []
+    for start in range(0, len(nodes), batch_size):
+        end = start + batch_size
+        batches.append(nodes[start:end])
+    semaphore = asyncio.Semaphore(int(os.getenv("HIERARCHICAL_CONCURRENCY", "4")))
+
+    async def expand(batch: List[Dict[str, Any]]) -> List[Any]:
+        prompt = _get_expand_prompt(setting_text, outline, batch)
+        async with semaphore:
+            expanded = await _request_completion_async(
+                api_provider, api_key, model, prompt
+            )
+        extracted = extract_json_object(expanded or "")
+        return (extracted.value.get("nodes") or []) if extracted else []
+
+    nodes_by_id = {node["id"]: node for node in nodes}
+    # Неудавшиеся группы запрашиваются ещё раз, остальные не повторяются.
+    for _ in range(2):
+        results = await asyncio.gather(
+            *(expand(batch) for batch in batches), return_exceptions=True
+        )
+        failed = []
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                logger.warning(
+                    f"Expansion of {len(batch)} nodes with {api_provider} failed: {result}"
+                )
+                failed.append(batch)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                _apply_expansion(nodes_by_id, result)
+        batches = failed
+        if not batches:
+            break
+    _fill_from_outline(nodes_by_id)
+
+    quest, issues = await _validate_quest_async(outline, api_provider, api_key, model)
+    complete = not batches and _is_complete(response, issues)
+    _store_in_cache(cache_key, quest, complete)
+    return quest
+
+
+def _get_regenerate_prompt(
+    quest: Dict[str, Any], node_ids: List[str], instruction: Optional[str]
+) -> Prompt:
+    """Промпт для переписывания выбранных узлов с минимальным контекстом."""
+    graph = QuestGraph(quest)
+    selected = [graph.index[node_id] for node_id in node_ids]
+    neighbours = "\n".join(
+        f"- {node_id}: {graph.index[node_id].get('title', '')} "
+        f"({graph.index[node_id].get('type', '')})"
+        for node_id in graph.neighbours(node_ids)
+    )
+    return REGENERATE_TEMPLATE.render(
+        title=quest.get("questTitle", ""),
+        selected=json.dumps(selected, ensure_ascii=False),
+        neighbours=neighbours or "нет",
+        instruction=instruction or "нет",
+    )
+
+
+def _splice_nodes(
+    quest: Dict[str, Any], node_ids: List[str], new_nodes: List[Any]
+) -> Dict[str, Any]:
+    # Узлы с id из node_ids заменяются, узлы с новыми id добавляются, а
+    # остальные узлы квеста модель переписать не может. Поля, которых нет
+    # в ответе, берутся из исходного узла, поэтому входящие рёбра и тип
+    # узла сохраняются.
+    graph = QuestGraph(quest)
+    selected = set(node_ids)
+    spliced = []
+    for node in new_nodes:
+        if not isinstance(node, dict) or not isinstance(node.get("id"), str):
+            continue
+        if node["id"] in selected:
+            spliced.append({**graph.index[node["id"]], **node})
+        elif node["id"] not in graph.index:
+            spliced.append(node)
+    return merge_nodes(quest, spliced)
+
+
+async def regenerate_quest_nodes_async(
+    quest: Dict[str, Any],
+    node_ids: List[str],
+    api_key: str,
+    api_provider: str,
+    model: str,
+    instruction: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Переписывает отдельные узлы готового квеста.
+
+    Провайдер получает только название квеста, выбранные узлы и их соседей.
+    Ответ вклеивается в квест, после чего граф проверяется и чинится так же,
+    как при обычной генерации, чтобы все переходы вели на существующие узлы.
+    """
+    if not _is_supported(api_provider):
+        return _unknown_provider(api_provider)
+
+    prompt = _get_regenerate_prompt(quest, node_ids, instruction)
+    deadline_at = retry_policy.deadline_from_now()
+    try:
+        content = await _request_completion_async(
+            api_provider, api_key, model, prompt, deadline_at=deadline_at
+        )
+    except Exception as e:
+        return _classify_error(e, api_provider, model)
+    regenerated = await _continue_truncated_async(
+        content, api_provider, api_key, model, prompt, deadline_at
+    )
+    response = _parse_quest_response(regenerated, api_provider, model)
+    if "error" in response:
+        return response
+    nodes = response.get("nodes")
+    if not isinstance(nodes, list):
+        logger.error(f"Node regeneration response from {api_provider} has no nodes")
+        return {"error": NO_NODES_MESSAGE}
+
+    spliced = _splice_nodes(quest, node_ids, nodes)
+    quest, _ = await _validate_quest_async(
+        spliced, api_provider, api_key, model, deadline_at
+    )
+    return quest
+
+
+BATCH_ITEM_FIELDS = ("setting", "api_key", "api_provider", "model")
+
+
+def _run_batch_item(item: Dict[str, Any], use_cache: bool) -> Dict[str, Any]:
+    try:
+        return create_quest_from_setting(
+            item["setting"],
+            item["api_key"],
+            item["api_provider"],
+            item["model"],
+            use_cache=use_cache,
+        )
+    except Exception as e:
+        return _classify_error(e, item["api_provider"], item["model"])
+
+
+def generate_quests_batch(
+    items: List[Any],
+    defaults: Optional[Dict[str, Any]] = None,
+    concurrency: Union[int, Dict[str, int], None] = None,
+    use_cache: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Генерирует несколько квестов параллельно и отдаёт результаты по готовности.
+
+    Элемент items — строка сеттинга или словарь с полями setting, api_key,
+    api_provider, model; недостающие поля берутся из defaults. Для каждого
+    провайдера одновременно выполняется не больше concurrency[provider]
+    запросов; число вместо словаря задаёт общий лимит для всех провайдеров
+    (по умолчанию BATCH_CONCURRENCY). Результаты отдаются в порядке
+    завершения в виде {"index": i, "result": квест} или {"index": i, "error": ...}.
+    """
+    defaults = defaults or {}
+    default_limit = int(os.getenv("BATCH_CONCURRENCY", "4"))
+    if isinstance(concurrency, int):
+        default_limit, concurrency = concurrency, {}
+    concurrency = concurrency or {}
+
+    executors: Dict[str, ThreadPoolExecutor] = {}
+    futures = {}
+    try:
+        for index, raw_item in enumerate(items):
+            item = {"setting": raw_item} if isinstance(raw_item, str) else raw_item
+            item = {**defaults, **item} if isinstance(item, dict) else None
+            if item is None or not all(
+                isinstance(item.get(f), str) and item[f] for f in BATCH_ITEM_FIELDS
+            ):
+                yield {
+                    "index": index,
+                    "error": "Missing 'setting', 'api_key', 'api_provider' or 'model'",
+                }
+                continue
+
+            provider = item["api_provider"]
+            if provider not in executors:
+                # Отдельный пул на провайдера ограничивает его параллелизм.
+                executors[provider] = ThreadPoolExecutor(
+                    max_workers=max(1, concurrency.get(provider, default_limit)),
+                    thread_name_prefix=f"batch-{provider}",
+                )
+            future = executors[provider].submit(_run_batch_item, item, use_cache)
+            futures[future] = index
+
+        for future in as_completed(futures):
+            quest = future.result()
+            if "error" in quest:
+                yield {"index": futures[future], "error": quest["error"]}
+            else:
+                yield {"index": futures[future], "result": quest}
+    finally:
+        # Если клиент отключился, ещё не начатые генерации отменяются.
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_generation_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    if job.get("hierarchical"):
+        return asyncio.run(
+            create_quest_hierarchical_async(
+                job["setting"],
+                job["api_key"],
+                job["api_provider"],
+                job["model"],
+                node_count=job.get("node_count"),
+                use_cache=job.get("use_cache", True),
+            )
+        )
+    return create_quest_from_setting(
+        job["setting"],
+        job["api_key"],
+        job["api_provider"],
+        job["model"],
+        use_cache=job.get("use_cache", True),
+    )
+
+
+def submit_generation_job(
+    setting_text: str,
+    api_key: str,
+    api_provider: str,
+    model: str,
+    use_cache: bool = True,
+    hierarchical: bool = False,
+    node_count: Optional[int] = None,
+) -> str:
+    """
+    Ставит генерацию в фоновую очередь и возвращает id задачи.
+
+    hierarchical=True включает двухэтапную генерацию большого квеста
+    (см. create_quest_hierarchical_async). Бросает QueueFullError, если
+    очередь заполнена.
+    """
+    payload = {
+        "setting": setting_text,
+        "api_provider": api_provider,
+        "model": model,
+        "use_cache": use_cache,
+        "hierarchical": hierarchical,
+        "node_count": node_count,
+    }
+    return get_job_queue(_run_generation_job).submit(payload, {"api_key": api_key})
+
+
+def get_generation_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Возвращает статус фоновой генерации или None, если задача не найдена."""
+    return get_job_queue(_run_generation_job).get(job_id)
+
+
+def _is_auth_error(message: str) -> bool:
+    return "401" in message or "invalid" in message.lower()
+
+
+def _check_api_key(api_provider: str, api_key: str) -> Dict[str, Any]:
     """Проверяет валидность API-ключа, делая легковесный запрос к провайдеру."""
+    if not _is_supported(api_provider):
+        return _unknown_provider(api_provider)
     try:
         if api_provider == "groq":
-            client = Groq(api_key=api_key)
+            client = _get_client("groq", api_key)
             client.models.list()  # Простой запрос для проверки аутентификации
             return {"status": "ok"}
-        elif api_provider == "openai":
-            client = openai.OpenAI(api_key=api_key)
+        elif api_provider in ("openai", "fake"):
+            client = _get_client(api_provider, api_key)
             client.models.list()
             return {"status": "ok"}
         elif api_provider == "gemini":
-            genai.configure(api_key=api_key)  # type: ignore[reportPrivateImportUsage]
             # Проверяем, есть ли доступные модели для генерации текста
             models = [
                 m
-                for m in genai.list_models()  # type: ignore[reportPrivateImportUsage]
+                for m in _list_gemini_models(api_key)
                 if "generateContent" in m.supported_generation_methods
             ]
             if not models:
@@ -180,24 +1689,26 @@ def validate_api_key(api_provider: str, api_key: str) -> Dict[str, Any]:
     except Exception as e:
         logger.error(f"API key validation failed for {api_provider}: {e}")
         # Возвращаем более понятное сообщение об ошибке
-        if "401" in str(e) or "invalid" in str(e).lower():
-            return {"status": "error", "message": "Неверный API ключ."}
+        if _is_auth_error(str(e)):
+            return {"status": "error", "message": INVALID_API_KEY_MESSAGE}
         return {
             "status": "error",
             "message": "Ошибка проверки ключа. См. логи сервера.",
         }
 
 
-def get_available_models(api_provider: str, api_key: str) -> Dict[str, Any]:
+def _fetch_available_models(api_provider: str, api_key: str) -> Dict[str, Any]:
     """Получает и фильтрует список доступных моделей."""
+    if not _is_supported(api_provider):
+        return _unknown_provider(api_provider)
     try:
         models_list = []
         if api_provider == "groq":
-            client = Groq(api_key=api_key)
+            client = _get_client("groq", api_key)
             models = client.models.list().data
             models_list = [model.id for model in models]
         elif api_provider == "openai":
-            client = openai.OpenAI(api_key=api_key)
+            client = _get_client("openai", api_key)
             models = client.models.list().data
             # Фильтруем модели, чтобы исключить те, которые не предназначены для генерации текста
             models_list = [
@@ -205,11 +1716,13 @@ def get_available_models(api_provider: str, api_key: str) -> Dict[str, Any]:
                 for model in models
                 if "gpt" in model.id.lower() or "text" in model.id.lower()
             ]
+        elif api_provider == "fake":
+            client = _get_client("fake", api_key)
+            models_list = [model.id for model in client.models.list().data]
         elif api_provider == "gemini":
-            genai.configure(api_key=api_key)  # type: ignore[reportPrivateImportUsage]
             models = [
                 m.name
-                for m in genai.list_models()  # type: ignore[reportPrivateImportUsage]
+                for m in _list_gemini_models(api_key)
                 if "generateContent" in m.supported_generation_methods
             ]
             models_list = models
@@ -230,3 +1743,48 @@ def get_available_models(api_provider: str, api_key: str) -> Dict[str, Any]:
     except Exception as e:
         logger.error(f"Failed to get models for {api_provider}: {e}")
         return {"error": str(e)}
+
+
+def _classify_key_check(result: Dict[str, Any]) -> Optional[str]:
+    if result.get("status") == "ok":
+        return POSITIVE
+    if result.get("message") == INVALID_API_KEY_MESSAGE:
+        return NEGATIVE
+    return None
+
+
+def _classify_models(result: Dict[str, Any]) -> Optional[str]:
+    if "models" in result:
+        return POSITIVE
+    if "error" in result and _is_auth_error(result["error"]):
+        return NEGATIVE
+    return None
+
+
+# Список моделей меняется редко, поэтому результаты проверок ключей и
+# отфильтрованные списки моделей кэшируются на сервере. Неверные ключи
+# кэшируются на короткое время, временные сбои не кэшируются вовсе.
+api_key_cache = RefreshingCache(
+    _check_api_key,
+    _classify_key_check,
+    ttl=float(os.getenv("MODELS_CACHE_TTL", "21600")),
+    negative_ttl=float(os.getenv("MODELS_CACHE_NEGATIVE_TTL", "300")),
+    refresh_ahead=float(os.getenv("MODELS_CACHE_REFRESH_AHEAD", "600")),
+)
+models_cache = RefreshingCache(
+    _fetch_available_models,
+    _classify_models,
+    ttl=float(os.getenv("MODELS_CACHE_TTL", "21600")),
+    negative_ttl=float(os.getenv("MODELS_CACHE_NEGATIVE_TTL", "300")),
+    refresh_ahead=float(os.getenv("MODELS_CACHE_REFRESH_AHEAD", "600")),
+)
+
+
+def validate_api_key(api_provider: str, api_key: str) -> Dict[str, Any]:
+    """Проверяет валидность API-ключа с учётом серверного кэша."""
+    return api_key_cache.get(api_provider, api_key)
+
+
+def get_available_models(api_provider: str, api_key: str) -> Dict[str, Any]:
+    """Возвращает отфильтрованный список моделей с учётом серверного кэша."""
+    return models_cache.get(api_provider, api_key)
@@ -0,0 +1,178 @@
+import copy
+from typing import Any, Dict, List
+
+NODE_TYPES = ("STORY", "CHOICE", "ENDING_SUCCESS", "ENDING_FAILURE")
+
+Schema = Dict[str, Any]
+
+_STRING: Schema = {"type": "string"}
+
+CHOICE_SCHEMA: Schema = {
+    "type": "object",
+    "properties": {"text": _STRING, "targetNodeId": _STRING},
+    "required": ["targetNodeId"],
+}
+
+NODE_SCHEMA: Schema = {
+    "type": "object",
+    "properties": {
+        "id": _STRING,
+        "title": _STRING,
+        "type": {"type": "string", "enum": list(NODE_TYPES)},
+        "description": _STRING,
+        "choices": {"type": "array", "items": CHOICE_SCHEMA},
+    },
+    "required": ["id", "title", "type"],
+}
+
+QUEST_SCHEMA: Schema = {
+    "type": "object",
+    "properties": {
+        "questTitle": _STRING,
+        "startNodeId": _STRING,
+        "nodes": {"type": "array", "items": NODE_SCHEMA},
+    },
+    "required": ["questTitle", "startNodeId", "nodes"],
+}
+
+# Ответ на перегенерацию узлов: только список узлов.
+NODES_SCHEMA: Schema = {
+    "type": "object",
+    "properties": {"nodes": {"type": "array", "items": NODE_SCHEMA}},
+    "required": ["nodes"],
+}
+
+OUTLINE_SCHEMA: Schema = {
+    "type": "object",
+    "properties": {
+        "questTitle": _STRING,
+        "startNodeId": _STRING,
+        "nodes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": _STRING,
+                    "title": _STRING,
+                    "type": NODE_SCHEMA["properties"]["type"],
+                    "choices": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {"targetNodeId": _STRING},
+                            "required": ["targetNodeId"],
+                        },
+                    },
+                },
+                "required": ["id", "title", "type", "choices"],
+            },
+        },
+    },
+    "required": ["questTitle", "startNodeId", "nodes"],
+}
+
+EXPANSION_SCHEMA: Schema = {
+    "type": "object",
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": _STRING,
+                    "description": _STRING,
+                    "choices": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {"text": _STRING, "targetNodeId": _STRING},
+                            "required": ["text", "targetNodeId"],
+                        },
+                    },
+                },
+                "required": ["id", "description", "choices"],
+            },
+        }
+    },
+    "required": ["nodes"],
+}
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+def schema_errors(value: Any, schema: Schema, path: str = "$") -> List[str]:
+    """
+    Проверяет значение по JSON Schema.
+
+    Поддерживается подмножество, которое используют схемы квеста: type,
+    properties, required, items, enum и additionalProperties: false.
+    Возвращает список ошибок вида "$.nodes[0].type: ...".
+    """
+    expected = schema.get("type")
+    python_type = _TYPES.get(expected) if expected else None
+    if python_type is not None and (
+        not isinstance(value, python_type)
+        or (isinstance(value, bool) and expected != "boolean")
+    ):
+        return [f"{path}: expected {expected}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: must be one of {', '.join(map(str, schema['enum']))}"]
+
+    errors: List[str] = []
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for name in schema.get("required", ()):
+            if name not in value:
+                errors.append(f"{path}: missing '{name}'")
+        for name, item in value.items():
+            if name in properties:
+                errors += schema_errors(item, properties[name], f"{path}.{name}")
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected '{name}'")
+    elif isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            errors += schema_errors(item, schema["items"], f"{path}[{i}]")
+    return errors
+
+
+def strict_schema(schema: Schema) -> Schema:
+    """
+    Вариант схемы для строгого режима OpenAI.
+
+    Строгий режим требует перечислить в required все свойства и запретить
+    остальные, поэтому необязательные поля модель возвращает пустыми.
+    """
+    schema = copy.deepcopy(schema)
+    if schema.get("type") == "object":
+        properties = schema.get("properties", {})
+        schema["properties"] = {
+            name: strict_schema(item) for name, item in properties.items()
+        }
+        schema["required"] = list(properties)
+        schema["additionalProperties"] = False
+    if "items" in schema:
+        schema["items"] = strict_schema(schema["items"])
+    return schema
+
+
+def gemini_schema(schema: Schema) -> Schema:
+    """Вариант схемы для response_schema Gemini (без additionalProperties)."""
+    schema = {
+        key: copy.deepcopy(item)
+        for key, item in schema.items()
+        if key != "additionalProperties"
+    }
+    if "properties" in schema:
+        schema["properties"] = {
+            name: gemini_schema(item) for name, item in schema["properties"].items()
+        }
+    if "items" in schema:
+        schema["items"] = gemini_schema(schema["items"])
+    return schema
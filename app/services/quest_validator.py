@@ -0,0 +1,253 @@
+import copy
+from collections import deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+ENDING_SUCCESS = "ENDING_SUCCESS"
+ENDING_FAILURE = "ENDING_FAILURE"
+ENDING_TYPES = (ENDING_SUCCESS, ENDING_FAILURE)
+
+# Коды проблем. Первые четыре repair_quest исправляет без обращения к модели.
+MISSING_ID = "missing_id"
+DUPLICATE_ID = "duplicate_id"
+DANGLING_TARGET = "dangling_target"
+INVALID_START = "invalid_start"
+NO_NODES = "no_nodes"
+DEAD_END = "dead_end"
+NO_PATH_TO_ENDING = "no_path_to_ending"
+UNREACHABLE = "unreachable"
+MISSING_ENDING = "missing_ending"
+
+
+class Issue(NamedTuple):
+    code: str
+    node_id: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class QuestGraph:
+    """
+    Индекс узлов квеста, построенный за один проход.
+
+    Узлы без id или с повторным id в индекс не попадают, их позиции
+    собраны в missing_ids и duplicates.
+    """
+
+    def __init__(self, quest: Dict[str, Any]):
+        nodes = quest.get("nodes")
+        self.nodes: List[Any] = list(nodes) if isinstance(nodes, list) else []
+        self.index: Dict[str, Dict[str, Any]] = {}
+        self.missing_ids: List[int] = []
+        self.duplicates: List[int] = []
+        for position, node in enumerate(self.nodes):
+            node_id = node.get("id") if isinstance(node, dict) else None
+            if not isinstance(node_id, str) or not node_id:
+                self.missing_ids.append(position)
+            elif node_id in self.index:
+                self.duplicates.append(position)
+            else:
+                self.index[node_id] = node
+        start = quest.get("startNodeId")
+        self.start: Optional[str] = start if start in self.index else None
+
+    def targets(self, node: Dict[str, Any]) -> Iterable[Any]:
+        for choice in _choices(node):
+            yield choice.get("targetNodeId")
+
+    def reachable_from_start(self) -> Set[str]:
+        if self.start is None:
+            return set()
+        seen = {self.start}
+        queue = deque([self.start])
+        while queue:
+            for target in self.targets(self.index[queue.popleft()]):
+                if target in self.index and target not in seen:
+                    seen.add(target)
+                    queue.append(target)
+        return seen
+
+    def reaching_an_ending(self) -> Set[str]:
+        """Узлы, из которых достижима какая-либо концовка (обратный обход)."""
+        incoming: Dict[str, List[str]] = {}
+        for node_id, node in self.index.items():
+            for target in self.targets(node):
+                if target in self.index:
+                    incoming.setdefault(target, []).append(node_id)
+        seen = {
+            node_id
+            for node_id, node in self.index.items()
+            if node.get("type") in ENDING_TYPES
+        }
+        queue = deque(seen)
+        while queue:
+            for source in incoming.get(queue.popleft(), ()):
+                if source not in seen:
+                    seen.add(source)
+                    queue.append(source)
+        return seen
+
+    def neighbours(self, node_ids: Iterable[str]) -> List[str]:
+        """id узлов, которые ведут в node_ids или в которые ведут они сами."""
+        selected = set(node_ids)
+        found: Dict[str, None] = {}
+        for node_id, node in self.index.items():
+            targets = [target for target in self.targets(node) if target in self.index]
+            if node_id in selected:
+                found.update(dict.fromkeys(targets))
+            elif any(target in selected for target in targets):
+                found[node_id] = None
+        return [node_id for node_id in found if node_id not in selected]
+
+
+def _choices(node: Dict[str, Any]) -> List[Dict[str, Any]]:
+    choices = node.get("choices")
+    if not isinstance(choices, list):
+        return []
+    return [choice for choice in choices if isinstance(choice, dict)]
+
+
+def validate_quest(quest: Dict[str, Any]) -> List[Issue]:
+    """
+    Проверяет граф квеста за O(V+E).
+
+    Находит узлы без id и с повторными id, ссылки на несуществующие узлы,
+    неверный startNodeId, тупики (не концовки без выборов), узлы, из которых
+    нельзя дойти до концовки, недостижимые из старта узлы и отсутствие
+    достижимых концовок ENDING_SUCCESS и ENDING_FAILURE.
+    """
+    graph = QuestGraph(quest)
+    if not graph.nodes:
+        return [Issue(NO_NODES)]
+
+    issues = [Issue(MISSING_ID, detail=str(i)) for i in graph.missing_ids]
+    issues += [
+        Issue(DUPLICATE_ID, graph.nodes[i]["id"], str(i)) for i in graph.duplicates
+    ]
+    if graph.start is None:
+        issues.append(Issue(INVALID_START, detail=str(quest.get("startNodeId"))))
+
+    for node_id, node in graph.index.items():
+        for target in graph.targets(node):
+            if target not in graph.index:
+                issues.append(Issue(DANGLING_TARGET, node_id, str(target)))
+
+    reachable = graph.reachable_from_start()
+    to_ending = graph.reaching_an_ending()
+    for node_id, node in graph.index.items():
+        if node.get("type") in ENDING_TYPES:
+            continue
+        if not any(target in graph.index for target in graph.targets(node)):
+            issues.append(Issue(DEAD_END, node_id))
+        elif node_id not in to_ending:
+            issues.append(Issue(NO_PATH_TO_ENDING, node_id))
+    if graph.start is not None:
+        for node_id in graph.index:
+            if node_id not in reachable:
+                issues.append(Issue(UNREACHABLE, node_id))
+
+    reachable_types = {graph.index[node_id].get("type") for node_id in reachable} or {
+        node.get("type") for node in graph.index.values()
+    }
+    for ending in ENDING_TYPES:
+        if ending not in reachable_types:
+            issues.append(Issue(MISSING_ENDING, detail=ending))
+    return issues
+
+
+def repair_quest(quest: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Issue]]:
+    """
+    Исправляет структурные ошибки без обращения к модели.
+
+    Узлам без id и с повторными id назначаются новые уникальные id, выборы
+    со ссылками на несуществующие узлы удаляются, неверный startNodeId
+    заменяется id первого узла. Возвращает копию квеста и оставшиеся
+    проблемы, которые требуют перегенерации узлов.
+    """
+    quest = copy.deepcopy(quest)
+    graph = QuestGraph(quest)
+    if not graph.nodes:
+        return quest, [Issue(NO_NODES)]
+
+    taken = set(graph.index)
+    for position in sorted(graph.missing_ids + graph.duplicates):
+        node = graph.nodes[position]
+        if not isinstance(node, dict):
+            node = graph.nodes[position] = {}
+        base = node.get("id") if isinstance(node.get("id"), str) else None
+        node["id"] = _unique_id(base or f"node_{position + 1}", taken)
+        taken.add(node["id"])
+    quest["nodes"] = graph.nodes
+
+    for node in graph.nodes:
+        if isinstance(node.get("choices"), list):
+            node["choices"] = [
+                choice
+                for choice in _choices(node)
+                if choice.get("targetNodeId") in taken
+            ]
+
+    if quest.get("startNodeId") not in taken:
+        quest["startNodeId"] = graph.nodes[0]["id"]
+
+    return quest, validate_quest(quest)
+
+
+def _unique_id(base: str, taken: Set[str]) -> str:
+    if base not in taken:
+        return base
+    suffix = 2
+    while f"{base}_{suffix}" in taken:
+        suffix += 1
+    return f"{base}_{suffix}"
+
+
+# Проблемы, которые можно исправить только перегенерацией узлов.
+REGENERATE_CODES = (DEAD_END, NO_PATH_TO_ENDING, MISSING_ENDING)
+
+
+def broken_node_ids(issues: List[Issue]) -> List[str]:
+    """id узлов, которые нужно перегенерировать, в порядке появления."""
+    return list(
+        dict.fromkeys(
+            issue.node_id
+            for issue in issues
+            if issue.code in REGENERATE_CODES and issue.node_id
+        )
+    )
+
+
+def merge_nodes(
+    quest: Dict[str, Any], new_nodes: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Заменяет узлы с совпадающим id и добавляет новые в конец."""
+    quest = copy.deepcopy(quest)
+    nodes = quest.get("nodes") or []
+    positions = {
+        node.get("id"): i for i, node in enumerate(nodes) if isinstance(node, dict)
+    }
+    for node in new_nodes:
+        if not isinstance(node, dict) or not node.get("id"):
+            continue
+        if node["id"] in positions:
+            nodes[positions[node["id"]]] = node
+        else:
+            positions[node["id"]] = len(nodes)
+            nodes.append(node)
+    quest["nodes"] = nodes
+    return quest
+
+
+def close_dead_ends(quest: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Последний шаг локальной починки: тупики становятся концовками.
+
+    Сначала тупикам назначаются отсутствующие в квесте типы концовок,
+    остальные становятся ENDING_FAILURE.
+    """
+    quest = copy.deepcopy(quest)
+    issues = validate_quest(quest)
+    missing = [issue.detail for issue in issues if issue.code == MISSING_ENDING]
+    dead_ends = {issue.node_id for issue in issues if issue.code == DEAD_END}
+    for node in quest.get("nodes") or []:
+        if node.get("id") in dead_ends:
+            node["type"] = missing.pop(0) if missing else ENDING_FAILURE
+    return quest
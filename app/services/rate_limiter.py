@@ -0,0 +1,275 @@
+import asyncio
+import email.utils
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Mapping, Optional, Tuple
+
+from services.client_pool import hash_api_key
+
+
+class RateLimitExceeded(Exception):
+    """Запрос не дождался свободного лимита за отведённое время."""
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Разбирает длительность из заголовков провайдеров в секунды.
+
+    Поддерживаются числа ("1.5"), формат Go ("6m0s", "12ms", "1h2m3.5s")
+    и HTTP-даты в retry-after.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+        return sum(float(n) * scale[u] for n, u in parts)
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(parsed.timestamp() - time.time(), 0.0)
+
+
+class TokenBucket:
+    """
+    Классический token bucket с резервированием.
+
+    Баланс может уходить в минус: запрос, которому не хватило токенов,
+    резервирует их заранее и ждёт, пока бакет пополнится, поэтому очередь
+    ожидающих обслуживается честно, по порядку прихода.
+    """
+
+    def __init__(
+        self,
+        capacity: float,
+        refill_per_second: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        if math.isfinite(self.capacity):
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self._updated) * self.refill_per_second,
+            )
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Через сколько секунд в бакете будет amount токенов."""
+        self._refill()
+        if not math.isfinite(self.capacity) or self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        if math.isfinite(self.capacity):
+            self.tokens -= amount
+
+    def set_limit(self, per_minute: float) -> None:
+        self._refill()
+        if not math.isfinite(self.capacity):
+            self.tokens = per_minute
+        self.capacity = per_minute
+        self.refill_per_second = per_minute / 60.0
+        self.tokens = min(self.tokens, per_minute)
+
+
+class ProviderLimiter:
+    """
+    Лимиты одной тройки (провайдер, ключ, модель): запросы и токены в минуту.
+
+    Лимиты, не заданные в конфигурации, считаются бесконечными, пока
+    провайдер не сообщит их в заголовках ответа.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(math.inf, 0.0, clock)
+        self.tokens = TokenBucket(math.inf, 0.0, clock)
+        self._tpm_configured = tpm is not None
+        if rpm is not None:
+            self.requests.set_limit(rpm)
+        if tpm is not None:
+            self.tokens.set_limit(tpm)
+        self.blocked_until = 0.0
+
+    def _reserve(self, estimated_tokens: float, max_wait: float) -> float:
+        with self._lock:
+            # Запрос, для которого токенов больше, чем вмещает бакет,
+            # ждёт его полного наполнения, а не вечно.
+            tokens_needed = min(estimated_tokens, self.tokens.capacity)
+            wait = max(
+                self.requests.wait_time(1),
+                self.tokens.wait_time(tokens_needed),
+                self.blocked_until - self._clock(),
+                0.0,
+            )
+            if wait > max_wait:
+                raise RateLimitExceeded(
+                    f"Client-side rate limit: would wait {wait:.1f}s (max {max_wait}s)"
+                )
+            self.requests.consume(1)
+            self.tokens.consume(tokens_needed)
+            return wait
+
+    def acquire(self, estimated_tokens: float, max_wait: float) -> float:
+        """Дожидается лимита; бросает RateLimitExceeded, если ждать дольше max_wait."""
+        wait = self._reserve(estimated_tokens, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, estimated_tokens: float, max_wait: float) -> float:
+        """Асинхронный вариант acquire()."""
+        wait = self._reserve(estimated_tokens, max_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, actual_tokens: Any, estimated_tokens: float) -> None:
+        """Корректирует бакет токенов по фактическому расходу из ответа."""
+        if not isinstance(actual_tokens, int):
+            return
+        with self._lock:
+            self.tokens.consume(actual_tokens - estimated_tokens)
+
+    def block_for(self, seconds: float) -> None:
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, self._clock() + seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Подстраивает лимиты под заголовки ответа провайдера.
+
+        retry-after и исчерпанный x-ratelimit-remaining-requests блокируют
+        запросы до сброса; x-ratelimit-limit-tokens (у Groq и OpenAI это
+        токены в минуту) задаёт ёмкость бакета токенов, а
+        x-ratelimit-remaining-tokens ограничивает текущий баланс.
+        """
+        retry_after = parse_duration(headers.get("retry-after"))
+        if retry_after is not None:
+            self.block_for(retry_after)
+
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        if remaining_requests is not None and remaining_requests.strip() == "0":
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if reset is not None:
+                self.block_for(reset)
+
+        with self._lock:
+            limit_tokens = headers.get("x-ratelimit-limit-tokens")
+            if limit_tokens and not self._tpm_configured:
+                try:
+                    self.tokens.set_limit(float(limit_tokens))
+                except ValueError:
+                    pass
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_tokens and math.isfinite(self.tokens.capacity):
+                try:
+                    self.tokens._refill()
+                    self.tokens.tokens = min(
+                        self.tokens.tokens, float(remaining_tokens)
+                    )
+                except ValueError:
+                    pass
+
+
+def _env_limit(name: str, provider: str) -> Optional[float]:
+    value = os.getenv(f"RATE_LIMIT_{provider.upper()}_{name}") or os.getenv(
+        f"RATE_LIMIT_{name}"
+    )
+    return float(value) if value else None
+
+
+class RateLimiterRegistry:
+    """
+    LRU/TTL-реестр лимитеров по ключу (provider, sha256(api_key), model).
+
+    Как и ClientPool, реестр ограничен по размеру: лимитеры давно не
+    использованных ключей вытесняются. Лимитер, простоявший дольше TTL,
+    уже полностью пополнился, поэтому его пересоздание лимиты не ослабляет.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 900.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._limiters: (
+            "OrderedDict[Tuple[str, str, str], Tuple[ProviderLimiter, float]]"
+        ) = OrderedDict()
+        self.max_wait = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))
+
+    def get(self, provider: str, api_key: str, model: str) -> ProviderLimiter:
+        key = (provider, hash_api_key(api_key), model)
+        now = self._clock()
+        with self._lock:
+            entry = self._limiters.get(key)
+            if entry is not None and not self._expired(entry, now):
+                limiter = entry[0]
+            else:
+                limiter = ProviderLimiter(
+                    rpm=_env_limit("RPM", provider),
+                    tpm=_env_limit("TPM", provider),
+                    clock=self._clock,
+                )
+            self._limiters[key] = (limiter, now)
+            self._limiters.move_to_end(key)
+            self._evict(now)
+            return limiter
+
+    def _expired(self, entry: Tuple[ProviderLimiter, float], now: float) -> bool:
+        # Ключ, заблокированный провайдером (retry-after), не забывается до сброса.
+        limiter, used = entry
+        return now - used > self.ttl and limiter.blocked_until <= now
+
+    def _evict(self, now: float) -> None:
+        expired = [
+            k for k, entry in self._limiters.items() if self._expired(entry, now)
+        ]
+        for k in expired:
+            del self._limiters[k]
+        while len(self._limiters) > self.max_size:
+            self._limiters.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._limiters.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._limiters)
+
+
+rate_limiters = RateLimiterRegistry(
+    max_size=int(os.getenv("RATE_LIMIT_REGISTRY_SIZE", "1024")),
+    ttl=float(os.getenv("RATE_LIMIT_REGISTRY_TTL", "900")),
+)
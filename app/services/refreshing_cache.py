@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services.client_pool import hash_api_key
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+POSITIVE = "positive"
+NEGATIVE = "negative"
+
+# Запись кэша: (результат, момент истечения, момент обновления или None).
+_Entry = Tuple[Dict[str, Any], float, Optional[float]]
+
+
+class RefreshingCache:
+    """
+    TTL-кэш ответов провайдера по ключу (provider, sha256(api_key)).
+
+    `classify(result)` решает, как кэшировать результат: POSITIVE — на ttl
+    с фоновым обновлением за refresh_ahead секунд до истечения, NEGATIVE
+    (например, неверный ключ) — на negative_ttl без обновления, None — не
+    кэшировать (временные сбои). Одновременные промахи по одному ключу
+    выполняют загрузку один раз.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str, str], Dict[str, Any]],
+        classify: Callable[[Dict[str, Any]], Optional[str]],
+        ttl: float = 21600.0,
+        negative_ttl: float = 300.0,
+        refresh_ahead: float = 600.0,
+        max_entries: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.loader = loader
+        self.classify = classify
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._refreshing: set = set()
+        self._flight = SingleFlight()
+
+    def get(self, provider: str, api_key: str) -> Dict[str, Any]:
+        """Возвращает результат из кэша или загружает его."""
+        key = (provider, hash_api_key(api_key))
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry[1]:
+                self._entries.move_to_end(key)
+                refresh_at = entry[2]
+                if (
+                    refresh_at is not None
+                    and now >= refresh_at
+                    and key not in self._refreshing
+                ):
+                    self._refreshing.add(key)
+                    threading.Thread(
+                        target=self._refresh, args=(key, api_key), daemon=True
+                    ).start()
+                return entry[0]
+
+        return self._flight.do(":".join(key), lambda: self._load(key, api_key))
+
+    def _load(self, key: Tuple[str, str], api_key: str) -> Dict[str, Any]:
+        result = self.loader(key[0], api_key)
+        self._store(key, result)
+        return result
+
+    def _refresh(self, key: Tuple[str, str], api_key: str) -> None:
+        try:
+            self._load(key, api_key)
+        except Exception as e:
+            # Старое значение остаётся в кэше до истечения TTL.
+            logger.warning(f"Background refresh failed for {key[0]}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key: Tuple[str, str], result: Dict[str, Any]) -> None:
+        kind = self.classify(result)
+        if kind is None:
+            return
+        now = self._clock()
+        if kind == NEGATIVE:
+            entry = (result, now + self.negative_ttl, None)
+        else:
+            entry = (
+                result,
+                now + self.ttl,
+                now + max(self.ttl - self.refresh_ahead, 0),
+            )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
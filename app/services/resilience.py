@@ -0,0 +1,291 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Провайдер признан недоступным, запрос отклонён без обращения к нему."""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"Circuit breaker for {provider} is open")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+class DeadlineExceeded(Exception):
+    """Общий дедлайн запроса истёк до следующей попытки."""
+
+
+class CircuitBreaker:
+    """
+    Автомат closed → open → half_open для одного провайдера.
+
+    После failure_threshold сбоев подряд запросы отклоняются сразу на
+    reset_timeout секунд. Затем один пробный запрос (half_open) решает,
+    закрыть цепь или открыть её снова; остальные запросы в это время
+    отклоняются.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+
+    def before_call(self) -> None:
+        """Бросает CircuitOpenError, если обращаться к провайдеру сейчас нельзя."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = self._clock()
+            retry_in = self.opened_at + self.reset_timeout - now
+            if self.state == OPEN and retry_in <= 0:
+                self.state = HALF_OPEN
+                self._probing = False
+            # Пробный запрос, который так и не завершился (например, отменён),
+            # не блокирует цепь дольше reset_timeout.
+            if self.state == HALF_OPEN and (
+                not self._probing or now - self._probe_started >= self.reset_timeout
+            ):
+                self._probing = True
+                self._probe_started = now
+                return
+            raise CircuitOpenError(self.provider, max(retry_in, 0.0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self) -> None:
+        """Завершает попытку, не сообщив ничего о провайдере (локальная ошибка)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = self._clock()
+                self._probing = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in": (
+                    max(self.opened_at + self.reset_timeout - self._clock(), 0.0)
+                    if self.state == OPEN
+                    else 0.0
+                ),
+            }
+
+
+class CircuitBreakerRegistry:
+    """Реестр автоматов по имени провайдера."""
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(provider)
+            if breaker is None:
+                breaker = self._breakers[provider] = CircuitBreaker(
+                    provider, self.failure_threshold, self.reset_timeout, self._clock
+                )
+            return breaker
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.provider: breaker.snapshot() for breaker in breakers}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._breakers.clear()
+
+
+class RetryPolicy:
+    """
+    Повторы с экспоненциальной задержкой и full jitter.
+
+    Перед попыткой n (с нуля) ждём случайное время из
+    [0, min(max_delay, base_delay * 2**n)]. Все попытки укладываются в общий
+    дедлайн: вызываемая функция получает оставшееся время как таймаут, а
+    повтор, который не успевает до дедлайна, не выполняется.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        deadline: float = 120.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self._clock = clock
+        self._sleep = sleep
+
+    def deadline_from_now(self) -> float:
+        """
+        Момент общего дедлайна для операции из нескольких вызовов call().
+
+        Передаётся в call(deadline_at=...), чтобы все этапы одной генерации
+        укладывались в один дедлайн, а не получали каждый свой.
+        """
+        return self._clock() + self.deadline
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def _next_delay(
+        self, attempt: int, error: Exception, is_retryable, deadline_at: float
+    ) -> Optional[float]:
+        # None — повторять не нужно или уже не успеваем.
+        if attempt + 1 >= self.max_attempts or not is_retryable(error):
+            return None
+        delay = self.backoff(attempt)
+        if self._clock() + delay >= deadline_at:
+            return None
+        return delay
+
+    def _remaining(self, deadline_at: float) -> float:
+        remaining = deadline_at - self._clock()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.deadline}s exceeded")
+        return remaining
+
+    def call(
+        self,
+        fn: Callable[[float], T],
+        is_retryable: Callable[[Exception], bool],
+        breaker: Optional[CircuitBreaker] = None,
+        is_failure: Optional[Callable[[Exception], bool]] = None,
+        deadline_at: Optional[float] = None,
+    ) -> T:
+        """
+        Вызывает fn(timeout) с повторами.
+
+        breaker учитывает исход каждой попытки: сбоем считаются ошибки, для
+        которых is_failure() истинно (по умолчанию — is_retryable()), успехом —
+        только полученный результат. Остальные ошибки нейтральны.
+        deadline_at — общий дедлайн (см. deadline_from_now); по умолчанию
+        отсчитывается от начала вызова.
+        """
+        if deadline_at is None:
+            deadline_at = self.deadline_from_now()
+        attempt = 0
+        while True:
+            timeout = self._remaining(deadline_at)
+            if breaker is not None:
+                breaker.before_call()
+            try:
+                result = fn(timeout)
+            except Exception as e:
+                _record(breaker, e, is_failure or is_retryable)
+                delay = self._next_delay(attempt, e, is_retryable, deadline_at)
+                if delay is None:
+                    raise
+                self._sleep(delay)
+                attempt += 1
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    async def call_async(
+        self,
+        fn: Callable[[float], Awaitable[T]],
+        is_retryable: Callable[[Exception], bool],
+        breaker: Optional[CircuitBreaker] = None,
+        is_failure: Optional[Callable[[Exception], bool]] = None,
+        deadline_at: Optional[float] = None,
+    ) -> T:
+        """Асинхронный вариант call()."""
+        if deadline_at is None:
+            deadline_at = self.deadline_from_now()
+        attempt = 0
+        while True:
+            timeout = self._remaining(deadline_at)
+            if breaker is not None:
+                breaker.before_call()
+            try:
+                result = await fn(timeout)
+            except Exception as e:
+                _record(breaker, e, is_failure or is_retryable)
+                delay = self._next_delay(attempt, e, is_retryable, deadline_at)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+
+def _record(breaker: Optional[CircuitBreaker], error: Exception, is_failure) -> None:
+    if breaker is None:
+        return
+    # Локальные ошибки (клиентский лимитер, дедлайн) и ответы вроде неверного
+    # ключа не говорят о здоровье провайдера: цепь не закрывается и не
+    # размыкается, пробный запрос half_open просто освобождается.
+    if is_failure(error):
+        breaker.record_failure()
+    else:
+        breaker.release()
+
+
+def build_retry_policy_from_env() -> RetryPolicy:
+    return RetryPolicy(
+        max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "3")),
+        base_delay=float(os.getenv("RETRY_BASE_DELAY", "0.5")),
+        max_delay=float(os.getenv("RETRY_MAX_DELAY", "8")),
+        deadline=float(os.getenv("RETRY_DEADLINE", "120")),
+    )
+
+
+retry_policy = build_retry_policy_from_env()
+circuit_breakers = CircuitBreakerRegistry(
+    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30")),
+)
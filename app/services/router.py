@@ -0,0 +1,185 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+Route = Dict[str, Any]
+
+
+class RoutesExhausted(Exception):
+    """Ни один маршрут не вернул результат; errors — список (маршрут, исключение)."""
+
+    def __init__(self, errors: List[Tuple[Route, BaseException]]):
+        super().__init__(f"All {len(errors)} routes failed")
+        self.errors = errors
+
+
+class LatencyStats:
+    """Скользящее окно последних вызовов одной пары (провайдер, модель)."""
+
+    def __init__(self, window: int = 100):
+        self._samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self._samples.append((latency, ok))
+
+    def percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """q-й перцентиль задержки успешных вызовов или None, если данных мало."""
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self._samples if ok)
+        if len(latencies) < max(min_samples, 1):
+            return None
+        index = max(math.ceil(q / 100 * len(latencies)) - 1, 0)
+        return latencies[index]
+
+    def error_rate(self, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            outcomes = [ok for _, ok in self._samples]
+        if len(outcomes) < max(min_samples, 1):
+            return None
+        return outcomes.count(False) / len(outcomes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            count = len(self._samples)
+        return {
+            "samples": count,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "error_rate": self.error_rate(),
+        }
+
+
+class LatencyRouter:
+    """
+    Маршрутизация генерации по ранжированному списку провайдеров.
+
+    Первый маршрут запускается сразу. Если он не ответил за p95 своей
+    задержки (с ограничениями hedge_min_delay/hedge_max_delay), параллельно
+    запускается следующий маршрут; побеждает первый успешный ответ, остальные
+    запросы отменяются. Ошибки, для которых is_fallback() истинно (5xx,
+    таймауты), сразу передают запрос следующему маршруту. Одновременно
+    выполняется не больше двух запросов. Маршруты с высокой долей ошибок
+    в скользящем окне переносятся в конец списка.
+    """
+
+    def __init__(
+        self,
+        hedge_percentile: float = 95.0,
+        hedge_delay: float = 15.0,
+        hedge_min_delay: float = 1.0,
+        hedge_max_delay: float = 60.0,
+        min_samples: int = 10,
+        max_error_rate: float = 0.5,
+        window: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], LatencyStats] = {}
+
+    def stats(self, provider: str, model: str) -> LatencyStats:
+        with self._lock:
+            stats = self._stats.get((provider, model))
+            if stats is None:
+                stats = self._stats[(provider, model)] = LatencyStats(self.window)
+            return stats
+
+    def _route_stats(self, route: Route) -> LatencyStats:
+        return self.stats(route["api_provider"], route["model"])
+
+    def delay_for(self, route: Route) -> float:
+        """Через сколько секунд без ответа маршрута запускать дублирующий запрос."""
+        p = self._route_stats(route).percentile(self.hedge_percentile, self.min_samples)
+        if p is None:
+            return self.hedge_delay
+        return min(max(p, self.hedge_min_delay), self.hedge_max_delay)
+
+    def rank(self, routes: List[Route]) -> List[Route]:
+        """Переносит маршруты с долей ошибок выше max_error_rate в конец."""
+
+        def unhealthy(route: Route) -> bool:
+            rate = self._route_stats(route).error_rate(self.min_samples)
+            return rate is not None and rate > self.max_error_rate
+
+        return sorted(routes, key=unhealthy)
+
+    async def race(
+        self,
+        routes: List[Route],
+        attempt: Callable[[Route], Awaitable[Any]],
+        is_fallback: Callable[[BaseException], bool],
+    ) -> Tuple[Route, Any]:
+        """Возвращает (маршрут, результат) первого успешного вызова attempt()."""
+        queue = self.rank(routes)
+        errors: List[Tuple[Route, BaseException]] = []
+        running: Dict["asyncio.Future[Any]", Tuple[Route, float]] = {}
+
+        def launch() -> None:
+            route = queue.pop(0)
+            running[asyncio.ensure_future(attempt(route))] = (route, self._clock())
+
+        launch()
+        try:
+            while running:
+                timeout = None
+                if queue and len(running) == 1:
+                    route, started = next(iter(running.values()))
+                    timeout = max(started + self.delay_for(route) - self._clock(), 0)
+                done, _ = await asyncio.wait(
+                    running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    route, started = running.pop(task)
+                    latency = self._clock() - started
+                    error = task.exception()
+                    self._route_stats(route).record(latency, ok=error is None)
+                    if error is None:
+                        return route, task.result()
+                    errors.append((route, error))
+                    if is_fallback(error) and queue and not running:
+                        launch()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        raise RoutesExhausted(errors)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            items = list(self._stats.items())
+        return {f"{provider}/{model}": s.snapshot() for (provider, model), s in items}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+def build_router_from_env() -> LatencyRouter:
+    return LatencyRouter(
+        hedge_percentile=float(os.getenv("ROUTING_HEDGE_PERCENTILE", "95")),
+        hedge_delay=float(os.getenv("ROUTING_HEDGE_DELAY", "15")),
+        hedge_min_delay=float(os.getenv("ROUTING_HEDGE_MIN_DELAY", "1")),
+        hedge_max_delay=float(os.getenv("ROUTING_HEDGE_MAX_DELAY", "60")),
+        min_samples=int(os.getenv("ROUTING_MIN_SAMPLES", "10")),
+        max_error_rate=float(os.getenv("ROUTING_MAX_ERROR_RATE", "0.5")),
+    )
+
+
+latency_router = build_router_from_env()
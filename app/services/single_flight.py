@@ -0,0 +1,107 @@
+import contextlib
+import copy
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые вызовы в один.
+
+    Первый вызов с данным ключом (лидер) выполняет функцию, остальные ждут
+    его результата и получают копию. Исключения лидера пробрасываются всем
+    ожидающим, а ключ освобождается.
+
+    Если задан lock_dir, лидер дополнительно берёт файловую блокировку
+    по ключу, и одинаковые запросы из разных воркеров gunicorn выполняются
+    по очереди. Перед вызовом функции лидер проверяет `recheck()` — обычно
+    общий дисковый кэш, куда уже мог записать результат другой воркер.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = None):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def _finish(self, key: str, future: Future, result: Any, error: Any) -> None:
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def in_flight(self) -> int:
+        """Возвращает число выполняющихся сейчас уникальных вызовов."""
+        with self._lock:
+            return len(self._calls)
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        recheck: Optional[Callable[[], Any]] = None,
+    ) -> Any:
+        """Выполняет fn() один раз для всех одновременных вызовов с ключом key."""
+        future, leader = self._join(key)
+        if not leader:
+            return copy.deepcopy(future.result())
+
+        result, error = None, None
+        try:
+            with self._process_lock(key):
+                result = recheck() if recheck else None
+                if result is None:
+                    result = fn()
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(key, future, result, error)
+        return result
+
+    @contextlib.contextmanager
+    def _process_lock(self, key: str) -> Iterator[None]:
+        lock_file = self._acquire_file_lock(key)
+        try:
+            yield
+        finally:
+            self._release_file_lock(lock_file)
+
+    def _acquire_file_lock(self, key: str) -> Any:
+        if not self.lock_dir:
+            return None
+        lock_file = open(os.path.join(self.lock_dir, f"{key}.lock"), "a+")
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return lock_file
+
+    def _release_file_lock(self, lock_file: Any) -> None:
+        if lock_file is None:
+            return
+        # Удаляем файл до снятия блокировки. Если другой воркер успел открыть
+        # старый файл, в худшем случае запрос просто выполнится повторно.
+        with contextlib.suppress(OSError):
+            os.unlink(lock_file.name)
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
+
+
+single_flight = SingleFlight(lock_dir=os.getenv("SINGLE_FLIGHT_LOCK_DIR"))
@@ -2,6 +2,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const generateBtn = document.getElementById('generate-btn');
     const settingInput = document.getElementById('setting-input');
     const resultBox = document.getElementById('result-box');
+    const questViewerBox = document.getElementById('quest-viewer');
     const providerRadios = document.querySelectorAll('input[name="api_provider"]');
     const modelSelectorGroup = document.getElementById('model-selector-group');
     const modelSelector = document.getElementById('model-selector');
@@ -11,6 +12,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const toggleResultBtn = document.getElementById('toggle-result-btn');
     const downloadResultBtn = document.getElementById('download-result-btn');
     const themeSelect = document.getElementById('theme-select');
+    const freshGenerationCheckbox = document.getElementById('fresh-generation-checkbox');
 
     function applyTheme(theme) {
         if (theme === 'system') {
@@ -36,17 +38,102 @@ document.addEventListener('DOMContentLoaded', () => {
         applyTheme(savedTheme);
     }
 
-    let chats = {};
+    // История чатов хранится на сервере: при загрузке страницы приходят
+    // только названия, квест чата запрашивается при переключении на него.
+    const CHATS_PAGE_SIZE = 30;
+    const EMPTY_RESULT = 'Здесь появится сгенерированный JSON...';
+    let chats = [];
+    let nextChatsCursor = null;
     let activeChatId = null;
 
-    function saveChats() {
-        localStorage.setItem('chats', JSON.stringify(chats));
+    // Квест показывается виртуализированным списком узлов, а служебные
+    // сообщения и ошибки — текстом в result-box
+    const questViewer = new QuestViewer(questViewerBox);
+    let currentQuest = null;
+
+    function showText(text) {
+        currentQuest = null;
+        questViewerBox.style.display = 'none';
+        resultBox.style.display = '';
+        resultBox.textContent = text;
+    }
+
+    function showQuest(quest, status = '') {
+        currentQuest = status ? null : quest;
+        resultBox.style.display = 'none';
+        questViewerBox.style.display = 'block';
+        questViewer.show(quest, status);
     }
 
-    function loadChats() {
+    async function historyRequest(url, options = {}) {
+        const response = await fetch(url, {
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            ...options,
+        });
+        if (response.status === 204) {
+            return null;
+        }
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || `HTTP ${response.status}`);
+        }
+        return data;
+    }
+
+    async function loadChats() {
+        const params = new URLSearchParams({ limit: CHATS_PAGE_SIZE });
+        if (nextChatsCursor) {
+            params.set('cursor', nextChatsCursor);
+        }
+        const page = await historyRequest(`/history/chats?${params}`);
+        chats = chats.concat(page.chats);
+        nextChatsCursor = page.next_cursor;
+    }
+
+    // Однократный перенос чатов из старого localStorage['chats'] на сервер.
+    async function migrateLocalChats() {
         const savedChats = localStorage.getItem('chats');
-        if (savedChats) {
-            chats = JSON.parse(savedChats);
+        if (!savedChats) {
+            return;
+        }
+        let oldChats = {};
+        try {
+            oldChats = JSON.parse(savedChats);
+        } catch (e) {
+            console.error('Invalid chats in localStorage:', e);
+        }
+        // Перенесённые чаты убираются из localStorage даже при сбое посередине,
+        // чтобы повторная попытка не создала их на сервере ещё раз
+        const pending = { ...oldChats };
+        try {
+            for (const [key, chat] of Object.entries(oldChats)) {
+                let quest = null;
+                try {
+                    const parsed = JSON.parse(chat.result);
+                    if (parsed && typeof parsed === 'object' && !Array.isArray(parsed)) {
+                        quest = parsed;
+                    }
+                } catch (e) {
+                    // В result была заглушка или текст ошибки, а не квест
+                }
+                const body = { title: chat.title, setting: chat.setting || '' };
+                if (quest) {
+                    body.quest = quest;
+                }
+                await historyRequest('/history/chats', {
+                    method: 'POST',
+                    body: JSON.stringify(body),
+                });
+                delete pending[key];
+            }
+        } finally {
+            if (Object.keys(pending).length) {
+                localStorage.setItem('chats', JSON.stringify(pending));
+            } else {
+                localStorage.removeItem('chats');
+            }
         }
     }
 
@@ -61,102 +148,175 @@ document.addEventListener('DOMContentLoaded', () => {
     });
     let chatsVisible = false;
 
-    function renderChatList() {
-        chatList.innerHTML = '';
-        const chatIds = Object.keys(chats);
+    // Элементы списка чатов по id: при переименовании, переключении и
+    // удалении меняются только затронутые элементы, а не весь список
+    const chatElements = new Map();
 
-        const visibleChats = chatsVisible ? chatIds : chatIds.slice(0, 8);
+    const moreChatsBtn = document.createElement('button');
+    moreChatsBtn.textContent = 'Загрузить ещё';
+    moreChatsBtn.addEventListener('click', async () => {
+        moreChatsBtn.disabled = true;
+        try {
+            await loadChats();
+        } catch (error) {
+            console.error('Failed to load chats:', error);
+        }
+        moreChatsBtn.disabled = false;
+        renderChatList();
+    });
 
-        for (const id of visibleChats) {
-            const chat = chats[id];
-            const chatDiv = document.createElement('div');
-            chatDiv.classList.add('chat-item');
-            if (id === activeChatId) {
-                chatDiv.classList.add('active');
-            }
+    const toggleChatsBtn = document.createElement('button');
+    toggleChatsBtn.addEventListener('click', () => {
+        chatsVisible = !chatsVisible;
+        renderChatList();
+    });
+
+    function shortTitle(title) {
+        return title.length > 30 ? title.substring(0, 27) + '...' : title;
+    }
 
-            const chatTitle = document.createElement('span');
-            chatTitle.classList.add('chat-title');
-            chatTitle.textContent = chat.title.length > 30 ? chat.title.substring(0, 27) + '...' : chat.title;
-            chatDiv.appendChild(chatTitle);
-
-            const editBtn = document.createElement('button');
-            editBtn.innerHTML = '&#9998;'; // Edit icon
-            editBtn.classList.add('edit-btn');
-            editBtn.addEventListener('click', (e) => {
-                e.stopPropagation();
-                const newTitle = prompt('Enter new chat title:', chat.title);
-                if (newTitle) {
-                    chats[id].title = newTitle;
-                    saveChats();
+    function createChatElement(id) {
+        const chatDiv = document.createElement('div');
+        chatDiv.classList.add('chat-item');
+        chatDiv.dataset.chatId = id;
+
+        const chatTitle = document.createElement('span');
+        chatTitle.classList.add('chat-title');
+        chatDiv.appendChild(chatTitle);
+
+        const editBtn = document.createElement('button');
+        editBtn.innerHTML = '&#9998;'; // Edit icon
+        editBtn.classList.add('edit-btn');
+        editBtn.addEventListener('click', async (e) => {
+            e.stopPropagation();
+            const chat = chats.find(item => item.id === id);
+            const newTitle = prompt('Enter new chat title:', chat.title);
+            if (newTitle) {
+                try {
+                    const updated = await historyRequest(`/history/chats/${id}`, {
+                        method: 'PATCH',
+                        body: JSON.stringify({ title: newTitle }),
+                    });
+                    chat.title = updated.title;
                     renderChatList();
+                } catch (error) {
+                    alert(`Не удалось переименовать чат: ${error.message}`);
                 }
-            });
+            }
+        });
 
-            const deleteBtn = document.createElement('button');
-            deleteBtn.innerHTML = '&#128465;'; // Trash icon
-            deleteBtn.classList.add('delete-btn');
-            deleteBtn.addEventListener('click', (e) => {
-                e.stopPropagation();
-                if (confirm('Are you sure you want to delete this chat?')) {
-                    delete chats[id];
-                    if (activeChatId === id) {
-                        activeChatId = Object.keys(chats)[0] || null;
-                        if(activeChatId) {
-                            switchChat(activeChatId);
-                        } else {
-                            createNewChat();
-                        }
+        const deleteBtn = document.createElement('button');
+        deleteBtn.innerHTML = '&#128465;'; // Trash icon
+        deleteBtn.classList.add('delete-btn');
+        deleteBtn.addEventListener('click', async (e) => {
+            e.stopPropagation();
+            if (confirm('Are you sure you want to delete this chat?')) {
+                try {
+                    await historyRequest(`/history/chats/${id}`, { method: 'DELETE' });
+                } catch (error) {
+                    alert(`Не удалось удалить чат: ${error.message}`);
+                    return;
+                }
+                chats = chats.filter(item => item.id !== id);
+                if (activeChatId === id) {
+                    activeChatId = chats.length ? chats[0].id : null;
+                    if (activeChatId) {
+                        switchChat(activeChatId);
+                    } else {
+                        createNewChat();
                     }
-                    saveChats();
-                    renderChatList();
                 }
-            });
+                renderChatList();
+            }
+        });
 
-            const chatActions = document.createElement('div');
-            chatActions.classList.add('chat-actions');
-            chatActions.appendChild(editBtn);
-            chatActions.appendChild(deleteBtn);
-            chatDiv.appendChild(chatActions);
+        const chatActions = document.createElement('div');
+        chatActions.classList.add('chat-actions');
+        chatActions.appendChild(editBtn);
+        chatActions.appendChild(deleteBtn);
+        chatDiv.appendChild(chatActions);
 
-            chatDiv.dataset.chatId = id;
-            chatDiv.addEventListener('click', () => {
-                switchChat(id);
-            });
-            chatList.appendChild(chatDiv);
+        chatDiv.addEventListener('click', () => {
+            switchChat(id);
+        });
+        return chatDiv;
+    }
+
+    function renderChatList() {
+        const visibleChats = chatsVisible ? chats : chats.slice(0, 8);
+        const visibleIds = new Set(visibleChats.map(chat => chat.id));
+        for (const [id, element] of chatElements) {
+            if (!visibleIds.has(id)) {
+                element.remove();
+                chatElements.delete(id);
+            }
         }
 
-        if (chatIds.length > 8) {
-            const toggleBtn = document.createElement('button');
-            toggleBtn.textContent = chatsVisible ? 'Свернуть' : 'Развернуть';
-            toggleBtn.addEventListener('click', () => {
-                chatsVisible = !chatsVisible;
-                renderChatList();
-            });
-            chatList.appendChild(toggleBtn);
+        const wanted = [];
+        for (const chat of visibleChats) {
+            let chatDiv = chatElements.get(chat.id);
+            if (!chatDiv) {
+                chatDiv = createChatElement(chat.id);
+                chatElements.set(chat.id, chatDiv);
+            }
+            const chatTitle = chatDiv.firstChild;
+            const title = shortTitle(chat.title);
+            if (chatTitle.textContent !== title) {
+                chatTitle.textContent = title;
+            }
+            chatDiv.classList.toggle('active', chat.id === activeChatId);
+            wanted.push(chatDiv);
+        }
+
+        moreChatsBtn.textContent = 'Загрузить ещё';
+        if (chatsVisible && nextChatsCursor) {
+            wanted.push(moreChatsBtn);
+        }
+        if (chats.length > 8 || nextChatsCursor) {
+            toggleChatsBtn.textContent = chatsVisible ? 'Свернуть' : 'Развернуть';
+            wanted.push(toggleChatsBtn);
+        }
+
+        // Узлы переставляются только там, где порядок изменился
+        wanted.forEach((element, position) => {
+            if (chatList.children[position] !== element) {
+                chatList.insertBefore(element, chatList.children[position] || null);
+            }
+        });
+        while (chatList.children.length > wanted.length) {
+            chatList.lastChild.remove();
         }
     }
 
-    function switchChat(chatId) {
+    async function switchChat(chatId) {
         activeChatId = chatId;
-        const chat = chats[chatId];
-        settingInput.value = chat.setting;
-        resultBox.textContent = chat.result;
         renderChatList();
+        showText('Загрузка...');
+        try {
+            const chat = await historyRequest(`/history/chats/${chatId}`);
+            if (activeChatId !== chatId) {
+                return; // Пока шёл запрос, пользователь выбрал другой чат
+            }
+            settingInput.value = chat.setting;
+            if (chat.quest) {
+                showQuest(chat.quest);
+            } else {
+                showText(EMPTY_RESULT);
+            }
+        } catch (error) {
+            console.error('Failed to load chat:', error);
+            showText(`Ошибка: ${error.message}`);
+        }
     }
 
-    function createNewChat() {
-        const newChatId = `chat_${Date.now()}`;
-        chats[newChatId] = {
-            id: newChatId,
-            title: `Чат ${Object.keys(chats).length + 1}`,
-            setting: '',
-            result: 'Здесь появится сгенерированный JSON...'
-        };
-        activeChatId = newChatId;
-        saveChats();
-        renderChatList();
-        switchChat(newChatId);
+    async function createNewChat() {
+        const chat = await historyRequest('/history/chats', {
+            method: 'POST',
+            body: JSON.stringify({ title: `Чат ${chats.length + 1}` }),
+        });
+        chats.unshift(chat);
+        settingInput.value = '';
+        await switchChat(chat.id);
     }
 
     newChatBtn.addEventListener('click', createNewChat);
@@ -165,6 +325,8 @@ document.addEventListener('DOMContentLoaded', () => {
         window.location.href = '/settings';
     });
 
+    const MODELS_CACHE_MAX_AGE_MS = 60 * 60 * 1000;
+
     async function updateModels() {
         const selectedProvider = document.querySelector('input[name="api_provider"]:checked').value;
         const apiKey = localStorage.getItem(`${selectedProvider}_api_key`);
@@ -175,10 +337,11 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
-        if (cachedModels) {
-            const models = JSON.parse(cachedModels);
+        // Локальная копия живёт недолго: актуальный список кэширует сервер
+        const cached = cachedModels ? JSON.parse(cachedModels) : null;
+        if (cached && cached.fetchedAt && Date.now() - cached.fetchedAt < MODELS_CACHE_MAX_AGE_MS) {
             modelSelector.innerHTML = '';
-            models.forEach(model => {
+            cached.models.forEach(model => {
                 const option = document.createElement('option');
                 option.value = model;
                 option.textContent = model;
@@ -203,7 +366,10 @@ document.addEventListener('DOMContentLoaded', () => {
             const data = await response.json();
 
             if (response.ok && data.models) {
-                localStorage.setItem(`${selectedProvider}_models`, JSON.stringify(data.models));
+                localStorage.setItem(`${selectedProvider}_models`, JSON.stringify({
+                    models: data.models,
+                    fetchedAt: Date.now(),
+                }));
                 modelSelector.innerHTML = '';
                 data.models.forEach(model => {
                     const option = document.createElement('option');
@@ -245,26 +411,56 @@ document.addEventListener('DOMContentLoaded', () => {
     toggleResultView(true);
 
     downloadResultBtn.addEventListener('click', () => {
-        const resultJson = resultBox.textContent;
-        try {
-            JSON.parse(resultJson); // Check if it's a valid JSON
-            const blob = new Blob([resultJson], { type: 'application/json' });
-            const url = URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = `quest_result_${Date.now()}.json`;
-            document.body.appendChild(a);
-            a.click();
-            document.body.removeChild(a);
-            URL.revokeObjectURL(url);
-        } catch (e) {
+        if (!currentQuest) {
             alert('Невозможно скачать, так как результат не является валидным JSON.');
+            return;
         }
+        // JSON собирается только для скачивания, а не при каждом показе
+        const resultJson = JSON.stringify(currentQuest, null, 2);
+        const blob = new Blob([resultJson], { type: 'application/json' });
+        const url = URL.createObjectURL(blob);
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = `quest_result_${Date.now()}.json`;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        URL.revokeObjectURL(url);
     });
 
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message';
+                let data = '';
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event: ')) {
+                        event = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        data += line.slice(6);
+                    }
+                }
+                if (data) {
+                    onEvent(event, JSON.parse(data));
+                }
+            }
+        }
+    }
+
     generateBtn.addEventListener('click', async () => {
         if (!activeChatId) {
-            createNewChat();
+            await createNewChat();
         }
 
         const setting = settingInput.value.trim();
@@ -288,13 +484,24 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
-        resultBox.textContent = 'Генерация... Пожалуйста, подождите.';
+        showText('Генерация... Пожалуйста, подождите.');
         generateBtn.disabled = true;
 
-        chats[activeChatId].setting = setting;
+        const chatId = activeChatId;
+
+        // Показываем сцены по мере генерации, не дожидаясь всего квеста;
+        // список обновляется не чаще раза за кадр
+        const streamed = { nodes: [] };
+        let progressFrame = null;
+        const stopProgress = () => {
+            if (progressFrame !== null) {
+                cancelAnimationFrame(progressFrame);
+                progressFrame = null;
+            }
+        };
 
         try {
-            const response = await fetch('/generate', {
+            const response = await fetch('/generate/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -304,38 +511,64 @@ document.addEventListener('DOMContentLoaded', () => {
                     api_key: apiKey,
                     api_provider: selectedProvider,
                     model: selectedModel,
+                    use_cache: !freshGenerationCheckbox.checked,
+                    chat_id: chatId,
                 }),
             });
 
-            const data = await response.json();
-
-            if (response.ok) {
-                const result = JSON.stringify(data, null, 2);
-                resultBox.textContent = result;
-                chats[activeChatId].result = result;
-            } else {
-                const error = `Ошибка: ${data.error || 'Неизвестная ошибка сервера'}`;
-                resultBox.textContent = error;
-                chats[activeChatId].result = error;
+            if (!response.ok) {
+                const data = await response.json();
+                showText(`Ошибка: ${data.error || 'Неизвестная ошибка сервера'}`);
+                return;
             }
+
+            await readEventStream(response, (event, payload) => {
+                if (event === 'node') {
+                    streamed.nodes.push(payload.node);
+                    if (progressFrame === null) {
+                        progressFrame = requestAnimationFrame(() => {
+                            progressFrame = null;
+                            showQuest(streamed, `Генерация... Получено сцен: ${streamed.nodes.length}`);
+                        });
+                    }
+                } else if (event === 'result') {
+                    stopProgress();
+                    showQuest(payload);
+                    // Сервер сохранил квест новой версией: чат поднимается наверх
+                    const chat = chats.find(item => item.id === chatId);
+                    if (chat) {
+                        chat.versions += 1;
+                        chats = [chat, ...chats.filter(item => item.id !== chatId)];
+                        renderChatList();
+                    }
+                } else if (event === 'error') {
+                    stopProgress();
+                    showText(`Ошибка: ${payload.error || 'Неизвестная ошибка сервера'}`);
+                }
+            });
         } catch (error) {
             console.error('Fetch Error:', error);
-            const errorMsg = 'Сетевая ошибка или не удалось обработать запрос. Проверьте консоль (F12).';
-            resultBox.textContent = errorMsg;
-            chats[activeChatId].result = errorMsg;
+            stopProgress();
+            showText('Сетевая ошибка или не удалось обработать запрос. Проверьте консоль (F12).');
         } finally {
             generateBtn.disabled = false;
-            saveChats();
         }
     });
 
-    loadChats();
-    if (Object.keys(chats).length === 0) {
-        createNewChat();
-    } else {
-        activeChatId = Object.keys(chats)[0];
-        switchChat(activeChatId);
+    async function initChats() {
+        try {
+            await migrateLocalChats();
+            await loadChats();
+        } catch (error) {
+            console.error('Failed to load chats:', error);
+        }
+        if (chats.length === 0) {
+            await createNewChat();
+        } else {
+            await switchChat(chats[0].id);
+        }
     }
-    renderChatList();
+
+    initChats();
     updateModels();
 });
\ No newline at end of file
@@ -0,0 +1,262 @@
+// Просмотр больших квестов: в DOM находятся только видимые строки списка,
+// а описание и выборы узла создаются только после его раскрытия.
+
+class VirtualList {
+    constructor(viewport, renderRow, estimateHeight) {
+        this.viewport = viewport;
+        this.renderRow = renderRow;
+        this.estimateHeight = estimateHeight;
+        this.overscan = 8;
+        this.rows = [];
+        this.offsets = [0];
+        // Измеренные высоты строк по ключу; до первого показа — оценка по типу
+        this.heights = new Map();
+        this.elements = new Map();
+        this.frame = null;
+        this.width = 0;
+
+        this.spacer = document.createElement('div');
+        this.spacer.classList.add('virtual-spacer');
+        viewport.appendChild(this.spacer);
+
+        viewport.addEventListener('scroll', () => this.scheduleRender());
+        new ResizeObserver(() => {
+            // При смене ширины меняется перенос строк, старые замеры неверны
+            if (this.viewport.clientWidth !== this.width) {
+                this.width = this.viewport.clientWidth;
+                this.heights.clear();
+                this.layout();
+            }
+            this.scheduleRender();
+        }).observe(viewport);
+    }
+
+    // Строки с теми же ключами будут отрисованы заново
+    reset() {
+        for (const element of this.elements.values()) {
+            element.remove();
+        }
+        this.elements.clear();
+        this.heights.clear();
+    }
+
+    setRows(rows) {
+        this.rows = rows;
+        this.layout();
+        this.render();
+    }
+
+    heightOf(row) {
+        return this.heights.get(row.key) ?? this.estimateHeight(row);
+    }
+
+    layout() {
+        const offsets = new Array(this.rows.length + 1);
+        offsets[0] = 0;
+        for (let i = 0; i < this.rows.length; i++) {
+            offsets[i + 1] = offsets[i] + this.heightOf(this.rows[i]);
+        }
+        this.offsets = offsets;
+        this.spacer.style.height = `${offsets[this.rows.length]}px`;
+    }
+
+    // Индекс строки, в которую попадает координата y (бинарный поиск)
+    indexAt(y) {
+        let low = 0;
+        let high = this.rows.length - 1;
+        while (low < high) {
+            const middle = (low + high + 1) >> 1;
+            if (this.offsets[middle] <= y) {
+                low = middle;
+            } else {
+                high = middle - 1;
+            }
+        }
+        return Math.max(low, 0);
+    }
+
+    scheduleRender() {
+        if (this.frame === null) {
+            this.frame = requestAnimationFrame(() => {
+                this.frame = null;
+                this.render();
+            });
+        }
+    }
+
+    render() {
+        const top = this.viewport.scrollTop;
+        const bottom = top + this.viewport.clientHeight;
+        const start = Math.max(this.indexAt(top) - this.overscan, 0);
+        const end = Math.min(this.indexAt(bottom) + this.overscan + 1, this.rows.length);
+
+        const visible = new Map();
+        for (let i = start; i < end; i++) {
+            const row = this.rows[i];
+            let element = this.elements.get(row.key);
+            if (!element) {
+                element = this.renderRow(row);
+                element.classList.add('virtual-row');
+                this.spacer.appendChild(element);
+            }
+            visible.set(row.key, element);
+        }
+        for (const [key, element] of this.elements) {
+            if (!visible.has(key)) {
+                element.remove();
+            }
+        }
+        this.elements = visible;
+
+        let measured = false;
+        for (let i = start; i < end; i++) {
+            const row = this.rows[i];
+            const height = visible.get(row.key).offsetHeight;
+            if (height && height !== this.heightOf(row)) {
+                this.heights.set(row.key, height);
+                measured = true;
+            }
+        }
+        if (measured) {
+            this.layout();
+        }
+        for (let i = start; i < end; i++) {
+            visible.get(this.rows[i].key).style.transform = `translateY(${this.offsets[i]}px)`;
+        }
+    }
+
+    scrollToKey(key) {
+        const index = this.rows.findIndex(row => row.key === key);
+        if (index !== -1) {
+            this.viewport.scrollTop = this.offsets[index];
+            this.render();
+        }
+    }
+}
+
+const QUEST_ROW_HEIGHTS = {
+    meta: 36,
+    node: 34,
+    description: 64,
+    choice: 28,
+};
+
+class QuestViewer {
+    constructor(viewport) {
+        this.viewport = viewport;
+        this.list = new VirtualList(
+            viewport,
+            row => this.renderRow(row),
+            row => QUEST_ROW_HEIGHTS[row.type],
+        );
+        this.quest = null;
+        this.nodeList = [];
+        this.status = '';
+        this.expanded = new Set();
+        this.indexById = new Map();
+    }
+
+    // Тот же объект quest (например, растущий при потоковой генерации)
+    // сохраняет раскрытые узлы и позицию прокрутки.
+    show(quest, status = '') {
+        if (quest !== this.quest) {
+            this.expanded.clear();
+            this.list.reset();
+            this.viewport.scrollTop = 0;
+        }
+        this.quest = quest;
+        this.status = status;
+        const nodes = quest && Array.isArray(quest.nodes) ? quest.nodes : [];
+        this.nodeList = nodes.map(node => (node && typeof node === 'object' ? node : {}));
+        this.indexById = new Map();
+        this.nodeList.forEach((node, index) => {
+            if (!this.indexById.has(node.id)) {
+                this.indexById.set(node.id, index);
+            }
+        });
+        this.refresh();
+    }
+
+    refresh() {
+        this.list.setRows(this.buildRows());
+    }
+
+    buildRows() {
+        const nodes = this.nodeList;
+        const meta = this.status
+            || `${this.quest.questTitle || 'Без названия'} · сцен: ${nodes.length} · старт: ${this.quest.startNodeId || '—'}`;
+        const rows = [{ key: `meta:${meta}`, type: 'meta', text: meta }];
+        nodes.forEach((node, index) => {
+            const open = this.expanded.has(index);
+            rows.push({ key: `n:${index}:${open ? 1 : 0}`, type: 'node', index, open });
+            if (!open) {
+                return;
+            }
+            rows.push({ key: `d:${index}`, type: 'description', index });
+            const choices = Array.isArray(node.choices) ? node.choices : [];
+            choices.forEach((choice, position) => {
+                rows.push({ key: `c:${index}:${position}`, type: 'choice', index, choice: choice || {} });
+            });
+        });
+        return rows;
+    }
+
+    toggle(index) {
+        if (this.expanded.has(index)) {
+            this.expanded.delete(index);
+        } else {
+            this.expanded.add(index);
+        }
+        this.refresh();
+    }
+
+    reveal(nodeId) {
+        const index = this.indexById.get(nodeId);
+        if (index === undefined) {
+            return;
+        }
+        this.expanded.add(index);
+        this.refresh();
+        this.list.scrollToKey(`n:${index}:1`);
+    }
+
+    // Текст квеста вставляется только через textContent
+    renderRow(row) {
+        const element = document.createElement('div');
+        element.classList.add('quest-row', `quest-row-${row.type}`);
+        if (row.type === 'meta') {
+            element.textContent = row.text;
+            return element;
+        }
+
+        const node = this.nodeList[row.index];
+        if (row.type === 'node') {
+            const title = document.createElement('span');
+            title.classList.add('quest-node-title');
+            title.textContent = `${row.open ? '▾' : '▸'} ${node.title || node.id || 'Без названия'}`;
+            const id = document.createElement('span');
+            id.classList.add('quest-node-id');
+            id.textContent = node.id || '';
+            const type = document.createElement('span');
+            type.classList.add('quest-node-type');
+            type.textContent = node.type || '';
+            element.append(title, id, type);
+            element.addEventListener('click', () => this.toggle(row.index));
+        } else if (row.type === 'description') {
+            element.textContent = node.description || 'Нет описания.';
+        } else {
+            const text = document.createElement('span');
+            text.textContent = `→ ${row.choice.text || 'Без текста'}`;
+            const target = document.createElement('a');
+            target.href = '#';
+            target.classList.add('quest-choice-target');
+            target.textContent = row.choice.targetNodeId || '?';
+            target.addEventListener('click', (e) => {
+                e.preventDefault();
+                this.reveal(row.choice.targetNodeId);
+            });
+            element.append(text, target);
+        }
+        return element;
+    }
+}
@@ -0,0 +1,79 @@
+"""Общие функции бенчмарков: перцентили и сохранение результатов в JSON."""
+
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "app")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Бенчмарки импортируют модули приложения так же, как тесты (PYTHONPATH=app).
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """q-й перцентиль методом ближайшего ранга или None для пустой выборки."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def summarize(latencies: List[float]) -> Dict[str, Any]:
+    """p50/p95/p99, среднее и максимум в миллисекундах."""
+    summary: Dict[str, Any] = {"count": len(latencies)}
+    for q in (50, 95, 99):
+        value = percentile(latencies, q)
+        summary[f"p{q}_ms"] = None if value is None else round(value * 1000, 3)
+    if latencies:
+        summary["mean_ms"] = round(sum(latencies) / len(latencies) * 1000, 3)
+        summary["max_ms"] = round(max(latencies) * 1000, 3)
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(
+    suite: str, results: List[Dict[str, Any]], output: Optional[str] = None
+) -> str:
+    """
+    Сохраняет результаты с метаданными окружения и возвращает путь к файлу.
+
+    По умолчанию файл называется benchmarks/results/<suite>-<commit>.json,
+    чтобы результаты разных коммитов можно было сравнить через
+    python -m benchmarks.compare.
+    """
+    commit = git_commit()
+    path = output or os.path.join(RESULTS_DIR, f"{suite}-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    document = {
+        "suite": suite,
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    return path
@@ -0,0 +1,82 @@
+"""
+Сравнение двух файлов результатов бенчмарков.
+
+    python -m benchmarks.compare benchmarks/results/micro-abc123.json \\
+        benchmarks/results/micro-def456.json --threshold 10
+
+Сравнивает p50 (и RPS для нагрузочных тестов) одинаковых бенчмарков и
+завершается с кодом 1, если хоть один ухудшился больше чем на threshold
+процентов.
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+# Поля, по которым результаты сопоставляются между файлами.
+KEY_FIELDS = ("benchmark", "nodes", "server", "scenario", "concurrency")
+
+
+def _key(result: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(result.get(field) for field in KEY_FIELDS)
+
+
+def _load(path: str) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return {_key(result): result for result in json.load(f)["results"]}
+
+
+def compare(
+    base: Dict[Tuple[Any, ...], Dict[str, Any]],
+    head: Dict[Tuple[Any, ...], Dict[str, Any]],
+    threshold: float,
+) -> List[Dict[str, Any]]:
+    """
+    Строки сравнения для общих бенчмарков.
+
+    change — изменение в процентах в сторону ухудшения: рост p50 или
+    падение RPS. regression истинно, если change больше threshold.
+    """
+    rows = []
+    for key in base.keys() & head.keys():
+        for metric, higher_is_better in (("p50_ms", False), ("rps", True)):
+            before: Optional[float] = base[key].get(metric)
+            after: Optional[float] = head[key].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            if higher_is_better:
+                change = -change
+            rows.append(
+                {
+                    "name": " ".join(str(part) for part in key if part is not None),
+                    "metric": metric,
+                    "before": before,
+                    "after": after,
+                    "change": round(change, 1),
+                    "regression": change > threshold,
+                }
+            )
+    return sorted(rows, key=lambda row: (row["name"], row["metric"]))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    rows = compare(_load(args.base), _load(args.head), args.threshold)
+    for row in rows:
+        mark = "REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['name']:>40} {row['metric']:>7}: {row['before']:>10} -> "
+            f"{row['after']:>10} ({row['change']:+.1f}%) {mark}"
+        )
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
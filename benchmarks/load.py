@@ -0,0 +1,238 @@
+"""
+HTTP-нагрузка на эндпоинты приложения с поддельным провайдером.
+
+Для каждой конфигурации сервера (тип и число воркеров gunicorn) поднимает
+приложение и поддельный OpenAI-совместимый сервер services.fake_llm,
+нагружает /generate, /api/models и /validate_api_key заданным числом
+параллельных клиентов и сохраняет p50/p95/p99 задержки и RPS в JSON.
+Запуск из корня репозитория:
+
+    python -m benchmarks.load --servers gthread:2x64,sync:4 --duration 20
+
+Конфигурация "werkzeug" запускает встроенный сервер Flask для окружений
+без gunicorn.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.common import APP_DIR, summarize, write_results
+
+SCENARIOS = ("generate", "generate_cached", "models", "validate_api_key")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_command(spec: str, port: int) -> List[str]:
+    """
+    Команда запуска приложения по спецификации воркеров.
+
+    "gthread:2x64" — 2 процесса gthread по 64 потока, "sync:4" — 4 процесса
+    sync, "werkzeug" — встроенный многопоточный сервер Flask.
+    """
+    if spec == "werkzeug":
+        return [
+            sys.executable,
+            "-m",
+            "flask",
+            "--app",
+            "main",
+            "run",
+            "--port",
+            str(port),
+            "--with-threads",
+        ]
+    worker_class, _, size = spec.partition(":")
+    workers, _, threads = (size or "1").partition("x")
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--worker-class",
+        worker_class,
+        "--workers",
+        workers,
+        "--bind",
+        f"127.0.0.1:{port}",
+        "--timeout",
+        "120",
+    ]
+    if threads:
+        command += ["--threads", threads]
+    return command + ["main:app"]
+
+
+def _start(command: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        command,
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}: {url}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not start in {timeout}s: {url}")
+
+
+def _request(scenario: str, number: int) -> Dict[str, Any]:
+    if scenario in ("generate", "generate_cached"):
+        cached = scenario == "generate_cached"
+        return {
+            "url": "/generate",
+            "json": {
+                "setting": "benchmark" if cached else f"benchmark {number}",
+                "api_key": "benchmark",
+                "api_provider": "fake",
+                "model": "fake-quest",
+                "use_cache": cached,
+            },
+        }
+    url = "/api/models" if scenario == "models" else "/validate_api_key"
+    return {"url": url, "json": {"api_key": "benchmark", "api_provider": "fake"}}
+
+
+async def run_scenario(
+    base_url: str, scenario: str, concurrency: int, duration: float
+) -> Dict[str, Any]:
+    """Закрытая модель нагрузки: concurrency клиентов шлют запросы без пауз."""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = iter(range(sys.maxsize))
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=120.0, limits=limits
+    ) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker() -> None:
+            while time.perf_counter() < deadline:
+                request = _request(scenario, next(counter))
+                started = time.perf_counter()
+                try:
+                    response = await client.post(request["url"], json=request["json"])
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ok = statuses.get("200", 0)
+    return {
+        **summarize(latencies),
+        "rps": round(len(latencies) / elapsed, 2),
+        "ok_rps": round(ok / elapsed, 2),
+        "errors": len(latencies) - ok,
+        "statuses": statuses,
+    }
+
+
+def run(
+    servers: List[str],
+    scenarios: List[str],
+    concurrency: int,
+    duration: float,
+    llm_env: Dict[str, str],
+) -> List[Dict[str, Any]]:
+    results = []
+    llm_port = _free_port()
+    env = {**os.environ, **llm_env, "PYTHONPATH": APP_DIR}
+    llm = _start(
+        [sys.executable, "-m", "services.fake_llm", "--port", str(llm_port)], env
+    )
+    try:
+        _wait_ready(f"http://127.0.0.1:{llm_port}/v1/models", llm)
+        env["FAKE_LLM_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+        for spec in servers:
+            port = _free_port()
+            app = _start(server_command(spec, port), env)
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                _wait_ready(base_url + "/", app)
+                for scenario in scenarios:
+                    result = asyncio.run(
+                        run_scenario(base_url, scenario, concurrency, duration)
+                    )
+                    results.append(
+                        {
+                            "server": spec,
+                            "scenario": scenario,
+                            "concurrency": concurrency,
+                            "duration_s": duration,
+                            **result,
+                        }
+                    )
+                    print(
+                        f"{spec:>14} {scenario:>17}: {result['rps']:>8.1f} rps"
+                        f"  p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms"
+                        f"  p99 {result['p99_ms']} ms  errors {result['errors']}"
+                    )
+            finally:
+                app.terminate()
+                app.wait()
+    finally:
+        llm.terminate()
+        llm.wait()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--servers", default="gthread:2x64")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--llm-latency", default="0.2", help="FAKE_LLM_LATENCY, seconds"
+    )
+    parser.add_argument("--llm-latency-sigma", default="0.5")
+    parser.add_argument("--llm-tokens-per-second", default="0")
+    parser.add_argument("--llm-node-count", default="8")
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    llm_env = {
+        "FAKE_LLM_LATENCY": args.llm_latency,
+        "FAKE_LLM_LATENCY_SIGMA": args.llm_latency_sigma,
+        "FAKE_LLM_TOKENS_PER_SECOND": args.llm_tokens_per_second,
+        "FAKE_LLM_NODE_COUNT": args.llm_node_count,
+    }
+    results = run(
+        args.servers.split(","),
+        args.scenarios.split(","),
+        args.concurrency,
+        args.duration,
+        llm_env,
+    )
+    print(f"Results: {write_results('load', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
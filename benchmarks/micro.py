@@ -0,0 +1,89 @@
+"""
+Микробенчмарки разбора и проверки квестов.
+
+Синтетические квесты от 10 до 10 000 узлов прогоняются через извлечение
+JSON, потоковый парсер узлов, проверку схемы, проверку графа и его
+починку. Запуск из корня репозитория:
+
+    python -m benchmarks.micro --sizes 10,100,1000,10000
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmarks.common import summarize, write_results
+from services.fake_llm import fake_quest
+from services.json_extract import QuestNodeStreamParser, extract_json_object
+from services.quest_schema import QUEST_SCHEMA, schema_errors
+from services.quest_validator import repair_quest, validate_quest
+
+DEFAULT_SIZES = "10,100,1000,10000"
+
+
+def _stream_parse(text: str) -> None:
+    parser = QuestNodeStreamParser()
+    for start in range(0, len(text), 64):
+        end = start + 64
+        parser.feed(text[start:end])
+
+
+def _cases(quest: Dict[str, Any]) -> Dict[str, Callable[[], Any]]:
+    text = json.dumps(quest, ensure_ascii=False)
+    # Оборванный ответ модели: обрыв посреди последнего узла.
+    cut = len(text) - 40
+    truncated = f"```json\n{text[:cut]}"
+    return {
+        "extract_json": lambda: extract_json_object(text),
+        "extract_truncated_json": lambda: extract_json_object(truncated),
+        "stream_parse": lambda: _stream_parse(text),
+        "schema_validate": lambda: schema_errors(quest, QUEST_SCHEMA),
+        "graph_validate": lambda: validate_quest(quest),
+        "graph_repair": lambda: repair_quest(quest),
+    }
+
+
+def measure(fn: Callable[[], Any], min_time: float, max_rounds: int) -> List[float]:
+    """Повторяет fn, пока не наберётся min_time секунд или max_rounds запусков."""
+    fn()  # Прогрев.
+    timings: List[float] = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < max_rounds and (
+        len(timings) < 3 or time.perf_counter() < deadline
+    ):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run(sizes: List[int], min_time: float, max_rounds: int) -> List[Dict[str, Any]]:
+    results = []
+    for size in sizes:
+        quest = fake_quest(f"benchmark {size}", size, description_words=20)
+        for name, fn in _cases(quest).items():
+            timings = measure(fn, min_time, max_rounds)
+            result = {"benchmark": name, "nodes": size, **summarize(timings)}
+            results.append(result)
+            print(
+                f"{name:>24} {size:>6} nodes: p50 {result['p50_ms']:>10.3f} ms"
+                f"  p95 {result['p95_ms']:>10.3f} ms  ({len(timings)} runs)"
+            )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--min-time", type=float, default=1.0)
+    parser.add_argument("--max-rounds", type=int, default=1000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(sizes, args.min_time, args.max_rounds)
+    print(f"Results: {write_results('micro', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
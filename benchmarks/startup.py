@@ -0,0 +1,106 @@
+"""
+Бенчмарк запуска воркера: время импорта приложения и память процесса.
+
+Каждый замер — отдельный процесс Python, который импортирует main при
+заданном LLM_PROVIDERS. Сценарий "lazy" — SDK не загружаются до первого
+запроса, "groq,openai,gemini" соответствует прежнему поведению, когда
+все SDK импортировались вместе с модулем генератора. Бенчмарк first_use
+показывает, сколько стоит ленивый импорт SDK при первом запросе.
+Запуск из корня репозитория:
+
+    python -m benchmarks.startup --rounds 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+from benchmarks.common import APP_DIR, summarize, write_results
+
+DEFAULT_SCENARIOS = "lazy;groq;openai;gemini;groq,openai,gemini"
+
+# Дочерний процесс печатает одну строку JSON с результатами замера.
+_CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter() - started
+first_use = None
+if len(sys.argv) > 1:
+    from services.providers import preload_provider_sdks
+    started = time.perf_counter()
+    preload_provider_sdks([sys.argv[1]])
+    first_use = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss //= 1024
+print(json.dumps({
+    "import_s": imported,
+    "first_use_s": first_use,
+    "max_rss_kb": rss,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def _measure(providers: str, first_use: Optional[str] = None) -> Dict[str, Any]:
+    env = {**os.environ, "PYTHONPATH": APP_DIR, "LLM_PROVIDERS": providers}
+    command = [sys.executable, "-c", _CHILD] + ([first_use] if first_use else [])
+    completed = subprocess.run(
+        command, cwd=APP_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _result(
+    benchmark: str, scenario: str, samples: List[Dict[str, Any]], field: str
+) -> Dict[str, Any]:
+    rss = sorted(sample["max_rss_kb"] for sample in samples)
+    middle = len(rss) // 2
+    return {
+        "benchmark": benchmark,
+        "scenario": scenario,
+        **summarize([sample[field] for sample in samples]),
+        "max_rss_mb": round(rss[middle] / 1024, 1),
+        "modules": samples[-1]["modules"],
+    }
+
+
+def run(scenarios: List[str], rounds: int) -> List[Dict[str, Any]]:
+    results = []
+    for scenario in scenarios:
+        providers = "" if scenario == "lazy" else scenario
+        samples = [_measure(providers) for _ in range(rounds)]
+        results.append(_result("import_main", scenario, samples, "import_s"))
+    for provider in ("groq", "openai", "gemini"):
+        samples = [_measure("", provider) for _ in range(rounds)]
+        results.append(_result("first_use", provider, samples, "first_use_s"))
+    for result in results:
+        print(
+            f"{result['benchmark']:>12} {result['scenario']:>20}: "
+            f"p50 {result['p50_ms']:>9.1f} ms  rss {result['max_rss_mb']:>6.1f} MB"
+            f"  {result['modules']:>5} modules"
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        default=DEFAULT_SCENARIOS,
+        help="значения LLM_PROVIDERS через ';' (lazy — пустое значение)",
+    )
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    scenarios = [scenario for scenario in args.scenarios.split(";") if scenario]
+    results = run(scenarios, args.rounds)
+    print(f"Results: {write_results('startup', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from services.client_pool import default_pool
+from services.metrics import metrics
+from services.quest_cache import quest_cache
+from services.quest_generator import api_key_cache, model_labels, models_cache
+from services.rate_limiter import rate_limiters
+from services.resilience import circuit_breakers
+from services.router import latency_router
+
+SHARED_CACHES = (
+    default_pool,
+    quest_cache,
+    api_key_cache,
+    models_cache,
+    model_labels,
+    rate_limiters,
+    latency_router,
+    circuit_breakers,
+    metrics,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_shared_state(monkeypatch, tmp_path):
+    """Очищает пул клиентов, кэши и лимитеры, чтобы моки не переходили между тестами."""
+    monkeypatch.setenv("METRICS_DB", str(tmp_path / "metrics.db"))
+    monkeypatch.setenv("HISTORY_DB", str(tmp_path / "history.db"))
+    for cache in SHARED_CACHES:
+        cache.clear()
+    yield
+    for cache in SHARED_CACHES:
+        cache.clear()
+
+
+class FakeClock:
+    """Часы, которые идут только по команде теста; sleep сдвигает их мгновенно."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    """Управляемые часы для TTL, лимитеров и повторов."""
+    return FakeClock()
+
+
+class TransientError(Exception):
+    """Временная ошибка для тестов повторов и переключения маршрутов."""
+
+    @classmethod
+    def matches(cls, e):
+        return isinstance(e, cls)
+
+
+@pytest.fixture
+def transient():
+    """Класс временной ошибки; transient.matches — проверка для retry и router."""
+    return TransientError
+
+
+def _completion(content):
+    completion = MagicMock()
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    completion.choices[0].message.content = content
+    return completion
+
+
+@pytest.fixture
+def completion():
+    """Фабрика ответа chat.completions; не-строковое содержимое сериализуется в JSON."""
+    return _completion
+
+
+def _make_quest(title="Квест"):
+    return {
+        "questTitle": title,
+        "startNodeId": "start",
+        "nodes": [
+            {
+                "id": "start",
+                "title": "Развилка",
+                "type": "CHOICE",
+                "description": "Дорога расходится.",
+                "choices": [
+                    {"text": "Налево", "targetNodeId": "win"},
+                    {"text": "Направо", "targetNodeId": "lose"},
+                ],
+            },
+            {"id": "win", "title": "Победа", "type": "ENDING_SUCCESS", "choices": []},
+            {
+                "id": "lose",
+                "title": "Поражение",
+                "type": "ENDING_FAILURE",
+                "choices": [],
+            },
+        ],
+    }
+
+
+@pytest.fixture
+def make_quest():
+    """Фабрика минимального квеста, который проходит проверку графа."""
+    return _make_quest
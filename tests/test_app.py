@@ -1,6 +1,9 @@
 import json
 import pytest
+from unittest.mock import patch
 from main import app
+from services.job_queue import QueueFullError
+from services.quest_export import decode_quest
 
 
 @pytest.fixture
@@ -37,10 +40,11 @@ def test_generate_quest_endpoint_success(client, monkeypatch):
         "startNodeId": "1",
         "nodes": [],
     }
-    monkeypatch.setattr(
-        "main.create_quest_from_setting",
-        lambda setting, api_key, api_provider, model: mock_quest,
-    )
+
+    def fake_create_quest(setting, api_key, api_provider, model, use_cache):
+        return mock_quest
+
+    monkeypatch.setattr("main.create_quest_from_setting", fake_create_quest)
     response = client.post(
         "/generate",
         json={
@@ -64,13 +68,32 @@ def test_generate_quest_endpoint_missing_data(client):
     )
 
 
+def test_generate_endpoints_reject_non_string_fields(client):
+    """Тестирует ответ 400 в JSON, если поля запроса не непустые строки."""
+    base = {
+        "setting": "сеттинг",
+        "api_key": "key",
+        "api_provider": "groq",
+        "model": "llama3",
+    }
+    for url in ("/generate", "/generate/stream"):
+        for field, value in (("setting", 5), ("model", ["x"]), ("api_key", "")):
+            response = client.post(url, json={**base, field: value})
+            assert response.status_code == 400
+            assert "Missing 'setting'" in response.get_json()["error"]
+    route = {"api_provider": "groq", "model": None, "api_key": "key"}
+    response = client.post("/generate", json={"setting": "сеттинг", "routes": [route]})
+    assert response.status_code == 400
+
+
 def test_generate_quest_endpoint_generator_error(client, monkeypatch):
     """Тестирует ответ 500, когда генератор квестов возвращает ошибку."""
     error_response = {"error": "Произошла ошибка генерации"}
-    monkeypatch.setattr(
-        "main.create_quest_from_setting",
-        lambda setting, api_key, api_provider, model: error_response,
-    )
+
+    def fake_create_quest(setting, api_key, api_provider, model, use_cache):
+        return error_response
+
+    monkeypatch.setattr("main.create_quest_from_setting", fake_create_quest)
     response = client.post(
         "/generate",
         json={
@@ -162,3 +185,389 @@ def test_get_available_models_endpoint_missing_data(client):
     response = client.post("/api/models", json={"api_provider": "groq"})
     assert response.status_code == 400
     assert "Missing 'api_key' or 'api_provider'" in response.get_json().get("error", "")
+
+
+def test_generate_stream_endpoint_sends_sse_events(client, monkeypatch):
+    """Тестирует, что /generate/stream отдаёт события в формате SSE."""
+
+    def fake_stream(setting, api_key, api_provider, model, use_cache):
+        yield "node", {"node": {"id": "start"}}
+        yield "result", {"questTitle": "Квест"}
+
+    monkeypatch.setattr("main.stream_quest_from_setting", fake_stream)
+    response = client.post(
+        "/generate/stream",
+        json={
+            "setting": "сеттинг",
+            "api_key": "key",
+            "api_provider": "groq",
+            "model": "llama3-8b-8192",
+        },
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert body == (
+        'event: node\ndata: {"node": {"id": "start"}}\n\n'
+        'event: result\ndata: {"questTitle": "Квест"}\n\n'
+    )
+
+
+def test_generate_stream_endpoint_missing_data(client):
+    """Тестирует ответ 400 потокового эндпоинта при неполном запросе."""
+    response = client.post("/generate/stream", json={"setting": "сеттинг"})
+    assert response.status_code == 400
+
+
+def test_generate_batch_endpoint_streams_ndjson(client, monkeypatch):
+    """Тестирует, что /generate/batch отдаёт результаты построчно в NDJSON."""
+    calls = {}
+
+    def fake_batch(settings, defaults, concurrency, use_cache):
+        calls.update(defaults=defaults, concurrency=concurrency)
+        yield {"index": 1, "result": {"questTitle": "Второй"}}
+        yield {"index": 0, "error": "Ошибка"}
+
+    monkeypatch.setattr("main.generate_quests_batch", fake_batch)
+    response = client.post(
+        "/generate/batch",
+        json={
+            "settings": ["первый", "второй"],
+            "api_key": "key",
+            "api_provider": "groq",
+            "model": "llama3-8b-8192",
+            "concurrency": 3,
+        },
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [
+        {"index": 1, "result": {"questTitle": "Второй"}},
+        {"index": 0, "error": "Ошибка"},
+    ]
+    assert calls == {
+        "defaults": {
+            "api_key": "key",
+            "api_provider": "groq",
+            "model": "llama3-8b-8192",
+        },
+        "concurrency": 3,
+    }
+
+
+def test_generate_batch_endpoint_requires_settings(client):
+    """Тестирует ответ 400 при отсутствии списка сеттингов."""
+    response = client.post("/generate/batch", json={"settings": []})
+    assert response.status_code == 400
+    assert "Missing 'settings'" in response.get_json()["error"]
+
+
+def test_generate_batch_endpoint_validates_before_streaming(client, monkeypatch):
+    """Тестирует ответ 400 на неверные concurrency и api_provider до начала потока."""
+    monkeypatch.setattr("main.generate_quests_batch", pytest.fail)
+    base = {"settings": ["сеттинг"], "api_key": "key", "model": "llama3"}
+    invalid = [
+        {"api_provider": "groq", "concurrency": "4"},
+        {"api_provider": "groq", "concurrency": 0},
+        {"api_provider": "groq", "concurrency": True},
+        {"api_provider": "groq", "concurrency": {"groq": "2"}},
+        {"api_provider": "groq", "concurrency": {"groq": 1000}},
+        {"api_provider": ["groq"]},
+        {"api_provider": "groq", "settings": [{"setting": "s", "api_provider": {}}]},
+    ]
+    for fields in invalid:
+        response = client.post("/generate/batch", json={**base, **fields})
+        assert response.status_code == 400, fields
+
+
+def test_generate_background_returns_job_id(client, monkeypatch):
+    """Тестирует, что /generate с background=true сразу возвращает id задачи."""
+    submitted = {}
+
+    def fake_submit(setting, api_key, api_provider, model, use_cache):
+        submitted.update(setting=setting, api_key=api_key)
+        return "job123"
+
+    monkeypatch.setattr("main.submit_generation_job", fake_submit)
+    response = client.post(
+        "/generate",
+        json={
+            "setting": "сеттинг",
+            "api_key": "key",
+            "api_provider": "groq",
+            "model": "llama3-8b-8192",
+            "background": True,
+        },
+    )
+    assert response.status_code == 202
+    assert response.get_json() == {"job_id": "job123", "status": "pending"}
+    assert response.headers["Location"].endswith("/jobs/job123")
+    assert submitted == {"setting": "сеттинг", "api_key": "key"}
+
+
+def test_generate_background_queue_full(client, monkeypatch):
+    """Тестирует ответ 503 при переполненной очереди."""
+
+    def fake_submit(*args, **kwargs):
+        raise QueueFullError("full")
+
+    monkeypatch.setattr("main.submit_generation_job", fake_submit)
+    response = client.post(
+        "/generate",
+        json={
+            "setting": "сеттинг",
+            "api_key": "key",
+            "api_provider": "groq",
+            "model": "llama3-8b-8192",
+            "background": True,
+        },
+    )
+    assert response.status_code == 503
+
+
+def test_job_status_endpoint(client, monkeypatch):
+    """Тестирует получение статуса и результата задачи."""
+    jobs = {"job123": {"id": "job123", "status": "done", "result": {"q": 1}}}
+    monkeypatch.setattr("main.get_generation_job", jobs.get)
+    assert client.get("/jobs/job123").get_json()["result"] == {"q": 1}
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_generate_with_routes(client, monkeypatch):
+    """Тестирует генерацию по списку маршрутов."""
+    routes = [
+        {"api_provider": "groq", "model": "llama3", "api_key": "k1"},
+        {"api_provider": "openai", "model": "gpt-4", "api_key": "k2"},
+    ]
+
+    async def fake_routed(setting, received_routes, use_cache):
+        assert received_routes == routes
+        return {"questTitle": "Маршрут"}
+
+    monkeypatch.setattr("main.create_quest_routed_async", fake_routed)
+    response = client.post("/generate", json={"setting": "сеттинг", "routes": routes})
+    assert response.status_code == 200
+    assert response.get_json() == {"questTitle": "Маршрут"}
+
+
+def test_generate_with_invalid_routes(client):
+    """Тестирует ответ 400 для неполного списка маршрутов."""
+    response = client.post(
+        "/generate", json={"setting": "сеттинг", "routes": [{"api_provider": "groq"}]}
+    )
+    assert response.status_code == 400
+
+
+def test_provider_status_endpoint(client, monkeypatch):
+    """Тестирует эндпоинт состояния провайдеров."""
+    status = {"circuit_breakers": {"groq": {"state": "open"}}, "latency": {}}
+    monkeypatch.setattr("main.get_provider_status", lambda: status)
+    response = client.get("/providers/status")
+    assert response.status_code == 200
+    assert response.get_json() == status
+
+
+def test_generate_hierarchical(client, monkeypatch):
+    """Тестирует двухэтапную генерацию большого квеста через /generate."""
+    received = {}
+
+    async def fake_hierarchical(
+        setting, api_key, api_provider, model, node_count, use_cache
+    ):
+        received["node_count"] = node_count
+        return {"questTitle": "Большой"}
+
+    monkeypatch.setattr("main.create_quest_hierarchical_async", fake_hierarchical)
+    payload = {
+        "setting": "сеттинг",
+        "api_key": "key",
+        "api_provider": "groq",
+        "model": "llama3",
+        "hierarchical": True,
+        "node_count": 200,
+    }
+    response = client.post("/generate", json=payload)
+    assert response.status_code == 200
+    assert received == {"node_count": 200}
+
+    payload["node_count"] = 100000
+    assert client.post("/generate", json=payload).status_code == 400
+
+
+def test_regenerate_nodes_route(client, monkeypatch, make_quest):
+    """Тестирует перегенерацию отдельных узлов через /generate/nodes."""
+    received = {}
+
+    async def fake_regenerate(
+        quest, node_ids, api_key, api_provider, model, instruction
+    ):
+        received.update(node_ids=node_ids, instruction=instruction)
+        return quest
+
+    monkeypatch.setattr("main.regenerate_quest_nodes_async", fake_regenerate)
+    payload = {
+        "quest": make_quest(),
+        "node_ids": ["win", "win"],
+        "instruction": "Короче",
+        "api_key": "key",
+        "api_provider": "groq",
+        "model": "llama3",
+    }
+    response = client.post("/generate/nodes", json=payload)
+    assert response.status_code == 200
+    assert received == {"node_ids": ["win"], "instruction": "Короче"}
+
+    payload["node_ids"] = ["nope"]
+    response = client.post("/generate/nodes", json=payload)
+    assert response.status_code == 400
+    assert "nope" in response.get_json()["error"]
+
+
+def test_regenerate_nodes_route_validates_quest_schema(client, make_quest):
+    """Тестирует отказ /generate/nodes для квеста, не подходящего под схему."""
+    quest = make_quest()
+    quest["nodes"][0]["type"] = "BOSS"
+    response = client.post(
+        "/generate/nodes",
+        json={
+            "quest": quest,
+            "node_ids": ["start"],
+            "api_key": "key",
+            "api_provider": "groq",
+            "model": "llama3",
+        },
+    )
+    assert response.status_code == 400
+    assert "$.nodes[0].type" in response.get_json()["error"]
+
+
+def test_regenerate_nodes_route_rejects_non_string_ids(client, make_quest):
+    """Тестирует ответ 400, если node_ids содержит не строки."""
+    for node_ids in ([{}], [["start"]], "start"):
+        response = client.post(
+            "/generate/nodes",
+            json={
+                "quest": make_quest(),
+                "node_ids": node_ids,
+                "api_key": "key",
+                "api_provider": "groq",
+                "model": "llama3",
+            },
+        )
+        assert response.status_code == 400
+        assert "list of strings" in response.get_json()["error"]
+
+
+def test_metrics_endpoint(client):
+    """Эндпоинт /metrics отдаёт счётчики запросов в формате Prometheus."""
+    client.get("/")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert "# TYPE http_requests_total counter" in text
+    assert 'http_requests_total{endpoint="index",method="GET",status="200"} 1' in text
+
+
+def test_history_routes(client, make_quest):
+    """Чаты создаются, читаются постранично и по одному для своего cookie."""
+    created = client.post(
+        "/history/chats",
+        json={"title": "Первый", "setting": "лес", "quest": make_quest()},
+    )
+    assert created.status_code == 201
+    assert "quest_user=" in created.headers["Set-Cookie"]
+    chat_id = created.get_json()["id"]
+    client.post("/history/chats", json={"title": "Второй"})
+
+    page = client.get("/history/chats?limit=1").get_json()
+    assert len(page["chats"]) == 1 and page["next_cursor"]
+    rest = client.get(f"/history/chats?limit=1&cursor={page['next_cursor']}")
+    assert rest.get_json()["next_cursor"] is None
+
+    chat = client.get(f"/history/chats/{chat_id}").get_json()
+    assert chat["quest"] == make_quest() and chat["setting"] == "лес"
+    assert (
+        client.patch(f"/history/chats/{chat_id}", json={"title": 1}).status_code == 400
+    )
+    assert client.delete(f"/history/chats/{chat_id}").status_code == 204
+    assert client.get(f"/history/chats/{chat_id}").status_code == 404
+    assert client.get("/history/chats?cursor=broken").status_code == 400
+
+
+def test_generate_stream_saves_result_to_chat(client, monkeypatch, make_quest):
+    """Потоковая генерация с chat_id сохраняет квест новой версией чата."""
+    monkeypatch.setattr(
+        "main.stream_quest_from_setting",
+        lambda *args, **kwargs: iter([("result", make_quest("Новый"))]),
+    )
+    chat_id = client.post("/history/chats", json={}).get_json()["id"]
+    payload = {
+        "setting": "лес",
+        "api_key": "key",
+        "api_provider": "groq",
+        "model": "m",
+        "chat_id": chat_id,
+    }
+
+    response = client.post("/generate/stream", json=payload)
+    response.get_data()
+
+    chat = client.get(f"/history/chats/{chat_id}").get_json()
+    assert chat["versions"] == 1 and chat["quest"]["questTitle"] == "Новый"
+    missing = client.post("/generate/stream", json={**payload, "chat_id": "nope"})
+    assert missing.status_code == 404
+    for chat_id in (["x"], {"id": chat_id}, 5):
+        invalid = client.post("/generate/stream", json={**payload, "chat_id": chat_id})
+        assert invalid.status_code == 400
+        assert "chat_id" in invalid.get_json()["error"]
+
+
+def test_export_routes(client, make_quest):
+    """Квест и последняя версия чата экспортируются в QSTB и JSON."""
+    response = client.post("/export", json={"quest": make_quest()})
+    assert response.status_code == 200
+    assert response.mimetype == "application/octet-stream"
+    assert ".qstb" in response.headers["Content-Disposition"]
+    assert decode_quest(response.data)["startNodeId"] == "start"
+
+    index = client.post("/export", json={"quest": make_quest(), "format": "json"})
+    assert index.get_json()["format"] == "qstb-json"
+    assert (
+        client.post(
+            "/export", json={"quest": make_quest(), "format": "xml"}
+        ).status_code
+        == 400
+    )
+    assert client.post("/export", json={"quest": {"nodes": [1]}}).status_code == 400
+
+    chat_id = client.post(
+        "/history/chats", json={"title": "Чат", "quest": make_quest()}
+    ).get_json()["id"]
+    exported = client.get(f"/history/chats/{chat_id}/export")
+    assert decode_quest(exported.data)["questTitle"] == "Квест"
+    empty_id = client.post("/history/chats", json={"title": "Пустой"}).get_json()["id"]
+    assert client.get(f"/history/chats/{empty_id}/export").status_code == 404
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_generate_reuses_pooled_client(mock_groq, client, make_quest, completion):
+    """/generate обращается к провайдеру через клиент из пула, а не создаёт новый."""
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = completion(make_quest())
+    for setting in ("первый", "второй"):
+        response = client.post(
+            "/generate",
+            json={
+                "setting": setting,
+                "api_key": "key",
+                "api_provider": "groq",
+                "model": "llama3",
+            },
+        )
+        assert response.get_json() == make_quest()
+    assert create.call_count == 2
+    mock_groq.assert_called_once()
@@ -0,0 +1,67 @@
+from unittest.mock import MagicMock, patch
+
+from services.client_pool import ClientPool, hash_api_key
+from services.quest_generator import get_available_models, validate_api_key
+
+
+def test_pool_reuses_client_for_same_key():
+    """Тестирует, что для одного ключа клиент создаётся только один раз."""
+    pool = ClientPool()
+    factory = MagicMock(side_effect=lambda key: object())
+    first = pool.get("groq", "key", factory)
+    second = pool.get("groq", "key", factory)
+    assert first is second
+    factory.assert_called_once_with("key")
+
+
+def test_pool_separates_providers_and_keys():
+    """Тестирует, что разные провайдеры и ключи получают разные клиенты."""
+    pool = ClientPool()
+    factory = MagicMock(side_effect=lambda key: object())
+    a = pool.get("groq", "key1", factory)
+    b = pool.get("groq", "key2", factory)
+    c = pool.get("openai", "key1", factory)
+    assert len({id(a), id(b), id(c)}) == 3
+
+
+def test_pool_evicts_least_recently_used():
+    """Тестирует вытеснение давно не использованного клиента."""
+    pool = ClientPool(max_size=2)
+    factory = MagicMock(side_effect=lambda key: object())
+    a = pool.get("groq", "a", factory)
+    pool.get("groq", "b", factory)
+    pool.get("groq", "a", factory)
+    pool.get("groq", "c", factory)
+    assert len(pool) == 2
+    assert pool.get("groq", "a", factory) is a
+    assert factory.call_count == 3
+
+
+def test_pool_expires_idle_clients(clock):
+    """Тестирует, что клиент пересоздаётся после истечения TTL."""
+    pool = ClientPool(ttl=10, clock=clock)
+    factory = MagicMock(side_effect=lambda key: object())
+    first = pool.get("groq", "key", factory)
+    clock.now = 5
+    assert pool.get("groq", "key", factory) is first
+    clock.now = 20
+    assert pool.get("groq", "key", factory) is not first
+
+
+def test_hash_api_key_does_not_expose_key():
+    """Тестирует, что хэш ключа не содержит сам ключ."""
+    digest = hash_api_key("secret-key")
+    assert "secret-key" not in digest
+    assert len(digest) == 64
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_provider_client_shared_between_endpoints(mock_groq):
+    """Тестирует, что проверка ключа и список моделей используют один клиент."""
+    mock_model = MagicMock()
+    mock_model.id = "llama3-8b-8192"
+    mock_groq.return_value.models.list.return_value.data = [mock_model]
+    assert validate_api_key("groq", "key") == {"status": "ok"}
+    assert get_available_models("groq", "key") == {"models": ["llama3-8b-8192"]}
+    mock_groq.assert_called_once()
+    assert mock_groq.call_args.kwargs["api_key"] == "key"
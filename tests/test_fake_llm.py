@@ -0,0 +1,135 @@
+import asyncio
+import threading
+from unittest.mock import ANY, patch
+
+import pytest
+from werkzeug.serving import make_server
+
+from services.fake_llm import FakeLLMConfig, create_app, fake_quest
+from services.prompts import QUEST_TEMPLATE
+from services.quest_generator import (
+    create_quest_from_setting,
+    create_quest_hierarchical_async,
+    get_available_models,
+    stream_quest_from_setting,
+    validate_api_key,
+)
+from services.quest_validator import validate_quest
+from services.rate_limiter import rate_limiters
+from services.resilience import retry_policy
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """Запускает поддельный сервер на свободном порту и направляет на него провайдер fake."""
+    servers = []
+
+    def start(**options):
+        config = FakeLLMConfig(**{"latency": 0.0, **options})
+        server = make_server("127.0.0.1", 0, create_app(config), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setenv(
+            "FAKE_LLM_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1"
+        )
+        return config
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_fake_quest_is_valid_and_deterministic():
+    """Тестирует, что поддельный квест корректен и зависит только от сеттинга."""
+    quest = fake_quest("лес", 12)
+    assert len(quest["nodes"]) == 12
+    assert validate_quest(quest) == []
+    assert fake_quest("лес", 12) == quest
+    assert fake_quest("море", 12) != quest
+
+
+def test_config_reads_environment(monkeypatch):
+    """Тестирует чтение настроек из переменных FAKE_LLM_*."""
+    monkeypatch.setenv("FAKE_LLM_ERROR_RATE", "0.25")
+    monkeypatch.setenv("FAKE_LLM_NODE_COUNT", "40")
+    config = FakeLLMConfig.from_env()
+    assert config.error_rate == 0.25
+    assert config.node_count == 40
+
+
+def test_generation_end_to_end(fake_server):
+    """Тестирует генерацию через настоящий клиент OpenAI и поддельный сервер."""
+    fake_server(node_count=6)
+    quest = create_quest_from_setting("сеттинг", "key", "fake", "fake-quest")
+    assert quest == fake_quest(QUEST_TEMPLATE.render(setting="сеттинг").user, 6)
+
+
+def test_streaming_end_to_end(fake_server):
+    """Тестирует потоковую генерацию через поддельный сервер."""
+    fake_server(node_count=4)
+    limiter = rate_limiters.get("fake", "key", "fake-quest")
+    with patch.object(limiter, "record_usage") as record_usage:
+        events = list(stream_quest_from_setting("сеттинг", "key", "fake", "fake-quest"))
+    kinds = [kind for kind, _ in events]
+    assert kinds.count("node") == 4
+    assert kinds[-1] == "result"
+    # Фактический расход приходит в последнем фрагменте (stream_options).
+    actual_tokens = record_usage.call_args.args[0]
+    assert isinstance(actual_tokens, int) and actual_tokens > 0
+    record_usage.assert_called_once_with(actual_tokens, ANY)
+
+
+def test_truncated_output_is_continued(fake_server, monkeypatch):
+    """Тестирует дозапрос продолжения, когда ответ обрезан по max_tokens."""
+    fake_server(node_count=5)
+    monkeypatch.setenv("GENERATION_MAX_TOKENS", "150")
+    monkeypatch.setenv("JSON_CONTINUATION_ATTEMPTS", "5")
+    quest = create_quest_from_setting("сеттинг", "key", "fake", "fake-quest")
+    assert len(quest["nodes"]) == 5
+    assert validate_quest(quest) == []
+
+
+def test_injected_errors_are_retried(fake_server, monkeypatch):
+    """Тестирует повтор запросов после внедрённых ошибок 500."""
+    fake_server(error_rate=0.5, seed=1)
+    monkeypatch.setattr(retry_policy, "max_attempts", 10)
+    monkeypatch.setattr(retry_policy, "base_delay", 0.0)
+    quest = create_quest_from_setting("сеттинг", "key", "fake", "fake-quest")
+    assert "error" not in quest
+
+
+def test_rate_limit_injection(fake_server):
+    """Тестирует, что 429 от сервера превращается в ошибку лимита запросов."""
+    fake_server(rate_limit_rate=1.0)
+    result = create_quest_from_setting("сеттинг", "key", "fake", "fake-quest")
+    assert result == {"error": "Превышен лимит запросов к API. Попробуйте позже."}
+
+
+def test_hierarchical_generation_end_to_end(fake_server):
+    """Тестирует двухэтапную генерацию через поддельный сервер."""
+    fake_server()
+    quest = asyncio.run(
+        create_quest_hierarchical_async("сеттинг", "key", "fake", "fake-quest", 25)
+    )
+    assert len(quest["nodes"]) == 25
+    assert all(node.get("description") for node in quest["nodes"])
+    assert all(
+        choice.get("text") for node in quest["nodes"] for choice in node["choices"]
+    )
+
+
+def test_api_key_and_models(fake_server):
+    """Тестирует проверку ключа и список моделей поддельного провайдера."""
+    fake_server()
+    assert validate_api_key("fake", "key") == {"status": "ok"}
+    assert validate_api_key("fake", "invalid-key")["status"] == "error"
+    assert get_available_models("fake", "key") == {"models": ["fake-quest"]}
+
+
+def test_fake_provider_requires_base_url(monkeypatch):
+    """Тестирует, что без FAKE_LLM_BASE_URL провайдер fake неизвестен."""
+    monkeypatch.delenv("FAKE_LLM_BASE_URL", raising=False)
+    unknown = {"error": "Unknown API provider: fake"}
+    assert create_quest_from_setting("сеттинг", "key", "fake", "fake-quest") == unknown
+    assert validate_api_key("fake", "key") == unknown
+    assert get_available_models("fake", "key") == unknown
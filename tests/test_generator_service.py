@@ -1,56 +1,107 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
+import asyncio
 import json
 import re
+import threading
+import time
+
+import pytest
 
 from services.quest_generator import (
     create_quest_from_setting,
+    create_quest_routed_async,
+    generate_quests_batch,
     validate_api_key,
     get_available_models,
+    stream_quest_from_setting,
 )
+from services.json_extract import extract_json_object
+from services.quest_cache import quest_cache
+from services.resilience import retry_policy
 
 
-@patch("services.quest_generator.Groq")
-def test_create_quest_groq_success(mock_groq):
+@patch("services.quest_generator.groq.Groq")
+def test_create_quest_groq_success(mock_groq, make_quest):
     """Тестирует успешный путь с провайдером Groq."""
-    mock_response_content = '{"questTitle": "Успешный тест Groq"}'
+    mock_response_content = json.dumps(make_quest("Успешный тест Groq"))
     mock_completion = MagicMock()
     mock_completion.choices[0].message.content = mock_response_content
     mock_groq.return_value.chat.completions.create.return_value = mock_completion
     result = create_quest_from_setting(
         "любой сеттинг", "fake_key", "groq", "llama3-88b-8192"
     )
-    assert result == {"questTitle": "Успешный тест Groq"}
+    assert result == make_quest("Успешный тест Groq")
     mock_groq.return_value.chat.completions.create.assert_called_once()
 
 
 @patch("services.quest_generator.openai.OpenAI")
-def test_create_quest_openai_success(mock_openai):
+def test_create_quest_openai_success(mock_openai, make_quest):
     """Тестирует успешный путь с провайдером OpenAI."""
-    mock_response_content = '{"questTitle": "Успешный тест OpenAI"}'
+    mock_response_content = json.dumps(make_quest("Успешный тест OpenAI"))
     mock_completion = MagicMock()
     mock_completion.choices[0].message.content = mock_response_content
     mock_openai.return_value.chat.completions.create.return_value = mock_completion
     result = create_quest_from_setting("любой сеттинг", "fake_key", "openai", "gpt-4")
-    assert result == {"questTitle": "Успешный тест OpenAI"}
+    assert result == make_quest("Успешный тест OpenAI")
     mock_openai.return_value.chat.completions.create.assert_called_once()
 
 
 @patch("services.quest_generator.genai")
-def test_create_quest_gemini_success(mock_genai):
+def test_create_quest_gemini_success(mock_genai, make_quest):
     """Тестирует успешный путь с провайдером Gemini."""
     mock_response = MagicMock()
-    mock_response.text = '{"questTitle": "Успешный тест Gemini"}'
+    mock_response.text = json.dumps(make_quest("Успешный тест Gemini"))
     mock_model = MagicMock()
     mock_model.generate_content.return_value = mock_response
     mock_genai.GenerativeModel.return_value = mock_model
     result = create_quest_from_setting(
         "любой сеттинг", "fake_key", "gemini", "gemini-pro"
     )
-    assert result == {"questTitle": "Успешный тест Gemini"}
-    mock_genai.configure.assert_called_once_with(api_key="fake_key")
+    assert result == make_quest("Успешный тест Gemini")
+    mock_genai.configure.assert_not_called()
+
+
+@patch("services.quest_generator.glm")
+@patch("services.quest_generator.genai")
+def test_create_quest_gemini_uses_per_key_client(mock_genai, mock_glm):
+    """Тестирует, что каждый ключ Gemini получает собственный клиент."""
+    mock_glm.GenerativeServiceClient.side_effect = lambda client_options: MagicMock(
+        api_key=client_options["api_key"]
+    )
+    models = []
+
+    def make_model(name, system_instruction=None):
+        model = MagicMock()
+        model.generate_content.return_value.text = '{"questTitle": "Q"}'
+        models.append(model)
+        return model
+
+    mock_genai.GenerativeModel.side_effect = make_model
+    create_quest_from_setting(
+        "сеттинг", "key_a", "gemini", "gemini-pro", use_cache=False
+    )
+    create_quest_from_setting(
+        "сеттинг", "key_b", "gemini", "gemini-pro", use_cache=False
+    )
+    create_quest_from_setting(
+        "сеттинг", "key_a", "gemini", "gemini-pro", use_cache=False
+    )
+    assert [m._client.api_key for m in models] == ["key_a", "key_b", "key_a"]
+    assert models[0]._client is models[2]._client
+    mock_genai.configure.assert_not_called()
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.genai")
+def test_get_available_models_gemini_passes_per_key_client(mock_genai):
+    """Тестирует, что список моделей Gemini запрашивается клиентом ключа."""
+    mock_genai.list_models.return_value = []
+    get_available_models("gemini", "fake_key")
+    client = mock_genai.list_models.call_args.kwargs["client"]
+    assert client._client_options.api_key == "fake_key"
+    mock_genai.configure.assert_not_called()
+
+
+@patch("services.quest_generator.groq.Groq")
 def test_create_quest_api_error(mock_groq):
     """Тестирует случай, когда API (на примере Groq) возвращает ошибку."""
     mock_groq.return_value.chat.completions.create.side_effect = Exception("API Error")
@@ -61,7 +112,7 @@ def test_create_quest_api_error(mock_groq):
     assert "Произошла ошибка при обращении к API groq: API Error" in result["error"]
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_create_quest_no_content(mock_groq):
     """Тестирует случай, когда API (на примере Groq) не вернуло контент."""
     mock_completion = MagicMock()
@@ -74,7 +125,7 @@ def test_create_quest_no_content(mock_groq):
     assert result["error"] == "LLM returned no content."
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_validate_key_groq_success(mock_groq):
     """Тестирует успешную валидацию ключа Groq."""
     mock_groq.return_value.models.list.return_value = MagicMock()
@@ -95,7 +146,7 @@ def test_validate_key_gemini_success(mock_genai):
     mock_model.supported_generation_methods = ["generateContent"]
     mock_genai.list_models.return_value = [mock_model]
     assert validate_api_key("gemini", "valid") == {"status": "ok"}
-    mock_genai.configure.assert_called_once_with(api_key="valid")
+    mock_genai.configure.assert_not_called()
 
 
 @patch("services.quest_generator.genai")
@@ -107,7 +158,7 @@ def test_validate_key_gemini_no_models(mock_genai):
     assert "Ошибка проверки ключа" in result["message"]
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_validate_key_api_error_401(mock_groq):
     """Тестирует обработку ошибки 401 (неверный ключ)."""
     mock_groq.return_value.models.list.side_effect = Exception("401 Invalid Key")
@@ -115,7 +166,7 @@ def test_validate_key_api_error_401(mock_groq):
     assert result == {"status": "error", "message": "Неверный API ключ."}
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_validate_key_generic_api_error(mock_groq):
     """Тестирует обработку общей ошибки API."""
     mock_groq.return_value.models.list.side_effect = Exception("Connection Timeout")
@@ -132,7 +183,7 @@ def test_validate_key_unknown_provider():
     assert result == {"error": "Unknown API provider: foobar"}
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_get_available_models_groq_success(mock_groq):
     """Тестирует успешное получение моделей от Groq."""
     mock_model = MagicMock()
@@ -169,7 +220,7 @@ def test_get_available_models_unknown_provider():
     assert result == {"error": "Unknown API provider: foobar"}
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_get_available_models_api_error(mock_groq):
     """Тестирует обработку ошибки API при получении моделей."""
     mock_groq.return_value.models.list.side_effect = Exception("API Error")
@@ -180,7 +231,7 @@ def test_get_available_models_api_error(mock_groq):
 # --- НОВЫЕ ТЕСТЫ ДЛЯ ОБРАБОТКИ ОШИБОК JSON И API ---
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_create_quest_json_decode_error_raw_content(mock_groq):
     """Тестирует случай, когда LLM возвращает невалидный, но немаркдаун JSON."""
     mock_completion = MagicMock()
@@ -200,10 +251,12 @@ def test_create_quest_json_decode_error_raw_content(mock_groq):
 
 
 @patch("services.quest_generator.genai")
-def test_create_quest_json_decode_error_markdown_valid_json(mock_genai):
+def test_create_quest_json_decode_error_markdown_valid_json(mock_genai, make_quest):
     """Тестирует, что очистка markdown работает и валидный JSON внутри парсится."""
     mock_response = MagicMock()
-    mock_response.text = '```json\n{"questTitle": "Parsed from markdown"}\n```'
+    mock_response.text = (
+        f"```json\n{json.dumps(make_quest('Parsed from markdown'))}\n```"
+    )
     mock_model = MagicMock()
     mock_model.generate_content.return_value = mock_response
     mock_genai.GenerativeModel.return_value = mock_model
@@ -211,42 +264,140 @@ def test_create_quest_json_decode_error_markdown_valid_json(mock_genai):
     result = create_quest_from_setting(
         "любой сеттинг", "fake_key", "gemini", "gemini-pro"
     )
-    assert result == {"questTitle": "Parsed from markdown"}
-    mock_genai.configure.assert_called_once_with(api_key="fake_key")
+    assert result == make_quest("Parsed from markdown")
+    mock_genai.configure.assert_not_called()
 
 
 @patch("services.quest_generator.genai")
-def test_create_quest_json_decode_error_markdown_invalid_json(mock_genai):
-    """Тестирует, что очистка markdown работает, но внутренний JSON невалиден."""
-    mock_response_invalid = MagicMock()
-    mock_response_invalid.text = (
-        '```json\n{"questTitle": "Partial JSON",\n```'  # Invalid JSON
+def test_create_quest_truncated_json_is_continued(mock_genai, make_quest):
+    """Тестирует дозапрос продолжения оборванного JSON вместо полной регенерации."""
+    full = json.dumps(make_quest("Partial JSON"), ensure_ascii=False)
+    cut = full.index('"id": "lose"') + 5
+    truncated = MagicMock()
+    truncated.text = "```json\n" + full[:cut]
+    continuation = MagicMock()
+    continuation.text = full[cut:] + "\n```"
+    mock_model = MagicMock()
+    mock_model.generate_content.side_effect = [truncated, continuation]
+    mock_genai.GenerativeModel.return_value = mock_model
+
+    result = create_quest_from_setting(
+        "любой сеттинг", "fake_key", "gemini", "gemini-pro"
     )
+    assert result == make_quest("Partial JSON")
+    assert mock_model.generate_content.call_count == 2
+    contents = mock_model.generate_content.call_args_list[1].args[0]
+    assert [part["role"] for part in contents] == ["user", "model", "user"]
+    assert contents[1]["parts"] == [truncated.text]
+
+
+@patch("services.quest_generator.genai")
+def test_generation_stages_share_one_deadline(
+    mock_genai, make_quest, clock, monkeypatch
+):
+    """Тестирует, что дозапрос продолжения получает остаток общего дедлайна."""
+    monkeypatch.setattr(retry_policy, "_clock", clock)
+    monkeypatch.setattr(retry_policy, "deadline", 120)
+    full = json.dumps(make_quest("Partial JSON"), ensure_ascii=False)
+    cut = full.index('"id": "lose"') + 5
+    truncated = MagicMock()
+    truncated.text = "```json\n" + full[:cut]
+    continuation = MagicMock()
+    continuation.text = full[cut:] + "\n```"
+    responses = [truncated, continuation]
+
+    def generate_content(*args, **kwargs):
+        clock.now += 100
+        return responses.pop(0)
+
+    mock_model = MagicMock()
+    mock_model.generate_content.side_effect = generate_content
+    mock_genai.GenerativeModel.return_value = mock_model
+
+    create_quest_from_setting("любой сеттинг", "fake_key", "gemini", "gemini-pro")
+    timeouts = [
+        call.kwargs["request_options"]["timeout"]
+        for call in mock_model.generate_content.call_args_list
+    ]
+    assert timeouts == [pytest.approx(120, abs=1), pytest.approx(20, abs=1)]
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_create_quest_extracts_json_once(mock_groq, make_quest):
+    """Тестирует, что ответ модели разбирается один раз за генерацию."""
+    mock_completion = MagicMock()
+    mock_completion.choices[0].message.content = json.dumps(make_quest("Один"))
+    mock_groq.return_value.chat.completions.create.return_value = mock_completion
+    with patch(
+        "services.quest_generator.extract_json_object", wraps=extract_json_object
+    ) as extract:
+        result = create_quest_from_setting("сеттинг", "key", "groq", "llama3")
+    assert result == make_quest("Один")
+    extract.assert_called_once()
+
+
+@patch("services.quest_generator.genai")
+def test_create_quest_truncated_json_is_closed_when_continuation_fails(
+    mock_genai, make_quest
+):
+    """Тестирует, что оборванный JSON закрывается после последнего целого узла."""
+    full = json.dumps(make_quest("Partial JSON"), ensure_ascii=False)
+    mock_response_invalid = MagicMock()
+    mock_response_invalid.text = "```json\n" + full[: full.index('"id": "lose"')]
     mock_model_invalid = MagicMock()
-    mock_model_invalid.generate_content.return_value = mock_response_invalid
+    mock_model_invalid.generate_content.side_effect = [
+        mock_response_invalid,
+        Exception("boom"),
+        Exception("boom"),
+    ]
     mock_genai.GenerativeModel.return_value = mock_model_invalid
 
     with patch("services.quest_generator.logger.error") as mock_logger_error:
-        result_invalid = create_quest_from_setting(
-            "любой сеттинг", "fake_key", "gemini", "gemini-pro"
-        )
-        assert "error" in result_invalid
-        assert (
-            "Модель не смогла сгенерировать валидный JSON." in result_invalid["error"]
-        )
-        mock_logger_error.assert_called_once()
-        log_message_invalid = mock_logger_error.call_args[0][0]
-        assert (
-            'Raw content (original): \'```json\n{"questTitle": "Partial JSON",\n```\'.'
-            in log_message_invalid
-        )
-        assert (
-            'Cleaned content: \'{"questTitle": "Partial JSON",\'.'
-            in log_message_invalid
-        )
+        with patch.object(quest_cache, "set") as cache_set:
+            result = create_quest_from_setting(
+                "любой сеттинг", "fake_key", "gemini", "gemini-pro"
+            )
+    assert [node["id"] for node in result["nodes"]] == ["start", "win"]
+    # Выбор, ведущий в недописанный узел, удалён.
+    assert result["nodes"][0]["choices"] == [{"text": "Налево", "targetNodeId": "win"}]
+    mock_logger_error.assert_not_called()
+    # Оборванный квест не кэшируется: следующий запрос снова обратится к API.
+    cache_set.assert_not_called()
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_quest_with_remaining_issues_is_not_cached(mock_groq, make_quest, completion):
+    """Тестирует, что квест с неисправленными проблемами графа не кэшируется."""
+    quest = make_quest("Без пути к поражению")
+    quest["nodes"][0]["choices"].pop()
+    mock_groq.return_value.chat.completions.create.side_effect = [
+        completion(quest),
+        Exception("boom"),
+    ]
+    with patch.object(quest_cache, "set") as cache_set:
+        result = create_quest_from_setting("сеттинг", "key", "groq", "llama3")
+    assert "error" not in result
+    assert mock_groq.return_value.chat.completions.create.call_count == 2
+    cache_set.assert_not_called()
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_quest_with_unreachable_node_is_cached(mock_groq, make_quest, completion):
+    """Тестирует, что недостижимые узлы не мешают кэшировать квест."""
+    quest = make_quest("С лишним узлом")
+    quest["nodes"].append(
+        {"id": "orphan", "title": "Забытая сцена", "type": "ENDING_SUCCESS"}
+    )
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = completion(quest)
+    results = [
+        create_quest_from_setting("сеттинг", "key", "groq", "llama3") for _ in range(3)
+    ]
+    assert results == [quest] * 3
+    assert create.call_count == 1
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_create_quest_api_rate_limit_error(mock_groq):
     """Тестирует обработку ошибки превышения лимита запросов."""
     mock_groq.return_value.chat.completions.create.side_effect = Exception(
@@ -259,7 +410,7 @@ def test_create_quest_api_rate_limit_error(mock_groq):
     assert "Превышен лимит запросов к API. Попробуйте позже." in result["error"]
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_create_quest_api_invalid_key_error(mock_groq):
     """Тестирует обработку ошибки неверного API ключа."""
     mock_groq.return_value.chat.completions.create.side_effect = Exception(
@@ -272,7 +423,7 @@ def test_create_quest_api_invalid_key_error(mock_groq):
     assert "Неверный API ключ. Пожалуйста, проверьте ваш ключ." in result["error"]
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_create_quest_api_model_not_found_error(mock_groq):
     """Тестирует обработку ошибки "модель не найдена"."""
     mock_groq.return_value.chat.completions.create.side_effect = Exception(
@@ -296,9 +447,6 @@ def test_create_quest_api_model_deprecated_error(mock_genai):
         "404 Gemini 1.0 Pro Vision has been deprecated on July 12, 2024. Consider switching to different model, for example gemini-1.5-flash."
     )
     mock_genai.GenerativeModel.return_value = mock_model_genai
-    mock_genai.configure.return_value = (
-        None  # Ensure configure doesn't raise error itself
-    )
 
     result = create_quest_from_setting(
         "любой сеттинг", "fake_key", "gemini", "gemini-1.0-pro-vision"
@@ -310,7 +458,7 @@ def test_create_quest_api_model_deprecated_error(mock_genai):
     )
 
 
-@patch("services.quest_generator.Groq")
+@patch("services.quest_generator.groq.Groq")
 def test_create_quest_api_general_error(mock_groq):
     """Тестирует обработку общей, неопознанной ошибки API."""
     mock_groq.return_value.chat.completions.create.side_effect = Exception(
@@ -340,3 +488,202 @@ def test_create_quest_api_quota_exceeded_error(mock_openai):
         "Превышен лимит использования API или недостаточно средств. Пожалуйста, проверьте ваш тарифный план или баланс."
         in result["error"]
     )
+
+
+# --- АСИНХРОННЫЙ ДВИЖОК ГЕНЕРАЦИИ ---
+
+
+def _route(api_provider, model, api_key):
+    return {"api_provider": api_provider, "model": model, "api_key": api_key}
+
+
+def _async_chat_client(mock_factory, content=None, side_effect=None):
+    client = MagicMock()
+    completion = MagicMock()
+    completion.choices[0].message.content = content
+    client.chat.completions.create = AsyncMock(
+        return_value=completion, side_effect=side_effect
+    )
+    mock_factory.return_value.__aenter__.return_value = client
+    return client
+
+
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_create_quest_async_groq_success(mock_async_groq, make_quest):
+    """Тестирует асинхронную генерацию через Groq."""
+    client = _async_chat_client(mock_async_groq, json.dumps(make_quest("Async Groq")))
+    result = asyncio.run(
+        create_quest_routed_async("сеттинг", [_route("groq", "llama3", "fake_key")])
+    )
+    assert result == make_quest("Async Groq")
+    client.chat.completions.create.assert_awaited_once()
+    mock_async_groq.return_value.__aexit__.assert_awaited_once()
+
+
+@patch("services.quest_generator.openai.AsyncOpenAI")
+def test_create_quest_async_openai_error_classified(mock_async_openai):
+    """Тестирует, что ошибки асинхронного пути классифицируются как в синхронном."""
+    _async_chat_client(
+        mock_async_openai, side_effect=Exception("Too many requests, rate limit")
+    )
+    result = asyncio.run(
+        create_quest_routed_async("сеттинг", [_route("openai", "gpt-4", "fake_key")])
+    )
+    assert result == {"error": "Превышен лимит запросов к API. Попробуйте позже."}
+
+
+@patch("services.quest_generator.glm")
+@patch("services.quest_generator.genai")
+def test_create_quest_async_gemini_success(mock_genai, mock_glm, make_quest):
+    """Тестирует асинхронную генерацию Gemini с клиентом, привязанным к ключу."""
+    mock_response = MagicMock()
+    mock_response.text = f"```json\n{json.dumps(make_quest('Async Gemini'))}\n```"
+    mock_model = MagicMock()
+    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
+    mock_genai.GenerativeModel.return_value = mock_model
+    async_client = mock_glm.GenerativeServiceAsyncClient.return_value
+    result = asyncio.run(
+        create_quest_routed_async(
+            "сеттинг", [_route("gemini", "gemini-pro", "fake_key")]
+        )
+    )
+    assert result == make_quest("Async Gemini")
+    mock_glm.GenerativeServiceAsyncClient.assert_called_once_with(
+        client_options={"api_key": "fake_key"}
+    )
+    assert mock_model._async_client is async_client.__aenter__.return_value
+    mock_genai.configure.assert_not_called()
+
+
+def test_create_quest_async_unknown_provider():
+    """Тестирует асинхронную генерацию с неизвестным провайдером."""
+    result = asyncio.run(
+        create_quest_routed_async("сеттинг", [_route("foobar", "model", "key")])
+    )
+    assert result == {"error": "Unknown API provider: foobar"}
+
+
+# --- ПОТОКОВАЯ ГЕНЕРАЦИЯ ---
+
+
+def _stream_chunk(text):
+    chunk = MagicMock()
+    chunk.choices[0].delta.content = text
+    return chunk
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_stream_quest_groq_emits_tokens_nodes_and_result(mock_groq, make_quest):
+    """Тестирует события потоковой генерации: токены, узлы и итоговый квест."""
+    quest = make_quest("Q")
+    start, win, lose = (json.dumps(node) for node in quest["nodes"])
+    head = '{"questTitle": "Q", "startNodeId": "start", "nodes": ['
+    parts = [head + start, ", " + win, ", " + lose + "]}"]
+    mock_groq.return_value.chat.completions.create.return_value = [
+        _stream_chunk(p) for p in parts
+    ]
+    events = list(stream_quest_from_setting("сеттинг", "key", "groq", "llama3"))
+    assert [e for e, _ in events] == [
+        "token",
+        "node",
+        "token",
+        "node",
+        "token",
+        "node",
+        "result",
+    ]
+    assert events[1][1] == {"node": quest["nodes"][0]}
+    assert events[-1][1] == quest
+    assert mock_groq.return_value.chat.completions.create.call_args.kwargs["stream"]
+
+
+@patch("services.quest_generator.genai")
+def test_stream_quest_gemini_uses_stream_mode(mock_genai, make_quest):
+    """Тестирует потоковую генерацию Gemini."""
+    chunk = MagicMock()
+    chunk.text = json.dumps(make_quest("G"))
+    mock_genai.GenerativeModel.return_value.generate_content.return_value = [chunk]
+    events = list(stream_quest_from_setting("сеттинг", "key", "gemini", "gemini-pro"))
+    assert events[-1] == ("result", make_quest("G"))
+    mock_genai.GenerativeModel.return_value.generate_content.assert_called_once_with(
+        ANY, stream=True, request_options={"timeout": ANY}
+    )
+    call = mock_genai.GenerativeModel.return_value.generate_content.call_args
+    assert 0 < call.kwargs["request_options"]["timeout"] <= retry_policy.deadline
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_stream_quest_error_is_classified(mock_groq):
+    """Тестирует, что ошибка провайдера в потоке превращается в событие error."""
+    mock_groq.return_value.chat.completions.create.side_effect = Exception(
+        "401 Unauthorized"
+    )
+    events = list(stream_quest_from_setting("сеттинг", "key", "groq", "llama3"))
+    assert events == [
+        ("error", {"error": "Неверный API ключ. Пожалуйста, проверьте ваш ключ."})
+    ]
+
+
+# --- ПАКЕТНАЯ ГЕНЕРАЦИЯ ---
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_batch_generation_respects_provider_concurrency(mock_groq, make_quest):
+    """Тестирует, что пакет не превышает лимит параллельных запросов провайдера."""
+    lock = threading.Lock()
+    active = {"now": 0, "max": 0}
+
+    def create(**kwargs):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        time.sleep(0.02)
+        with lock:
+            active["now"] -= 1
+        completion = MagicMock()
+        setting = kwargs["messages"][-1]["content"]
+        completion.choices[0].message.content = json.dumps(
+            {**make_quest("ok"), "echo": "сеттинг 3" in setting}
+        )
+        return completion
+
+    mock_groq.return_value.chat.completions.create.side_effect = create
+    results = list(
+        generate_quests_batch(
+            [f"сеттинг {i}" for i in range(6)],
+            defaults={"api_key": "key", "api_provider": "groq", "model": "llama3"},
+            concurrency={"groq": 2},
+        )
+    )
+    assert sorted(r["index"] for r in results) == list(range(6))
+    assert active["max"] == 2
+    assert next(r for r in results if r["index"] == 3)["result"]["echo"] is True
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_batch_generation_reports_per_item_errors(mock_groq):
+    """Тестирует, что ошибки отдельных элементов классифицируются и не рвут пакет."""
+    mock_groq.return_value.chat.completions.create.side_effect = Exception(
+        "Too many requests, rate limit exceeded"
+    )
+    results = list(
+        generate_quests_batch(
+            [
+                "сеттинг",
+                {"setting": "без модели", "model": ""},
+                {"setting": "провайдер не строка", "api_provider": ["groq"]},
+            ],
+            defaults={"api_key": "key", "api_provider": "groq", "model": "llama3"},
+        )
+    )
+    assert sorted(results, key=lambda r: r["index"]) == [
+        {"index": 0, "error": "Превышен лимит запросов к API. Попробуйте позже."},
+        {
+            "index": 1,
+            "error": "Missing 'setting', 'api_key', 'api_provider' or 'model'",
+        },
+        {
+            "index": 2,
+            "error": "Missing 'setting', 'api_key', 'api_provider' or 'model'",
+        },
+    ]
@@ -0,0 +1,144 @@
+import asyncio
+import re
+from unittest.mock import AsyncMock, patch
+
+from services.quest_cache import quest_cache
+from services.quest_generator import create_quest_hierarchical_async
+
+
+def _outline(count):
+    nodes = [
+        {
+            "id": f"n{i}",
+            "title": f"Сцена {i}",
+            "type": "CHOICE",
+            "choices": [{"targetNodeId": f"n{i + 1}"}, {"targetNodeId": "fail"}],
+        }
+        for i in range(count)
+    ]
+    nodes.append({"id": f"n{count}", "title": "Победа", "type": "ENDING_SUCCESS"})
+    nodes.append({"id": "fail", "title": "Поражение", "type": "ENDING_FAILURE"})
+    return {"questTitle": "Большой квест", "startNodeId": "n0", "nodes": nodes}
+
+
+def _expansion(prompt):
+    ids = re.findall(r"^- (\S+):", prompt, re.MULTILINE)
+    return {
+        "nodes": [
+            {
+                "id": node_id,
+                "description": f"Описание {node_id}",
+                "choices": [{"text": "Вперёд", "targetNodeId": "подмена"}],
+            }
+            for node_id in ids
+        ]
+    }
+
+
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_hierarchical_generation_expands_outline_in_parallel(
+    mock_groq, monkeypatch, completion
+):
+    """Тестирует скелет, параллельное дописывание узлов группами и сборку квеста."""
+    monkeypatch.setenv("HIERARCHICAL_BATCH_SIZE", "5")
+    monkeypatch.setenv("HIERARCHICAL_CONCURRENCY", "2")
+    active = {"now": 0, "max": 0}
+    prompts = []
+
+    async def create(**kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        prompts.append(prompt)
+        if "СКЕЛЕТ" in kwargs["messages"][0]["content"]:
+            return completion(_outline(20))
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        return completion(_expansion(prompt))
+
+    client = mock_groq.return_value.__aenter__.return_value
+    client.chat.completions.create = AsyncMock(side_effect=create)
+    quest = asyncio.run(
+        create_quest_hierarchical_async("сеттинг", "key", "groq", "llama3", 20)
+    )
+
+    assert "примерно из 20 узлов" in prompts[0]
+    assert len(prompts) == 1 + 5
+    assert active["max"] == 2
+    assert len(quest["nodes"]) == 22
+    assert all(node["description"].startswith("Описание") for node in quest["nodes"])
+    # Переходы берутся из скелета, а не из ответа второго этапа; выборы без
+    # текста получают название следующей сцены.
+    assert quest["nodes"][0]["choices"] == [
+        {"targetNodeId": "n1", "text": "Сцена 1"},
+        {"targetNodeId": "fail", "text": "Поражение"},
+    ]
+    assert "n7" not in prompts[1] and "n7" in prompts[2]
+
+
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_hierarchical_generation_fills_choice_texts(mock_groq, completion):
+    """Тестирует, что тексты выборов сопоставляются по targetNodeId."""
+
+    async def create(**kwargs):
+        if "СКЕЛЕТ" in kwargs["messages"][0]["content"]:
+            return completion(_outline(1))
+        return completion(
+            {
+                "nodes": [
+                    {
+                        "id": "n0",
+                        "description": "Старт",
+                        "choices": [{"text": "Сдаться", "targetNodeId": "fail"}],
+                    }
+                ]
+            }
+        )
+
+    client = mock_groq.return_value.__aenter__.return_value
+    client.chat.completions.create = AsyncMock(side_effect=create)
+    quest = asyncio.run(
+        create_quest_hierarchical_async("сеттинг", "key", "groq", "llama3", 3)
+    )
+    assert quest["nodes"][0]["choices"][1] == {
+        "targetNodeId": "fail",
+        "text": "Сдаться",
+    }
+
+
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_hierarchical_generation_retries_only_failed_batches(
+    mock_groq, monkeypatch, completion
+):
+    """Тестирует повтор только неудавшихся групп и текст скелета для остальных."""
+    monkeypatch.setenv("HIERARCHICAL_BATCH_SIZE", "2")
+    attempts = {}
+
+    async def create(**kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        if "СКЕЛЕТ" in kwargs["messages"][0]["content"]:
+            return completion(_outline(3))
+        ids = tuple(re.findall(r"^- (\S+):", prompt, re.MULTILINE))
+        attempts[ids] = attempts.get(ids, 0) + 1
+        # Первая группа удаётся со второй попытки, вторая не удаётся вовсе.
+        if (ids == ("n0", "n1") and attempts[ids] == 1) or ids == ("n2", "n3"):
+            raise Exception("Invalid API key")
+        return completion(_expansion(prompt))
+
+    client = mock_groq.return_value.__aenter__.return_value
+    client.chat.completions.create = AsyncMock(side_effect=create)
+    with patch.object(quest_cache, "set") as cache_set:
+        quest = asyncio.run(
+            create_quest_hierarchical_async("сеттинг", "key", "groq", "llama3", 3)
+        )
+
+    assert attempts == {("n0", "n1"): 2, ("n2", "n3"): 2, ("fail",): 1}
+    descriptions = {node["id"]: node["description"] for node in quest["nodes"]}
+    assert descriptions == {
+        "n0": "Описание n0",
+        "n1": "Описание n1",
+        "n2": "Сцена 2",
+        "n3": "Победа",
+        "fail": "Описание fail",
+    }
+    cache_set.assert_not_called()
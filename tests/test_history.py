@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from services.history import HistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / "history.db"))
+
+
+def test_chat_pages_follow_updated_at(store, make_quest):
+    """Чаты отдаются страницами по курсору, недавно изменённые первыми."""
+    ids = [store.create_chat("user", f"Чат {i}")["id"] for i in range(5)]
+    store.add_version("user", ids[0], "сеттинг", make_quest())
+    store.create_chat("other", "Чужой чат")
+
+    first, cursor = store.list_chats("user", limit=2)
+    second, cursor2 = store.list_chats("user", limit=2, cursor=cursor)
+    third, cursor3 = store.list_chats("user", limit=2, cursor=cursor2)
+
+    listed = [chat["id"] for chat in first + second + third]
+    assert listed[0] == ids[0]
+    assert sorted(listed) == sorted(ids)
+    assert cursor3 is None
+    assert "setting" not in first[0] and "quest" not in first[0]
+    with pytest.raises(ValueError):
+        store.list_chats("user", cursor="broken")
+
+
+def test_versions_and_ownership(store, make_quest):
+    """Версии нумеруются по порядку и недоступны другому пользователю."""
+    chat = store.create_chat("user", "Чат", "первый", quest=make_quest("v1"))
+    assert chat["versions"] == 1
+    store.add_version("user", chat["id"], "второй", make_quest("v2"))
+
+    loaded = store.get_chat("user", chat["id"])
+    assert loaded["setting"] == "второй"
+    assert loaded["quest"]["questTitle"] == "v2"
+    versions, cursor = store.list_versions("user", chat["id"], limit=1)
+    assert [v["version"] for v in versions] == [2]
+    versions, cursor = store.list_versions("user", chat["id"], limit=1, cursor=cursor)
+    assert [v["version"] for v in versions] == [1] and cursor is None
+    assert store.get_version("user", chat["id"], 1)["quest"]["questTitle"] == "v1"
+
+    assert store.get_chat("other", chat["id"]) is None
+    assert store.add_version("other", chat["id"], "x", make_quest()) is None
+    assert store.update_chat("other", chat["id"], title="x") is None
+    assert not store.delete_chat("other", chat["id"])
+
+    assert store.delete_chat("user", chat["id"])
+    assert store.get_version("user", chat["id"], 1) is None
+
+
+def test_concurrent_versions_get_unique_numbers(tmp_path, make_quest):
+    """Параллельные сохранения из разных соединений не делят номер версии."""
+    path = str(tmp_path / "history.db")
+    chat = HistoryStore(path).create_chat("user", "Чат")
+
+    def save():
+        HistoryStore(path).add_version("user", chat["id"], "сеттинг", make_quest())
+
+    threads = [threading.Thread(target=save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    versions, _ = HistoryStore(path).list_versions("user", chat["id"], limit=100)
+    assert sorted(v["version"] for v in versions) == list(range(1, 9))
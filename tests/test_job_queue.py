@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+
+from services.job_queue import (
+    DONE,
+    FAILED,
+    ORPHANED_ERROR,
+    RUNNING,
+    TIMEOUT_ERROR,
+    JobQueue,
+    QueueFullError,
+)
+
+
+def _wait_for(queue, job_id, statuses=(DONE, FAILED)):
+    for _ in range(500):
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish: {job}")
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def factory(runner, **kwargs):
+        kwargs.setdefault("poll_interval", 0.05)
+        queue = JobQueue(str(tmp_path / "jobs.db"), runner, **kwargs)
+        queues.append(queue)
+        return queue
+
+    yield factory
+    for queue in queues:
+        queue.stop()
+
+
+def test_job_runs_in_background_and_stores_result(make_queue):
+    """Тестирует выполнение задачи и сохранение результата."""
+    queue = make_queue(
+        lambda job: {"questTitle": job["setting"], "key": job["api_key"]}
+    )
+    queue.start()
+    job_id = queue.submit({"setting": "лес"}, {"api_key": "secret"})
+    job = _wait_for(queue, job_id)
+    assert job["status"] == DONE
+    assert job["result"] == {"questTitle": "лес", "key": "secret"}
+
+
+def test_api_key_is_not_persisted(make_queue, tmp_path):
+    """Тестирует, что API-ключ не записывается в базу очереди."""
+    release = threading.Event()
+    queue = make_queue(lambda job: release.wait(5) and {"ok": True})
+    queue.submit({"setting": "лес"}, {"api_key": "top-secret-key"})
+    stored = b"".join(path.read_bytes() for path in tmp_path.iterdir())
+    assert b"top-secret-key" not in stored
+    assert "лес".encode("utf-8") in stored
+    release.set()
+
+
+def test_generation_error_marks_job_failed(make_queue):
+    """Тестирует, что ошибка генерации сохраняется как статус failed."""
+    queue = make_queue(lambda job: {"error": "Неверный API ключ."})
+    queue.start()
+    job = _wait_for(queue, queue.submit({}, {}))
+    assert job["status"] == FAILED
+    assert job["error"] == "Неверный API ключ."
+
+
+def test_job_timeout(make_queue):
+    """Тестирует, что задача, превысившая таймаут, получает статус ошибки."""
+    release = threading.Event()
+    queue = make_queue(lambda job: release.wait(5), job_timeout=0.1)
+    queue.start()
+    job = _wait_for(queue, queue.submit({}, {}))
+    release.set()
+    assert job["error"] == TIMEOUT_ERROR
+
+
+def test_timeout_counts_from_job_start(make_queue):
+    """Тестирует, что задача, ждущая свободный поток, не истекает до старта."""
+    release = threading.Event()
+    calls = []
+
+    def runner(job):
+        calls.append(job["n"])
+        if job["n"] == 1:
+            release.wait(5)
+            return {"questTitle": "Поздно"}
+        return {"questTitle": "Вторая"}
+
+    queue = make_queue(runner, workers=1, job_timeout=0.3)
+    queue.start()
+    first = queue.submit({"n": 1}, {})
+    second = queue.submit({"n": 2}, {})
+    assert _wait_for(queue, first)["error"] == TIMEOUT_ERROR
+    # Первая генерация всё ещё держит единственный поток: вторая ждёт старта.
+    time.sleep(0.6)
+    assert queue.get(second)["status"] == RUNNING
+    assert queue.get(second)["started_at"] is None
+    assert calls == [1]
+
+    release.set()
+    job = _wait_for(queue, second)
+    assert job["status"] == DONE and job["result"] == {"questTitle": "Вторая"}
+    # Результат первой задачи, пришедший после таймаута, отброшен.
+    assert queue.get(first)["error"] == TIMEOUT_ERROR
+    assert "result" not in queue.get(first)
+
+
+def test_queue_depth_limit(make_queue):
+    """Тестирует ограничение глубины очереди."""
+    queue = make_queue(lambda job: {}, max_depth=2)
+    queue.submit({}, {})
+    queue.submit({}, {})
+    with pytest.raises(QueueFullError):
+        queue.submit({}, {})
+
+
+def test_status_is_visible_from_another_worker(make_queue):
+    """Тестирует, что статус задачи доступен из другого экземпляра очереди."""
+    queue = make_queue(lambda job: {"questTitle": "Q"})
+    queue.start()
+    job_id = queue.submit({}, {})
+    _wait_for(queue, job_id)
+    other = make_queue(lambda job: {})
+    assert other.get(job_id)["result"] == {"questTitle": "Q"}
+
+
+def test_jobs_of_dead_process_are_marked_orphaned(make_queue):
+    """Тестирует, что задачи завершившегося процесса помечаются прерванными."""
+    dead = make_queue(lambda job: {})
+    dead.owner = 2**22 + 12345  # заведомо несуществующий pid
+    job_id = dead.submit({}, {"api_key": "k"})
+    queue = make_queue(lambda job: {})
+    queue.start()
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"] == ORPHANED_ERROR
+
+
+def test_unknown_job_returns_none(make_queue):
+    """Тестирует запрос несуществующей задачи."""
+    assert make_queue(lambda job: {}).get("missing") is None
@@ -0,0 +1,109 @@
+import json
+from unittest.mock import patch
+
+from services.json_extract import (
+    ExtractedJSON,
+    QuestNodeStreamParser,
+    extract_json_object,
+)
+
+QUEST = {
+    "questTitle": 'Тест {со скобками} и "кавычками"',
+    "startNodeId": "start",
+    "nodes": [
+        {
+            "id": "start",
+            "title": "Начало [1]",
+            "type": "CHOICE",
+            "description": "Описание с \\ и }",
+            "choices": [{"text": "Вперёд", "targetNodeId": "end"}],
+        },
+        {
+            "id": "end",
+            "title": "Конец",
+            "type": "ENDING_SUCCESS",
+            "description": "Победа",
+            "choices": [],
+        },
+    ],
+}
+
+
+def test_stream_parser_emits_nodes_for_any_chunking():
+    """Тестирует, что узлы извлекаются при любом разбиении текста на части."""
+    text = "```json\n" + json.dumps(QUEST, ensure_ascii=False, indent=2) + "\n```"
+    for size in (1, 3, 7, len(text)):
+        parser = QuestNodeStreamParser()
+        nodes = []
+        for start in range(0, len(text), size):
+            end = start + size
+            nodes.extend(parser.feed(text[start:end]))
+        assert nodes == QUEST["nodes"]
+        assert parser.text == text
+
+
+def test_stream_parser_emits_node_as_soon_as_it_closes():
+    """Тестирует, что узел отдаётся сразу после закрывающей скобки."""
+    parser = QuestNodeStreamParser()
+    assert parser.feed('{"nodes": [{"id": "a", "choices": [{"x": 1}]') == []
+    assert parser.feed("}, {") == [{"id": "a", "choices": [{"x": 1}]}]
+
+
+def test_stream_parser_ignores_nested_nodes_keys():
+    """Тестирует, что вложенные массивы "nodes" не считаются узлами квеста."""
+    parser = QuestNodeStreamParser()
+    nodes = parser.feed('{"meta": {"nodes": [{"id": "x"}]}, "nodes": [{"id": "y"}]}')
+    assert nodes == [{"id": "y"}]
+
+
+def test_extract_json_object_skips_chatty_text():
+    """Тестирует поиск объекта среди пояснений модели."""
+    text = (
+        'Вот пример {не json}. Ответ:\n```json\n{"questTitle": "Q", "nodes": []}\n```'
+    )
+    assert extract_json_object(text) == ExtractedJSON(
+        {"questTitle": "Q", "nodes": []}, False
+    )
+
+
+def test_extract_json_object_drops_trailing_commas():
+    """Тестирует удаление висячих запятых."""
+    text = '{"a": [1, 2,], "b": {"c": "}"},}'
+    assert extract_json_object(text).value == {"a": [1, 2], "b": {"c": "}"}}
+
+
+def test_extract_json_object_closes_truncated_output():
+    """Тестирует обрезку оборванного ответа до последнего целого значения."""
+    text = '{"questTitle": "Q", "nodes": [{"id": "n1"}, {"id": "n2", "text": "обо'
+    assert extract_json_object(text) == ExtractedJSON(
+        {"questTitle": "Q", "nodes": [{"id": "n1"}, {"id": "n2"}]}, True
+    )
+    assert extract_json_object('{"a": 1, "b": tr').value == {"a": 1}
+
+
+def test_extract_json_object_without_object():
+    """Тестирует ответ без JSON-объекта."""
+    assert extract_json_object("{this is not json}") is None
+    assert extract_json_object("нет json") is None
+
+
+def test_stream_parser_handles_escapes_split_between_chunks():
+    """Тестирует экранирование, разорванное между фрагментами."""
+    node = {"id": "a", "description": 'Он сказал: "\\\\}" и ушёл {'}
+    text = json.dumps({"nodes": [node, {"id": "b"}]}, ensure_ascii=False)
+    for size in (1, 2):
+        parser = QuestNodeStreamParser()
+        nodes = []
+        for start in range(0, len(text), size):
+            end = start + size
+            nodes.extend(parser.feed(text[start:end]))
+        assert nodes == [node, {"id": "b"}]
+
+
+def test_extract_json_object_parses_clean_json_without_scanning():
+    """Тестирует, что корректный JSON разбирается без посимвольного сканера."""
+    with patch("services.json_extract._scan_object") as scan:
+        assert extract_json_object(' {"a": [1, 2]}\n') == ExtractedJSON(
+            {"a": [1, 2]}, False
+        )
+    scan.assert_not_called()
@@ -0,0 +1,140 @@
+import json
+import subprocess
+import sys
+from unittest.mock import MagicMock, patch
+
+from services.metrics import MetricsRegistry, _SQLiteStore, metrics
+from services.quest_generator import (
+    create_quest_from_setting,
+    stream_quest_from_setting,
+)
+
+
+def _registry():
+    registry = MetricsRegistry(flush_interval=0)
+    registry.counter("requests_total", "Requests.")
+    registry.histogram("stage_seconds", "Stages.", buckets=(0.1, 1.0))
+    return registry
+
+
+def test_histogram_render():
+    """Гистограмма выводится с накопительными корзинами, суммой и количеством."""
+    registry = _registry()
+    registry.observe("stage_seconds", 0.05, stage="parse")
+    registry.observe("stage_seconds", 0.5, stage="parse")
+    registry.observe("stage_seconds", 5, stage="parse")
+    registry.inc("requests_total", outcome="ok")
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE stage_seconds histogram" in lines
+    assert 'stage_seconds_bucket{le="0.1",stage="parse"} 1' in lines
+    assert 'stage_seconds_bucket{le="1.0",stage="parse"} 2' in lines
+    assert 'stage_seconds_bucket{le="+Inf",stage="parse"} 3' in lines
+    assert 'stage_seconds_sum{stage="parse"} 5.55' in lines
+    assert 'stage_seconds_count{stage="parse"} 3' in lines
+    assert 'requests_total{outcome="ok"} 1' in lines
+
+
+def test_values_are_summed_across_workers(tmp_path):
+    """Значения воркеров с разными pid суммируются при чтении."""
+    db_path = str(tmp_path / "metrics.db")
+    first, second = _SQLiteStore(db_path), _SQLiteStore(db_path)
+    second.owner = first.owner + 1
+    key = ("requests_total", (("outcome", "ok"),))
+
+    first.write({key: 2.0})
+    second.write({key: 3.0})
+    first.write({key: 4.0})
+
+    assert first.read() == {key: 7.0}
+
+
+def test_dead_worker_values_are_kept(tmp_path):
+    """Значения завершившегося воркера переносятся и не пропадают."""
+    db_path = str(tmp_path / "metrics.db")
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    dead = _SQLiteStore(db_path)
+    dead.owner = process.pid
+    key = ("requests_total", ())
+    dead.write({key: 5.0})
+
+    alive = _SQLiteStore(db_path)
+    alive.write({key: 1.0})
+
+    assert alive.read() == {key: 6.0}
+    pids = {pid for (pid,) in alive._connect().execute("SELECT pid FROM samples")}
+    assert process.pid not in pids
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_generation_metrics(mock_groq, make_quest):
+    """Запросы к провайдеру учитываются вместе с токенами и ошибками."""
+    completion = MagicMock()
+    completion.choices[0].message.content = json.dumps(make_quest())
+    completion.usage.prompt_tokens = 120
+    completion.usage.completion_tokens = 80
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = completion
+
+    create_quest_from_setting("сеттинг", "key", "groq", "llama")
+    create.side_effect = Exception("Invalid API key")
+    create_quest_from_setting("другой сеттинг", "key", "groq", "llama")
+
+    text = metrics.render()
+    assert 'llm_requests_total{model="llama",outcome="ok",provider="groq"} 1' in text
+    assert 'llm_requests_total{model="llama",outcome="error",provider="groq"} 1' in text
+    assert 'llm_tokens_total{kind="prompt",model="llama",provider="groq"} 120' in text
+    assert (
+        'quest_generation_errors_total{error="auth",model="llama",provider="groq"} 1'
+        in text
+    )
+    assert (
+        'quest_stage_seconds_count{model="llama",provider="groq",stage="parse"} 1'
+        in text
+    )
+    # Каждая проверка квеста учитывается в гистограмме один раз.
+    assert (
+        'quest_stage_seconds_count{model="llama",provider="groq",stage="validate"} 1'
+        in text
+    )
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_unknown_models_share_one_label(mock_groq):
+    """Модели, от которых не было ни одного ответа, попадают в метку other."""
+    create = mock_groq.return_value.chat.completions.create
+    create.side_effect = Exception("Invalid API key")
+    for model in ("made-up-1", "made-up-2"):
+        create_quest_from_setting("сеттинг", "key", "groq", model)
+
+    text = metrics.render()
+    assert "made-up" not in text
+    assert 'llm_requests_total{model="other",outcome="error",provider="groq"} 2' in text
+
+
+@patch("services.quest_generator.openai.OpenAI")
+def test_streaming_metrics(mock_openai, make_quest):
+    """Потоковый запрос учитывается с меткой модели, исходом и токенами."""
+    chunk = MagicMock(usage=None)
+    chunk.choices[0].delta.content = json.dumps(make_quest())
+    last = MagicMock(choices=[])
+    last.usage.prompt_tokens = 90
+    last.usage.completion_tokens = 60
+    create = mock_openai.return_value.chat.completions.create
+    create.return_value = [chunk, last]
+
+    list(stream_quest_from_setting("сеттинг", "key", "openai", "gpt-4o"))
+
+    assert create.call_args.kwargs["stream_options"] == {"include_usage": True}
+    text = metrics.render()
+    assert 'llm_requests_total{model="gpt-4o",outcome="ok",provider="openai"} 1' in text
+    assert (
+        'llm_tokens_total{kind="completion",model="gpt-4o",provider="openai"} 60'
+        in text
+    )
+    assert (
+        'quest_stage_seconds_count{model="gpt-4o",provider="openai",stage="ttft"} 1'
+        in text
+    )
@@ -0,0 +1,94 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+from services.quest_generator import regenerate_quest_nodes_async
+from services.quest_validator import QuestGraph
+
+
+def _mock_response(mock_groq, response):
+    create = AsyncMock(return_value=response)
+    mock_groq.return_value.__aenter__.return_value.chat.completions.create = create
+    return create
+
+
+def test_neighbours_include_parents_and_children(make_quest):
+    """Тестирует поиск соседей узла в обе стороны."""
+    graph = QuestGraph(make_quest())
+    assert graph.neighbours(["win"]) == ["start"]
+    assert graph.neighbours(["start"]) == ["win", "lose"]
+    assert graph.neighbours(["start", "win"]) == ["lose"]
+
+
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_regenerate_sends_only_minimal_context(mock_groq, make_quest, completion):
+    """Тестирует, что провайдер получает только выбранные узлы и соседей."""
+    quest = make_quest()
+    quest["nodes"].append(
+        {"id": "far", "title": "Далёкий узел", "type": "STORY", "choices": []}
+    )
+    quest["nodes"][0]["choices"].append({"text": "Дальше", "targetNodeId": "far"})
+    quest["nodes"][3]["choices"] = [{"text": "Назад", "targetNodeId": "lose"}]
+    create = _mock_response(mock_groq, completion({"nodes": []}))
+
+    asyncio.run(
+        regenerate_quest_nodes_async(
+            quest, ["win"], "key", "groq", "llama3", instruction="Сделай мрачнее"
+        )
+    )
+    prompt = create.call_args.kwargs["messages"][-1]["content"]
+    assert "Победа" in prompt and "Развилка" in prompt
+    assert "Сделай мрачнее" in prompt
+    assert "Далёкий узел" not in prompt
+
+
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_regenerate_splices_nodes_and_keeps_edges(mock_groq, make_quest, completion):
+    """Тестирует вклейку переписанных и новых узлов с сохранением переходов."""
+    quest = make_quest()
+    _mock_response(
+        mock_groq,
+        completion(
+            {
+                "nodes": [
+                    {
+                        "id": "start",
+                        "description": "Новая развилка.",
+                        "choices": [
+                            {"text": "Налево", "targetNodeId": "win"},
+                            {"text": "В пещеру", "targetNodeId": "cave"},
+                            {"text": "В никуда", "targetNodeId": "missing"},
+                        ],
+                    },
+                    {
+                        "id": "cave",
+                        "title": "Пещера",
+                        "type": "STORY",
+                        "choices": [{"text": "Выйти", "targetNodeId": "lose"}],
+                    },
+                    {"id": "win", "title": "Подмена соседа", "type": "STORY"},
+                ]
+            }
+        ),
+    )
+
+    result = asyncio.run(
+        regenerate_quest_nodes_async(quest, ["start"], "key", "groq", "llama3")
+    )
+    nodes = {node["id"]: node for node in result["nodes"]}
+    assert nodes["start"]["description"] == "Новая развилка."
+    assert nodes["start"]["title"] == "Развилка"
+    assert [c["targetNodeId"] for c in nodes["start"]["choices"]] == ["win", "cave"]
+    assert nodes["win"] == quest["nodes"][1]
+    assert nodes["cave"]["title"] == "Пещера"
+    assert quest["nodes"][0]["description"] == "Дорога расходится."
+
+
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_regenerate_reports_provider_errors(mock_groq, make_quest):
+    """Тестирует понятную ошибку при сбое провайдера."""
+    client = mock_groq.return_value.__aenter__.return_value
+    client.chat.completions.create = AsyncMock(side_effect=Exception("Invalid API key"))
+    result = asyncio.run(
+        regenerate_quest_nodes_async(make_quest(), ["win"], "key", "groq", "llama3")
+    )
+    assert result == {"error": "Неверный API ключ. Пожалуйста, проверьте ваш ключ."}
@@ -0,0 +1,63 @@
+from unittest.mock import MagicMock, patch
+
+from services.prompts import QUEST_TEMPLATE, PromptTemplate
+from services.quest_cache import make_cache_key
+from services.quest_generator import _chat_request, create_quest_from_setting
+
+
+def test_template_keeps_static_prefix_and_setting_last():
+    """Тестирует, что сеттинг попадает только в конец сообщения пользователя."""
+    first = QUEST_TEMPLATE.render(setting="Тёмный лес")
+    second = QUEST_TEMPLATE.render(setting="Город {в облаках}")
+    assert first.system is second.system
+    assert "Тёмный лес" not in first.system
+    assert second.user.rstrip("-\n").endswith("Город {в облаках}")
+
+
+def test_template_version_id():
+    """Тестирует, что версия шаблона меняется вместе с его текстом."""
+    template = PromptTemplate("demo", system="  Система\n", user="{x}")
+    assert template.version_id.startswith("demo:")
+    assert template.version_id == PromptTemplate("demo", "Система", "{x}").version_id
+    assert template.version_id != PromptTemplate("demo", "Система", "{x}!").version_id
+    assert (
+        template.version_id
+        != PromptTemplate("demo", "Система", "{x}", {"type": "object"}).version_id
+    )
+    prompt = template.render(x="y")
+    assert (prompt.system, prompt.user, prompt.name) == ("Система", "y", "demo")
+
+
+def test_chat_request_sends_system_prefix_first():
+    """Тестирует порядок сообщений: системный префикс, затем сеттинг."""
+    prompt = QUEST_TEMPLATE.render(setting="сеттинг")
+    messages = _chat_request("groq", prompt, "m")["messages"]
+    assert messages == [
+        {"role": "system", "content": prompt.system},
+        {"role": "user", "content": prompt.user},
+    ]
+    continued = _chat_request("groq", prompt, "m", partial="{")["messages"]
+    assert [m["role"] for m in continued] == ["system", "user", "assistant", "user"]
+
+
+@patch("services.quest_generator.genai")
+def test_gemini_receives_system_instruction(mock_genai, make_quest):
+    """Тестирует, что Gemini получает инструкции через system_instruction."""
+    model = MagicMock()
+    model.generate_content.return_value.text = '{"questTitle": "Q"}'
+    mock_genai.GenerativeModel.return_value = model
+    create_quest_from_setting("сеттинг", "key", "gemini", "gemini-pro")
+    kwargs = mock_genai.GenerativeModel.call_args.kwargs
+    assert kwargs["system_instruction"] == QUEST_TEMPLATE.system
+    assert "сеттинг" in model.generate_content.call_args.args[0]
+
+
+@patch("services.quest_generator.quest_cache")
+@patch("services.quest_generator.groq.Groq")
+def test_cache_key_uses_template_version(mock_groq, mock_cache):
+    """Тестирует, что ключ кэша строится по версии шаблона."""
+    mock_cache.get.return_value = {"questTitle": "из кэша"}
+    create_quest_from_setting("сеттинг", "key", "groq", "llama3")
+    assert mock_cache.get.call_args.args[0] == make_cache_key(
+        "сеттинг", "groq", "llama3", QUEST_TEMPLATE.version_id
+    )
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+
+from services.providers import LazySDK, loaded_attrs, preload_provider_sdks
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "app")
+
+
+def test_lazy_sdk_imports_on_first_attribute(tmp_path, monkeypatch):
+    """Модуль импортируется только при первом обращении к атрибуту."""
+    (tmp_path / "lazy_probe_sdk.py").write_text("VALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "lazy_probe_sdk", raising=False)
+    sdk = LazySDK("lazy_probe_sdk")
+
+    assert not sdk.loaded
+    assert "lazy_probe_sdk" not in sys.modules
+    assert sdk.VALUE == 42
+    assert sdk.loaded
+
+
+def test_loaded_attrs_skips_unloaded_sdks():
+    """Классы ошибок берутся только из уже импортированных SDK."""
+    loaded = LazySDK("json")
+    missing = LazySDK("not_imported_sdk_module")
+
+    assert loaded_attrs((loaded, missing), "JSONDecodeError") == (json.JSONDecodeError,)
+
+
+def test_preload_uses_enabled_providers(monkeypatch):
+    """SDK заранее загружаются только для провайдеров из LLM_PROVIDERS."""
+    monkeypatch.setenv("LLM_PROVIDERS", "fake, unknown")
+    assert preload_provider_sdks() == ["openai"]
+    monkeypatch.setenv("LLM_PROVIDERS", "")
+    assert preload_provider_sdks() == []
+
+
+def test_app_import_does_not_load_provider_sdks():
+    """Импорт приложения без LLM_PROVIDERS не тянет SDK провайдеров."""
+    code = (
+        "import json, sys, main; print(json.dumps("
+        "[m for m in ('openai', 'groq', 'google.generativeai') if m in sys.modules]))"
+    )
+    env = {**os.environ, "PYTHONPATH": APP_DIR, "LLM_PROVIDERS": ""}
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=APP_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert json.loads(completed.stdout.strip().splitlines()[-1]) == []
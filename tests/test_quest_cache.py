@@ -0,0 +1,110 @@
+import json
+from unittest.mock import MagicMock, patch
+
+from services.quest_cache import (
+    MemoryCache,
+    QuestCache,
+    SQLiteCache,
+    make_cache_key,
+)
+from services.quest_generator import create_quest_from_setting
+
+
+def test_cache_key_normalizes_setting():
+    """Тестирует, что пробелы и переносы строк не влияют на ключ кэша."""
+    assert make_cache_key("  Тёмный\n лес ", "groq", "m", "1") == make_cache_key(
+        "Тёмный лес", "groq", "m", "1"
+    )
+
+
+def test_cache_key_depends_on_provider_model_and_prompt_version():
+    """Тестирует, что ключ различается для разных провайдеров, моделей и промптов."""
+    keys = {
+        make_cache_key("лес", "groq", "m", "1"),
+        make_cache_key("лес", "openai", "m", "1"),
+        make_cache_key("лес", "groq", "m2", "1"),
+        make_cache_key("лес", "groq", "m", "2"),
+    }
+    assert len(keys) == 4
+
+
+def test_memory_cache_lru_and_ttl(clock):
+    """Тестирует вытеснение по размеру и истечение TTL в памяти."""
+    cache = MemoryCache(max_entries=2, ttl=60, clock=clock)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    clock.now += 61
+    assert cache.get("a") is None
+
+
+def test_sqlite_cache_ttl_and_size_eviction(tmp_path, clock):
+    """Тестирует дисковый уровень: TTL и вытеснение давно не читанных записей."""
+    cache = SQLiteCache(str(tmp_path / "cache.db"), ttl=60, max_entries=2, clock=clock)
+    cache.set("a", "1")
+    clock.now += 1
+    cache.set("b", "2")
+    clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    clock.now += 120
+    assert cache.get("c") is None
+
+
+def test_sqlite_cache_shared_between_instances(tmp_path):
+    """Тестирует, что дисковый кэш виден из другого соединения (воркера)."""
+    path = str(tmp_path / "cache.db")
+    SQLiteCache(path).set("key", "value")
+    assert SQLiteCache(path).get("key") == "value"
+
+
+def test_sqlite_cache_reconnects_after_fork(tmp_path):
+    """После fork (gunicorn --preload) кэш открывает новое соединение."""
+    cache = SQLiteCache(str(tmp_path / "cache.db"))
+    cache.set("key", "value")
+    inherited = cache._conn
+    cache._owner = -1  # Как будто объект создан в другом процессе.
+
+    assert cache.get("key") == "value"
+    assert cache._conn is not inherited
+
+
+def test_quest_cache_promotes_disk_hits_to_memory(tmp_path):
+    """Тестирует, что найденное на диске значение копируется в память."""
+    memory = MemoryCache()
+    disk = SQLiteCache(str(tmp_path / "cache.db"))
+    disk.set("key", '{"questTitle": "Q"}')
+    cache = QuestCache([memory, disk])
+    assert cache.get("key") == {"questTitle": "Q"}
+    assert memory.get("key") == '{"questTitle": "Q"}'
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_create_quest_uses_cache_and_allows_opt_out(mock_groq, make_quest):
+    """Тестирует, что повторный запрос берётся из кэша, а use_cache=False — нет."""
+    mock_completion = MagicMock()
+    mock_completion.choices[0].message.content = json.dumps(make_quest("Кэш"))
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = mock_completion
+    first = create_quest_from_setting("сеттинг", "key", "groq", "llama3")
+    second = create_quest_from_setting("  сеттинг ", "other_key", "groq", "llama3")
+    assert first == second == make_quest("Кэш")
+    assert create.call_count == 1
+    create_quest_from_setting("сеттинг", "key", "groq", "llama3", use_cache=False)
+    assert create.call_count == 2
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_create_quest_does_not_cache_errors(mock_groq):
+    """Тестирует, что ошибки генерации не попадают в кэш."""
+    create = mock_groq.return_value.chat.completions.create
+    create.side_effect = Exception("API Error")
+    create_quest_from_setting("сеттинг", "key", "groq", "llama3")
+    create_quest_from_setting("сеттинг", "key", "groq", "llama3")
+    assert create.call_count == 2
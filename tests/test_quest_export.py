@@ -0,0 +1,85 @@
+import mmap
+import struct
+
+import pytest
+
+from services.quest_export import (
+    NONE,
+    QuestBinary,
+    QuestFormatError,
+    decode_quest,
+    encode_quest,
+    export_quest_index,
+)
+
+
+def test_binary_round_trip(make_quest, tmp_path):
+    """Квест восстанавливается из QSTB, в том числе через mmap файла."""
+    quest = make_quest()
+    quest["nodes"][1]["description"] = "Сокровище найдено."
+    quest["nodes"][2]["description"] = ""
+    data = encode_quest(quest)
+    assert data[:4] == b"QSTB" and len(data) % 4 == 0
+    assert decode_quest(data) == quest
+
+    path = tmp_path / "quest.qstb"
+    path.write_bytes(data)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        binary = QuestBinary(m)
+        assert binary.string(binary.title) == "Квест"
+        del binary
+
+
+def test_adjacency_uses_node_indices(make_quest):
+    """Выборы узла лежат подряд и ссылаются на узлы по индексу."""
+    binary = QuestBinary(encode_quest(make_quest()))
+    assert binary.node_count == 3 and binary.edge_count == 2
+    assert binary.start_node == 0
+    targets = [target for target, _ in binary.choices(0)]
+    assert targets == [1, 2]
+    assert binary.choices(1) == [] and binary.choices(2) == []
+
+
+def test_strings_are_interned(make_quest):
+    """Повторяющиеся строки хранятся один раз."""
+    quest = make_quest()
+    for node in quest["nodes"]:
+        node["description"] = "Одинаковое описание"
+    binary = QuestBinary(encode_quest(quest))
+    descriptions = {binary.node(i)[2] for i in range(binary.node_count)}
+    assert len(descriptions) == 1
+    assert binary.string(0) == ""
+
+
+def test_dangling_targets_and_bad_data(make_quest):
+    """Выбор на несуществующий узел помечается NONE, чужие данные отклоняются."""
+    quest = make_quest()
+    quest["nodes"][0]["choices"][1]["targetNodeId"] = "missing"
+    quest["startNodeId"] = "missing"
+    binary = QuestBinary(encode_quest(quest))
+    assert binary.start_node == NONE
+    assert [target for target, _ in binary.choices(0)] == [1, NONE]
+    assert len(decode_quest(encode_quest(quest))["nodes"][0]["choices"]) == 1
+
+    with pytest.raises(QuestFormatError):
+        QuestBinary(b"JSON" + bytes(60))
+    data = bytearray(encode_quest(quest))
+    struct.pack_into("<H", data, 4, 99)
+    with pytest.raises(QuestFormatError):
+        QuestBinary(data)
+
+
+def test_json_index_mirrors_binary(make_quest):
+    """JSON-вариант содержит те же таблицы, что и QSTB."""
+    index = export_quest_index(make_quest())
+    binary = QuestBinary(encode_quest(make_quest()))
+    assert index["strings"][index["title"]] == "Квест"
+    assert index["startNode"] == binary.start_node
+    assert index["edgeIndex"] == [0, 2, 2, 2]
+    assert index["edges"]["target"] == [1, 2]
+    assert [index["nodeTypes"][t] for t in index["nodes"]["type"]] == [
+        "CHOICE",
+        "ENDING_SUCCESS",
+        "ENDING_FAILURE",
+    ]
+    assert export_quest_index({"nodes": []})["nodes"]["id"] == []
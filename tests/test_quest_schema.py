@@ -0,0 +1,81 @@
+from unittest.mock import MagicMock, patch
+
+from services.prompts import QUEST_TEMPLATE
+from services.quest_generator import _chat_request, create_quest_from_setting
+from services.quest_schema import (
+    NODE_SCHEMA,
+    QUEST_SCHEMA,
+    gemini_schema,
+    schema_errors,
+    strict_schema,
+)
+
+
+def test_valid_quest_matches_schema(make_quest):
+    """Тестирует, что корректный квест проходит проверку схемы."""
+    assert schema_errors(make_quest(), QUEST_SCHEMA) == []
+
+
+def test_schema_errors_report_paths(make_quest):
+    """Тестирует сообщения об ошибках с путём до поля."""
+    quest = make_quest()
+    quest["nodes"][0]["type"] = "BOSS"
+    quest["nodes"][1]["choices"] = "нет"
+    del quest["nodes"][2]["id"]
+    quest["startNodeId"] = 1
+    assert schema_errors(quest, QUEST_SCHEMA) == [
+        "$.startNodeId: expected string",
+        "$.nodes[0].type: must be one of STORY, CHOICE, ENDING_SUCCESS, ENDING_FAILURE",
+        "$.nodes[1].choices: expected array",
+        "$.nodes[2]: missing 'id'",
+    ]
+
+
+def test_strict_schema_requires_all_properties():
+    """Тестирует вариант схемы для строгого режима OpenAI."""
+    strict = strict_schema(QUEST_SCHEMA)
+    node = strict["properties"]["nodes"]["items"]
+    assert node["required"] == list(NODE_SCHEMA["properties"])
+    assert node["additionalProperties"] is False
+    assert node["properties"]["choices"]["items"]["additionalProperties"] is False
+    assert "additionalProperties" not in NODE_SCHEMA
+    assert schema_errors({"extra": 1}, {**strict, "required": []}) == [
+        "$: unexpected 'extra'"
+    ]
+
+
+def test_gemini_schema_drops_unsupported_keys():
+    """Тестирует, что для Gemini убирается additionalProperties."""
+    converted = gemini_schema(strict_schema(QUEST_SCHEMA))
+    assert "additionalProperties" not in str(converted)
+    assert converted["properties"]["nodes"]["items"]["required"]
+
+
+def test_chat_request_uses_json_schema_for_supported_models(monkeypatch):
+    """Тестирует выбор режима structured output по модели."""
+    prompt = QUEST_TEMPLATE.render(setting="сеттинг")
+    request = _chat_request("openai", prompt, "gpt-4o-mini")
+    response_format = request["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["strict"] is True
+    assert response_format["json_schema"]["name"] == "quest"
+    assert _chat_request("groq", prompt, "llama3")["response_format"] == {
+        "type": "json_object"
+    }
+    monkeypatch.setenv("STRUCTURED_OUTPUT", "0")
+    monkeypatch.setenv("GENERATION_MAX_TOKENS", "4000")
+    request = _chat_request("openai", prompt, "gpt-4o-mini")
+    assert request["response_format"] == {"type": "json_object"}
+    assert request["max_completion_tokens"] == 4000
+
+
+@patch("services.quest_generator.genai")
+def test_gemini_receives_response_schema(mock_genai, make_quest):
+    """Тестирует передачу response_schema моделям Gemini с его поддержкой."""
+    model = MagicMock()
+    model.generate_content.return_value.text = '{"questTitle": "Q"}'
+    mock_genai.GenerativeModel.return_value = model
+    create_quest_from_setting("сеттинг", "key", "gemini", "models/gemini-1.5-flash")
+    config = model.generate_content.call_args.kwargs["generation_config"]
+    assert config["response_mime_type"] == "application/json"
+    assert config["response_schema"] == gemini_schema(QUEST_SCHEMA)
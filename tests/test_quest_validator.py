@@ -0,0 +1,137 @@
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+from services.quest_generator import create_quest_from_setting
+from services.quest_validator import (
+    DANGLING_TARGET,
+    DEAD_END,
+    DUPLICATE_ID,
+    INVALID_START,
+    MISSING_ENDING,
+    MISSING_ID,
+    NO_NODES,
+    NO_PATH_TO_ENDING,
+    UNREACHABLE,
+    Issue,
+    close_dead_ends,
+    merge_nodes,
+    repair_quest,
+    validate_quest,
+)
+
+
+def _node(node_id, node_type="STORY", *targets):
+    return {
+        "id": node_id,
+        "type": node_type,
+        "choices": [{"text": t, "targetNodeId": t} for t in targets],
+    }
+
+
+def test_valid_quest_has_no_issues(make_quest):
+    """Тестирует, что корректный квест проходит проверку."""
+    assert validate_quest(make_quest()) == []
+
+
+def test_validate_reports_graph_problems():
+    """Тестирует обнаружение висячих ссылок, тупиков и недостижимых узлов."""
+    quest = {
+        "startNodeId": "a",
+        "nodes": [
+            _node("a", "CHOICE", "b", "ghost", "loop"),
+            _node("b"),
+            _node("loop", "STORY", "loop"),
+            _node("win", "ENDING_SUCCESS"),
+            _node("a"),
+            {"title": "без id"},
+        ],
+    }
+    issues = validate_quest(quest)
+    assert Issue(DANGLING_TARGET, "a", "ghost") in issues
+    assert Issue(DEAD_END, "b") in issues
+    assert Issue(NO_PATH_TO_ENDING, "loop") in issues
+    assert Issue(UNREACHABLE, "win") in issues
+    assert Issue(DUPLICATE_ID, "a", "4") in issues
+    assert Issue(MISSING_ID, detail="5") in issues
+    assert Issue(MISSING_ENDING, detail="ENDING_SUCCESS") in issues
+    assert Issue(MISSING_ENDING, detail="ENDING_FAILURE") in issues
+
+
+def test_validate_reports_missing_nodes_and_start():
+    """Тестирует квест без узлов и с неверным startNodeId."""
+    assert validate_quest({"questTitle": "Q"}) == [Issue(NO_NODES)]
+    quest = {"startNodeId": "nope", "nodes": [_node("end", "ENDING_FAILURE")]}
+    assert Issue(INVALID_START, detail="nope") in validate_quest(quest)
+
+
+def test_repair_fixes_structure_locally():
+    """Тестирует локальную починку id, ссылок и стартового узла."""
+    quest = {
+        "startNodeId": "missing",
+        "nodes": [
+            _node("a", "CHOICE", "win", "ghost", "lose"),
+            _node("win", "ENDING_SUCCESS"),
+            _node("win", "ENDING_FAILURE"),
+            {"type": "ENDING_FAILURE", "choices": []},
+        ],
+    }
+    repaired, issues = repair_quest(quest)
+    assert repaired["startNodeId"] == "a"
+    assert [node["id"] for node in repaired["nodes"]] == ["a", "win", "win_2", "node_4"]
+    assert [c["targetNodeId"] for c in repaired["nodes"][0]["choices"]] == ["win"]
+    assert quest["nodes"][0]["choices"][1]["targetNodeId"] == "ghost"
+    assert {issue.code for issue in issues} == {UNREACHABLE, MISSING_ENDING}
+
+
+def test_merge_and_close_dead_ends():
+    """Тестирует слияние перегенерированных узлов и превращение тупиков в концовки."""
+    quest = {"startNodeId": "a", "nodes": [_node("a", "CHOICE", "b", "c"), _node("b")]}
+    quest = merge_nodes(quest, [_node("c", "ENDING_SUCCESS")])
+    assert [node["id"] for node in quest["nodes"]] == ["a", "b", "c"]
+    closed = close_dead_ends(quest)
+    assert closed["nodes"][1]["type"] == "ENDING_FAILURE"
+    assert validate_quest(closed) == []
+
+
+def test_validate_is_linear_on_large_quests():
+    """Тестирует скорость проверки квеста из десятков тысяч узлов."""
+    count = 50000
+    nodes = [_node(f"n{i}", "CHOICE", f"n{i + 1}", "fail") for i in range(count)]
+    nodes.append(_node(f"n{count}", "ENDING_SUCCESS"))
+    nodes.append(_node("fail", "ENDING_FAILURE"))
+    quest = {"startNodeId": "n0", "nodes": nodes}
+    started = time.perf_counter()
+    assert validate_quest(quest) == []
+    assert time.perf_counter() - started < 2
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_generation_regenerates_only_broken_nodes(mock_groq, make_quest):
+    """Тестирует перегенерацию только сломанных узлов квеста."""
+    quest = make_quest()
+    quest["nodes"][2] = _node("lose")
+    fixed = _node("lose", "ENDING_FAILURE")
+    responses = []
+    for content in (quest, {"nodes": [fixed]}):
+        completion = MagicMock()
+        completion.choices[0].message.content = json.dumps(content)
+        responses.append(completion)
+    create = mock_groq.return_value.chat.completions.create
+    create.side_effect = responses
+
+    result = create_quest_from_setting("s", "key", "groq", "llama3")
+    assert result["nodes"][2] == fixed
+    assert result["nodes"][:2] == quest["nodes"][:2]
+    repair_prompt = create.call_args_list[1].kwargs["messages"][-1]["content"]
+    assert "узел lose: не концовка, но без выборов" in repair_prompt
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_generation_without_nodes_is_an_error(mock_groq):
+    """Тестирует ошибку для квеста без узлов."""
+    completion = MagicMock()
+    completion.choices[0].message.content = '{"questTitle": "Пусто"}'
+    mock_groq.return_value.chat.completions.create.return_value = completion
+    result = create_quest_from_setting("s", "key", "groq", "llama3")
+    assert "без узлов" in result["error"]
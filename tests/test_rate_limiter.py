@@ -0,0 +1,166 @@
+import json
+
+import httpx
+import pytest
+from unittest.mock import ANY, MagicMock, patch
+
+from services.quest_generator import (
+    _get_master_prompt,
+    _request_completion_once,
+    _update_rate_limits,
+    create_quest_from_setting,
+    stream_quest_from_setting,
+)
+from services.rate_limiter import (
+    ProviderLimiter,
+    RateLimiterRegistry,
+    RateLimitExceeded,
+    TokenBucket,
+    parse_duration,
+    rate_limiters,
+)
+from services.resilience import DeadlineExceeded
+
+
+def test_parse_duration_formats():
+    """Тестирует разбор длительностей из заголовков провайдеров."""
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("12ms") == pytest.approx(0.012)
+    assert parse_duration("1h2m3.5s") == 3723.5
+    assert parse_duration("soon") is None
+    assert parse_duration(None) is None
+
+
+def test_token_bucket_reports_wait_until_refill(clock):
+    """Тестирует, что пустой бакет сообщает время до пополнения."""
+    bucket = TokenBucket(60, 1.0, clock)
+    bucket.consume(60)
+    assert bucket.wait_time(1) == 1.0
+    clock.now = 30
+    assert bucket.wait_time(10) == 0.0
+
+
+def test_limiter_reserves_slots_in_order(clock):
+    """Тестирует, что ожидающие запросы резервируют лимит по очереди."""
+    limiter = ProviderLimiter(rpm=60, clock=clock)
+    for _ in range(60):
+        assert limiter._reserve(0, max_wait=10) == 0.0
+    assert limiter._reserve(0, max_wait=10) == pytest.approx(1.0)
+    assert limiter._reserve(0, max_wait=10) == pytest.approx(2.0)
+
+
+def test_limiter_raises_when_wait_exceeds_max(clock):
+    """Тестирует отказ, если ждать лимита дольше допустимого."""
+    limiter = ProviderLimiter(tpm=1000, clock=clock)
+    limiter.acquire(1000, max_wait=0)
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(500, max_wait=5)
+
+
+def test_limiter_adapts_to_response_headers(clock):
+    """Тестирует подстройку лимитов под заголовки x-ratelimit-*."""
+    limiter = ProviderLimiter(clock=clock)
+    limiter.update_from_headers(
+        {
+            "x-ratelimit-limit-tokens": "6000",
+            "x-ratelimit-remaining-tokens": "100",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "2s",
+        }
+    )
+    assert limiter.tokens.capacity == 6000
+    assert limiter.tokens.tokens == 100
+    assert limiter.blocked_until == 2.0
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(0, max_wait=1)
+
+
+def test_record_usage_corrects_estimate(clock):
+    """Тестирует учёт фактического расхода токенов после ответа."""
+    limiter = ProviderLimiter(tpm=1000, clock=clock)
+    limiter.acquire(100, max_wait=0)
+    limiter.record_usage(300, 100)
+    assert limiter.tokens.tokens == 700
+
+
+def test_response_hook_updates_limiter_for_request_model():
+    """Тестирует, что хук HTTP-клиента обновляет лимитер нужной модели."""
+    request = httpx.Request(
+        "POST", "https://api.groq.com/v1/chat", json={"model": "llama3"}
+    )
+    response = httpx.Response(
+        200, headers={"retry-after": "5"}, request=request, content=b"{}"
+    )
+    _update_rate_limits("groq", "key", response)
+    assert rate_limiters.get("groq", "key", "llama3").blocked_until > 0
+    assert rate_limiters.get("groq", "key", "other").blocked_until == 0
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_generation_fails_fast_when_provider_blocked(mock_groq):
+    """Тестирует, что заблокированный провайдером ключ не вызывает API."""
+    rate_limiters.get("groq", "key", "llama3").block_for(3600)
+    result = create_quest_from_setting("s", "key", "groq", "llama3", use_cache=False)
+    assert result == {"error": "Превышен лимит запросов к API. Попробуйте позже."}
+    mock_groq.return_value.chat.completions.create.assert_not_called()
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_provider_429_blocks_following_requests(mock_groq):
+    """Тестирует паузу для ключа после ответа 429 от провайдера."""
+    mock_groq.return_value.chat.completions.create.side_effect = Exception(
+        "Error code: 429 - Rate limit reached. Please try again in 7.5s"
+    )
+    create_quest_from_setting("s", "key", "groq", "llama3", use_cache=False)
+    limiter = rate_limiters.get("groq", "key", "llama3")
+    assert limiter.blocked_until - limiter._clock() == pytest.approx(7.5, abs=0.5)
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_streaming_corrects_estimate_with_actual_usage(mock_groq, make_quest):
+    """Тестирует корректировку бакета по расходу из последнего фрагмента потока."""
+    text = MagicMock(usage=None, x_groq=None)
+    text.choices[0].delta.content = json.dumps(make_quest())
+    last = MagicMock(choices=[], usage=None)
+    last.x_groq.usage.total_tokens = 321
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = [text, last]
+    limiter = rate_limiters.get("groq", "key", "llama3")
+    with patch.object(limiter, "record_usage") as record_usage:
+        list(stream_quest_from_setting("s", "key", "groq", "llama3", use_cache=False))
+    record_usage.assert_called_once_with(321, ANY)
+    assert "stream_options" not in create.call_args.kwargs
+
+
+def test_registry_evicts_idle_and_least_recently_used(clock):
+    """Тестирует вытеснение лимитеров по размеру реестра и TTL."""
+    registry = RateLimiterRegistry(max_size=2, ttl=60, clock=clock)
+    a = registry.get("groq", "a", "llama3")
+    registry.get("groq", "b", "llama3")
+    registry.get("groq", "a", "llama3")
+    registry.get("groq", "c", "llama3")
+    assert len(registry) == 2
+    assert registry.get("groq", "a", "llama3") is a
+
+    blocked = registry.get("groq", "c", "llama3")
+    blocked.block_for(600)
+    clock.now = 120
+    assert registry.get("groq", "a", "llama3") is not a
+    assert registry.get("groq", "c", "llama3") is blocked
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_rate_limit_wait_is_taken_from_request_timeout(mock_groq, completion):
+    """Тестирует, что ожидание лимита вычитается из таймаута запроса к SDK."""
+    create = mock_groq.return_value.chat.completions.create
+    create.return_value = completion("{}")
+    with patch.object(ProviderLimiter, "acquire", return_value=2.0):
+        _request_completion_once("groq", "key", "llama3", _get_master_prompt("s"), 10.0)
+    assert create.call_args.kwargs["timeout"] == pytest.approx(8.0)
+
+    with patch.object(ProviderLimiter, "acquire", return_value=10.0):
+        with pytest.raises(DeadlineExceeded):
+            _request_completion_once(
+                "groq", "key", "llama3", _get_master_prompt("s"), 10.0
+            )
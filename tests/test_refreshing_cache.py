@@ -0,0 +1,98 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from services.quest_generator import get_available_models, validate_api_key
+from services.refreshing_cache import NEGATIVE, POSITIVE, RefreshingCache
+
+
+def _classify(result):
+    if "models" in result:
+        return POSITIVE
+    if result.get("error") == "401":
+        return NEGATIVE
+    return None
+
+
+def test_positive_results_are_cached_until_ttl(clock):
+    """Тестирует, что успешный результат кэшируется на время TTL."""
+    loader = MagicMock(return_value={"models": ["a"]})
+    cache = RefreshingCache(loader, _classify, ttl=100, refresh_ahead=0, clock=clock)
+    assert cache.get("groq", "key") == {"models": ["a"]}
+    clock.now = 99
+    cache.get("groq", "key")
+    assert loader.call_count == 1
+    clock.now = 101
+    cache.get("groq", "key")
+    assert loader.call_count == 2
+
+
+def test_invalid_keys_are_negatively_cached(clock):
+    """Тестирует короткое кэширование неверных ключей."""
+    loader = MagicMock(return_value={"error": "401"})
+    cache = RefreshingCache(loader, _classify, negative_ttl=10, clock=clock)
+    cache.get("groq", "bad")
+    cache.get("groq", "bad")
+    assert loader.call_count == 1
+    clock.now = 11
+    cache.get("groq", "bad")
+    assert loader.call_count == 2
+
+
+def test_transient_errors_are_not_cached():
+    """Тестирует, что временные сбои не кэшируются."""
+    loader = MagicMock(return_value={"error": "timeout"})
+    cache = RefreshingCache(loader, _classify)
+    cache.get("groq", "key")
+    cache.get("groq", "key")
+    assert loader.call_count == 2
+
+
+def test_background_refresh_before_expiry(clock):
+    """Тестирует фоновое обновление: пока оно идёт, отдаётся старое значение."""
+    refreshed = threading.Event()
+    results = iter([{"models": ["old"]}, {"models": ["new"]}])
+
+    def loader(provider, api_key):
+        result = next(results)
+        if result == {"models": ["new"]}:
+            refreshed.set()
+        return result
+
+    cache = RefreshingCache(loader, _classify, ttl=100, refresh_ahead=20, clock=clock)
+    cache.get("groq", "key")
+    clock.now = 85
+    assert cache.get("groq", "key") == {"models": ["old"]}
+    assert refreshed.wait(5)
+    for _ in range(100):
+        if cache.get("groq", "key") == {"models": ["new"]}:
+            break
+        time.sleep(0.01)
+    assert cache.get("groq", "key") == {"models": ["new"]}
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_models_dedup_runs_once_per_refresh(mock_groq):
+    """Тестирует, что список моделей запрашивается и фильтруется один раз."""
+    models = []
+    for model_id in ["llama3-8b-8192", "llama3-8b-8192-2024-01-01"]:
+        model = MagicMock()
+        model.id = model_id
+        models.append(model)
+    mock_groq.return_value.models.list.return_value.data = models
+    with patch("services.quest_generator.re.sub", wraps=__import__("re").sub) as sub:
+        first = get_available_models("groq", "key")
+        calls_after_first = sub.call_count
+        second = get_available_models("groq", "key")
+        assert sub.call_count == calls_after_first
+    assert first == second == {"models": ["llama3-8b-8192"]}
+    mock_groq.return_value.models.list.assert_called_once()
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_validate_api_key_caches_invalid_key(mock_groq):
+    """Тестирует, что повторная проверка неверного ключа не идёт к провайдеру."""
+    mock_groq.return_value.models.list.side_effect = Exception("401 Invalid Key")
+    assert validate_api_key("groq", "invalid")["message"] == "Неверный API ключ."
+    assert validate_api_key("groq", "invalid")["message"] == "Неверный API ключ."
+    mock_groq.return_value.models.list.assert_called_once()
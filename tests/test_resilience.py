@@ -0,0 +1,165 @@
+import asyncio
+import json
+from unittest.mock import MagicMock, patch
+
+import httpx
+import openai
+import pytest
+
+from services.quest_generator import (
+    _is_provider_failure,
+    _is_retryable_error,
+    create_quest_from_setting,
+)
+from services.rate_limiter import RateLimitExceeded
+from services.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    circuit_breakers,
+)
+
+
+def _server_error(status=503):
+    return openai.InternalServerError(
+        "Service unavailable",
+        response=httpx.Response(status, request=httpx.Request("POST", "http://x")),
+        body=None,
+    )
+
+
+def test_retry_recovers_from_transient_errors(clock, transient):
+    """Тестирует повтор временных ошибок с экспоненциальной задержкой."""
+    policy = RetryPolicy(max_attempts=3, base_delay=1, clock=clock, sleep=clock.sleep)
+    fn = MagicMock(side_effect=[transient(), transient(), "ok"])
+    assert policy.call(fn, transient.matches) == "ok"
+    assert fn.call_count == 3
+    assert clock.now <= 1 + 2
+
+
+def test_retry_does_not_repeat_permanent_errors(transient):
+    """Тестирует, что постоянная ошибка не повторяется."""
+    policy = RetryPolicy(sleep=lambda _: None)
+    fn = MagicMock(side_effect=ValueError("401"))
+    with pytest.raises(ValueError):
+        policy.call(fn, transient.matches)
+    assert fn.call_count == 1
+
+
+def test_retry_respects_deadline(clock, transient):
+    """Тестирует передачу оставшегося времени и остановку у дедлайна."""
+    policy = RetryPolicy(
+        max_attempts=10, base_delay=4, deadline=5, clock=clock, sleep=clock.sleep
+    )
+    timeouts = []
+
+    def fn(timeout):
+        timeouts.append(timeout)
+        clock.now += 2
+        raise transient()
+
+    with patch("services.resilience.random.uniform", side_effect=lambda a, b: b):
+        with pytest.raises(transient):
+            policy.call(fn, transient.matches)
+    assert timeouts == [5]
+
+
+def test_retry_async(transient):
+    """Тестирует асинхронный вариант повторов."""
+    policy = RetryPolicy(base_delay=0)
+    calls = []
+
+    async def fn(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            raise transient()
+        return "ok"
+
+    assert asyncio.run(policy.call_async(fn, transient.matches)) == "ok"
+    assert len(calls) == 2
+
+
+def test_circuit_opens_and_probes_half_open(clock):
+    """Тестирует размыкание цепи и пробный запрос после паузы."""
+    breaker = CircuitBreaker("groq", failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now = 10
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_local_rate_limit_keeps_probe_half_open(clock):
+    """Тестирует, что отказ клиентского лимитера не закрывает цепь half_open."""
+    breaker = CircuitBreaker("groq", failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    policy = RetryPolicy(clock=clock, sleep=clock.sleep)
+    fn = MagicMock(side_effect=RateLimitExceeded("would wait 60s"))
+    with pytest.raises(RateLimitExceeded):
+        policy.call(fn, _is_retryable_error, breaker, _is_provider_failure)
+    assert breaker.state == HALF_OPEN
+    # Пробный слот освобождён: следующий запрос снова проверит провайдера.
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def test_failed_probe_reopens_circuit(clock):
+    """Тестирует повторное размыкание после неудачной пробы."""
+    breaker = CircuitBreaker("groq", failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.snapshot() == {
+        "state": OPEN,
+        "consecutive_failures": 2,
+        "retry_in": 10,
+    }
+
+
+@patch("services.resilience.random.uniform", return_value=0)
+@patch("services.quest_generator.groq.Groq")
+def test_generation_retries_server_errors(mock_groq, _uniform, make_quest):
+    """Тестирует повтор генерации после ответа 5xx."""
+    completion = MagicMock()
+    completion.choices[0].message.content = json.dumps(make_quest("Повтор"))
+    mock_groq.return_value.chat.completions.create.side_effect = [
+        _server_error(),
+        completion,
+    ]
+    result = create_quest_from_setting("s", "key", "groq", "llama3", use_cache=False)
+    assert result == make_quest("Повтор")
+    assert mock_groq.return_value.chat.completions.create.call_count == 2
+    assert circuit_breakers.get("groq").state == CLOSED
+
+
+@patch("services.resilience.random.uniform", return_value=0)
+@patch("services.quest_generator.groq.Groq")
+def test_open_circuit_fails_fast(mock_groq, _uniform):
+    """Тестирует отказ без обращения к провайдеру при разомкнутой цепи."""
+    mock_groq.return_value.chat.completions.create.side_effect = _server_error()
+    for _ in range(2):
+        create_quest_from_setting("s", "key", "groq", "llama3", use_cache=False)
+    assert circuit_breakers.get("groq").state == OPEN
+    calls = mock_groq.return_value.chat.completions.create.call_count
+
+    result = create_quest_from_setting("s", "key", "groq", "llama3", use_cache=False)
+    assert result == {
+        "error": "Провайдер groq временно недоступен. Попробуйте позже или выберите другого провайдера."
+    }
+    assert mock_groq.return_value.chat.completions.create.call_count == calls
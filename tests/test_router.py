@@ -0,0 +1,138 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import openai
+import pytest
+
+from services.quest_generator import create_quest_routed_async
+from services.router import LatencyRouter, RoutesExhausted, latency_router
+
+PRIMARY = {"api_provider": "groq", "model": "llama3", "api_key": "k1"}
+SECONDARY = {"api_provider": "openai", "model": "gpt-4", "api_key": "k2"}
+
+
+def test_percentile_and_error_rate():
+    """Тестирует статистику задержек по скользящему окну."""
+    stats = LatencyRouter(window=10).stats("groq", "llama3")
+    for latency in range(1, 11):
+        stats.record(float(latency), ok=latency != 10)
+    assert stats.percentile(50) == 5.0
+    assert stats.percentile(95) == 9.0
+    assert stats.error_rate() == 0.1
+    assert stats.percentile(95, min_samples=20) is None
+
+
+def test_hedge_delay_follows_p95_within_bounds():
+    """Тестирует задержку дублирующего запроса по p95 с ограничениями."""
+    router = LatencyRouter(hedge_delay=15, hedge_min_delay=1, min_samples=2)
+    assert router.delay_for(PRIMARY) == 15
+    for _ in range(5):
+        router.stats("groq", "llama3").record(0.2, ok=True)
+    assert router.delay_for(PRIMARY) == 1
+    for _ in range(5):
+        router.stats("groq", "llama3").record(4.0, ok=True)
+    assert router.delay_for(PRIMARY) == 4.0
+
+
+def test_unhealthy_routes_are_ranked_last():
+    """Тестирует перенос маршрутов с частыми ошибками в конец списка."""
+    router = LatencyRouter(min_samples=2, max_error_rate=0.5)
+    for _ in range(3):
+        router.stats("groq", "llama3").record(1.0, ok=False)
+    assert router.rank([PRIMARY, SECONDARY]) == [SECONDARY, PRIMARY]
+
+
+def test_slow_primary_is_hedged_and_cancelled(transient):
+    """Тестирует, что медленный маршрут дублируется, а проигравший отменяется."""
+    router = LatencyRouter(hedge_delay=0.05)
+    cancelled = []
+
+    async def attempt(route):
+        if route is PRIMARY:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(route["api_provider"])
+                raise
+        return route["model"]
+
+    route, result = asyncio.run(
+        router.race([PRIMARY, SECONDARY], attempt, transient.matches)
+    )
+    assert (route, result) == (SECONDARY, "gpt-4")
+    assert cancelled == ["groq"]
+
+
+def test_fast_primary_is_not_hedged(transient):
+    """Тестирует, что быстрый ответ не порождает дублирующий запрос."""
+    router = LatencyRouter(hedge_delay=1)
+    attempt = AsyncMock(return_value="quest")
+    assert asyncio.run(
+        router.race([PRIMARY, SECONDARY], attempt, transient.matches)
+    ) == (
+        PRIMARY,
+        "quest",
+    )
+    attempt.assert_awaited_once_with(PRIMARY)
+
+
+def test_transient_error_falls_back_immediately(transient):
+    """Тестирует немедленный переход к следующему маршруту при 5xx/таймауте."""
+    router = LatencyRouter(hedge_delay=60)
+
+    async def attempt(route):
+        if route is PRIMARY:
+            raise transient("503")
+        return "quest"
+
+    assert asyncio.run(
+        router.race([PRIMARY, SECONDARY], attempt, transient.matches)
+    ) == (
+        SECONDARY,
+        "quest",
+    )
+    assert router.stats("groq", "llama3").error_rate() == 1.0
+
+
+def test_permanent_error_does_not_fall_back(transient):
+    """Тестирует, что постоянная ошибка возвращается без обращения к резерву."""
+    router = LatencyRouter(hedge_delay=60)
+    attempt = AsyncMock(side_effect=ValueError("401"))
+    with pytest.raises(RoutesExhausted) as exc_info:
+        asyncio.run(router.race([PRIMARY, SECONDARY], attempt, transient.matches))
+    assert [route for route, _ in exc_info.value.errors] == [PRIMARY]
+    attempt.assert_awaited_once_with(PRIMARY)
+
+
+@patch("services.quest_generator.openai.AsyncOpenAI")
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_routed_generation_falls_back_on_server_error(
+    mock_groq, mock_openai, make_quest, completion
+):
+    """Тестирует переход на резервного провайдера при ответе 5xx."""
+    server_error = openai.InternalServerError(
+        "Service unavailable",
+        response=httpx.Response(503, request=httpx.Request("POST", "http://x")),
+        body=None,
+    )
+    groq_client = mock_groq.return_value.__aenter__.return_value
+    groq_client.chat.completions.create = AsyncMock(side_effect=server_error)
+    openai_client = mock_openai.return_value.__aenter__.return_value
+    openai_client.chat.completions.create = AsyncMock(
+        return_value=completion(make_quest("Резерв"))
+    )
+    result = asyncio.run(create_quest_routed_async("сеттинг", [PRIMARY, SECONDARY]))
+    assert result == make_quest("Резерв")
+    assert latency_router.stats("openai", "gpt-4").percentile(50) is not None
+
+
+@patch("services.quest_generator.groq.AsyncGroq")
+def test_routed_generation_returns_last_error(mock_groq):
+    """Тестирует классификацию ошибки, если все маршруты недоступны."""
+    groq_client = mock_groq.return_value.__aenter__.return_value
+    groq_client.chat.completions.create = AsyncMock(
+        side_effect=Exception("Invalid API key")
+    )
+    result = asyncio.run(create_quest_routed_async("сеттинг", [PRIMARY]))
+    assert result == {"error": "Неверный API ключ. Пожалуйста, проверьте ваш ключ."}
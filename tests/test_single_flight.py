@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from services.quest_generator import create_quest_from_setting
+from services.single_flight import SingleFlight
+
+
+def _run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    """Тестирует, что одновременные вызовы с одним ключом выполняются один раз."""
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {"questTitle": "Общий"}
+
+    threads, results, _ = _run_concurrently(5, lambda: flight.do("key", fn))
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"questTitle": "Общий"}] * 5
+    assert flight.in_flight() == 0
+
+
+def test_errors_are_fanned_out_to_waiters():
+    """Тестирует, что исключение лидера получают все ожидающие."""
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise RuntimeError("provider down")
+
+    threads, _, errors = _run_concurrently(3, lambda: flight.do("key", fn))
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert [str(e) for e in errors] == ["provider down"] * 3
+
+
+def test_leader_base_exception_releases_key():
+    """Тестирует освобождение ключа, если лидер прерван не-Exception ошибкой."""
+    flight = SingleFlight()
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        flight.do("key", interrupted)
+    assert flight.in_flight() == 0
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_lock_file_coalesces_between_workers(tmp_path):
+    """Тестирует, что второй «воркер» дожидается первого и берёт его результат."""
+    pytest.importorskip("fcntl")
+    shared_cache = {}
+    first_worker = SingleFlight(lock_dir=str(tmp_path))
+    second_worker = SingleFlight(lock_dir=str(tmp_path))
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_generation():
+        started.set()
+        release.wait(5)
+        shared_cache["key"] = {"questTitle": "Из первого воркера"}
+        return shared_cache["key"]
+
+    second_fn = MagicMock()
+    threads, _, _ = _run_concurrently(
+        1, lambda: first_worker.do("key", slow_generation)
+    )
+    started.wait(5)
+    waiter, results, _ = _run_concurrently(
+        1,
+        lambda: second_worker.do(
+            "key", second_fn, recheck=lambda: shared_cache.get("key")
+        ),
+    )
+    time.sleep(0.1)
+    release.set()
+    for thread in threads + waiter:
+        thread.join()
+    assert results == [{"questTitle": "Из первого воркера"}]
+    second_fn.assert_not_called()
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_create_quest_coalesces_identical_requests(mock_groq, make_quest):
+    """Тестирует, что одинаковые одновременные генерации вызывают API один раз."""
+    release = threading.Event()
+    mock_completion = MagicMock()
+    mock_completion.choices[0].message.content = json.dumps(make_quest("Один на всех"))
+
+    def slow_create(**kwargs):
+        release.wait(5)
+        return mock_completion
+
+    mock_groq.return_value.chat.completions.create.side_effect = slow_create
+    threads, results, _ = _run_concurrently(
+        4, lambda: create_quest_from_setting("сеттинг", "key", "groq", "llama3")
+    )
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [make_quest("Один на всех")] * 4
+    assert mock_groq.return_value.chat.completions.create.call_count == 1
+
+
+@patch("services.quest_generator.groq.Groq")
+def test_requests_with_different_keys_are_not_coalesced(
+    mock_groq, make_quest, completion
+):
+    """Тестирует, что ошибка чужого ключа не передаётся вызову с другим ключом."""
+    release = threading.Event()
+
+    def make_client(api_key, **kwargs):
+        def create(**request):
+            release.wait(5)
+            if api_key == "bad-key":
+                raise Exception("Invalid API key")
+            return completion(make_quest("Свой ключ"))
+
+        client = MagicMock()
+        client.chat.completions.create.side_effect = create
+        return client
+
+    mock_groq.side_effect = make_client
+    bad, bad_results, _ = _run_concurrently(
+        1, lambda: create_quest_from_setting("сеттинг", "bad-key", "groq", "llama3")
+    )
+    time.sleep(0.05)
+    good, good_results, _ = _run_concurrently(
+        1, lambda: create_quest_from_setting("сеттинг", "good-key", "groq", "llama3")
+    )
+    time.sleep(0.05)
+    release.set()
+    for thread in bad + good:
+        thread.join()
+    assert "error" in bad_results[0]
+    assert good_results == [make_quest("Свой ключ")]